@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+#
+# Copyright 2021.
+# ozora-ogino
+
+"""Compare the legacy loop based association with sort.associate_detections_to_trackers.
+
+Usage:
+    python -m benchmarks.bench_associate --sizes 10 100 1000
+"""
+
+import os
+import sys
+import time
+from argparse import ArgumentParser
+from typing import List
+
+import numpy as np
+from scipy.optimize import linear_sum_assignment as linear_assignment
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+from sort import associate_detections_to_trackers, iou
+
+from .synthetic import synthetic_boxes
+
+
+def _legacy(detections, trackers, iou_threshold=0.3):
+    """associate_detections_to_trackers as it was implemented before vectorisation."""
+    iou_matrix = np.zeros((len(detections), len(trackers)), dtype=np.float32)
+    for d, det in enumerate(detections):
+        for t, trk in enumerate(trackers):
+            iou_matrix[d, t] = iou(det, trk)
+
+    matched_indices = np.transpose(np.asarray(linear_assignment(-iou_matrix)))
+    unmatched_detections = [d for d in range(len(detections)) if d not in matched_indices[:, 0]]
+    unmatched_trackers = [t for t in range(len(trackers)) if t not in matched_indices[:, 1]]
+    matches = []
+    for m in matched_indices:
+        if iou_matrix[m[0], m[1]] < iou_threshold:
+            unmatched_detections.append(m[0])
+            unmatched_trackers.append(m[1])
+        else:
+            matches.append(m.reshape(1, 2))
+    matches = np.concatenate(matches, axis=0) if matches else np.empty((0, 2), dtype=int)
+    return matches, np.array(unmatched_detections), np.array(unmatched_trackers)
+
+
+def _measure(func, repeat: int) -> float:
+    start = time.perf_counter()
+    for _ in range(repeat):
+        func()
+    return (time.perf_counter() - start) / repeat * 1000
+
+
+def _main(sizes: List[int], repeat: int) -> None:
+    for size in sizes:
+        dets = synthetic_boxes(size)
+        # Trackers are the detections of the previous frame, slightly moved and shuffled.
+        trks = synthetic_boxes(size, seed=1)[:, :4] * 0.02 + dets[:, :4] * 0.98
+        trks = trks[np.random.default_rng(2).permutation(size)]
+
+        expect = _legacy(dets, trks)
+        result = associate_detections_to_trackers(dets, trks)
+        identical = all(np.array_equal(e, r) for e, r in zip(expect, result))
+
+        legacy = _measure(lambda: _legacy(dets, trks), repeat)
+        vectorised = _measure(lambda: associate_detections_to_trackers(dets, trks), repeat)
+        print(
+            f"{size:5d} boxes: legacy {legacy:9.3f} ms  vectorised {vectorised:9.3f} ms  "
+            f"x{legacy / vectorised:6.1f}  identical={identical}"
+        )
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser()
+    parser.add_argument("--sizes", nargs="+", default=[10, 30, 100, 300, 1000], type=int)
+    parser.add_argument("--repeat", default=3, type=int)
+    args = parser.parse_args()
+    _main(**vars(args))
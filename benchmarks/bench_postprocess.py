@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+#
+# Copyright 2021.
+# ozora-ogino
+
+"""Compare the legacy postprocess + NMS path with Detect.postprocess_dets.
+
+Usage:
+    # Without a model, Detect runs on a stub interpreter.
+    python -m benchmarks.bench_postprocess
+    python -m benchmarks.bench_postprocess --model ./models/yolov5n6-fp16.tflite
+"""
+
+import os
+import sys
+import time
+from argparse import ArgumentParser
+from typing import Optional
+
+import cv2
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+from detect import Detect
+
+from .stub import stub_detect
+
+
+def _legacy(output_data: np.ndarray, conf_thr: float, iou_thr: float, frame_shape) -> np.ndarray:
+    """Postprocess, NMS and person filtering as they were implemented before postprocess_dets."""
+    output_data = output_data[0]
+    boxes = output_data[..., :4]
+    conf = np.squeeze(output_data[..., 4:5], axis=1)
+    cls = np.squeeze(np.argmax(output_data[..., 5:], axis=1).astype(np.float32).reshape(-1, 1), axis=1)
+    idxs = np.where(conf > conf_thr)
+    boxes, cls, conf = boxes[idxs], cls[idxs], conf[idxs]
+
+    idx = cv2.dnn.NMSBoxes(boxes, conf, conf_thr, iou_thr)
+    boxes, conf, cls = boxes[idx], conf[idx], cls[idx]
+    person_idx = np.where(cls == 0)[0]
+    boxes, conf = boxes[person_idx], conf[person_idx]
+
+    x, y, w, h = boxes[..., 0], boxes[..., 1], boxes[..., 2], boxes[..., 3]
+    boxes = np.array([x - w / 2, y - h / 2, x + w / 2, y + h / 2]).transpose((1, 0))
+    H, W = frame_shape[:2]
+    return np.concatenate([boxes * np.array([W, H, W, H]), conf.reshape(-1, 1)], axis=1)
+
+
+def _synthetic_output(num_anchors: int, num_objects: int, seed: int = 0) -> np.ndarray:
+    """YOLOv5 like output with `num_objects` confident anchors and low objectness elsewhere."""
+    rng = np.random.default_rng(seed)
+    output = rng.random((1, num_anchors, 85), dtype=np.float32)
+    output[0, :, 2:4] *= 0.1
+    output[0, :, 4] *= 0.1
+    hits = rng.choice(num_anchors, num_objects, replace=False)
+    output[0, hits, 4] = rng.uniform(0.5, 1.0, num_objects)
+    output[0, hits, 5:] *= 0.1
+    output[0, hits, 5 + rng.integers(0, 2, num_objects)] = 0.9
+    return output
+
+
+def _main(model: Optional[str], num_anchors: int, num_objects: int, repeat: int) -> None:
+    conf_thr, iou_thr, frame_shape = 0.2, 0.2, (1080, 1920, 3)
+    detect = (
+        Detect(model, conf_thr, classes=[0], iou_thr=iou_thr)
+        if model
+        else stub_detect(conf_thr, classes=[0], iou_thr=iou_thr)
+    )
+    output = _synthetic_output(num_anchors, num_objects)
+
+    paths = {
+        "legacy": lambda: _legacy(output, conf_thr, iou_thr, frame_shape),
+        "fused": lambda: detect.postprocess_dets(output, frame_shape),
+    }
+    print(f"{num_anchors} anchors, {num_objects} confident anchors, {repeat} runs")
+    for name, func in paths.items():
+        func()
+        start = time.perf_counter()
+        for _ in range(repeat):
+            func()
+        latency = (time.perf_counter() - start) / repeat * 1000
+        print(f"{name:>8}: {latency:8.3f} ms/frame")
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser()
+    parser.add_argument("--model", default=None, help="Path to tflite weight. A stub is used if omitted.")
+    parser.add_argument("--num-anchors", default=25200, type=int)
+    parser.add_argument("--num-objects", default=200, type=int)
+    parser.add_argument("--repeat", default=200, type=int)
+    args = parser.parse_args()
+    _main(**vars(args))
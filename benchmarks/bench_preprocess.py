@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+#
+# Copyright 2021.
+# ozora-ogino
+
+"""Compare the legacy and zero-allocation Detect.preprocess paths.
+
+Usage:
+    # Without a model, Detect runs on a stub interpreter.
+    python -m benchmarks.bench_preprocess
+    python -m benchmarks.bench_preprocess --model ./models/yolov5n6-fp16.tflite
+"""
+
+import os
+import sys
+import time
+import tracemalloc
+from argparse import ArgumentParser
+from typing import Callable, Optional
+
+import cv2
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+from detect import Detect
+
+from .stub import stub_detect
+
+
+def _legacy_preprocess(detect: Detect, img: np.ndarray) -> np.ndarray:
+    """Preprocess as it was implemented before the zero-allocation path."""
+    img = cv2.resize(img, (detect.height, detect.width))
+    img = img[:, :, [2, 1, 0]]
+    img = img / 255.0
+    img = np.expand_dims(img, axis=0)
+    return img.astype(np.float32)
+
+
+def _measure(func: Callable, img: np.ndarray, repeat: int):
+    """Return mean latency in ms and peak allocated MiB per call."""
+    func(img)
+    start = time.perf_counter()
+    for _ in range(repeat):
+        func(img)
+    latency = (time.perf_counter() - start) / repeat * 1000
+
+    tracemalloc.start()
+    func(img)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return latency, peak / 2**20
+
+
+def _main(model: Optional[str], width: int, height: int, repeat: int) -> None:
+    detect = Detect(model, 0.2) if model else stub_detect(0.2)
+    img = np.random.randint(0, 255, size=(height, width, 3), dtype=np.uint8)
+    buffer = np.empty((1, detect.width, detect.height, 3), dtype=np.float32)
+
+    paths = {
+        "legacy": lambda x: _legacy_preprocess(detect, x),
+        "zero-alloc": lambda x: detect.preprocess(x, out=buffer),
+    }
+    print(f"Input {width}x{height} -> model {detect.height}x{detect.width}, {repeat} runs")
+    for name, func in paths.items():
+        latency, peak = _measure(func, img, repeat)
+        print(f"{name:>12}: {latency:8.3f} ms/frame  {peak:8.3f} MiB allocated")
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser()
+    parser.add_argument("--model", default=None, help="Path to tflite weight. A stub is used if omitted.")
+    parser.add_argument("--width", default=1920, type=int)
+    parser.add_argument("--height", default=1080, type=int)
+    parser.add_argument("--repeat", default=200, type=int)
+    args = parser.parse_args()
+    _main(**vars(args))
@@ -0,0 +1,197 @@
+#!/usr/bin/env python3
+#
+# Copyright 2021.
+# ozora-ogino
+
+"""Benchmark suite of the detect/track pipeline on synthetic crowds.
+
+No model, GPU or network is needed: Detect runs with StubInterpreter, which returns
+canned YOLOv5 outputs built from the synthetic crowds.
+
+benchmarks/baseline.json is a reference run with the default --repeat and --num-frames.
+Timings depend on the machine, so save a baseline on your machine before comparing.
+
+Usage:
+    # Save a baseline, e.g. on the main branch. benchmarks/baseline.json was created with this command.
+    python -m benchmarks.run --output benchmarks/baseline.json
+    # Compare with the baseline on the same machine, exit with 1 if a case is more than 30% slower.
+    python -m benchmarks.run --baseline benchmarks/baseline.json --tolerance 0.3
+    # Quick smoke run.
+    python -m benchmarks.run --repeat 3 --num-frames 5
+"""
+
+import json
+import os
+import platform
+import sys
+import time
+from argparse import ArgumentParser
+from typing import Callable, Dict, List, Optional
+
+import cv2
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+from detection import detect_person
+from sort import Sort, associate_detections_to_trackers
+from tracker import Tracker
+
+from .stub import stub_detect
+from .synthetic import crowd, frame, yolo_output
+
+RESOLUTIONS = {"720p": (1280, 720), "1080p": (1920, 1080), "2160p": (3840, 2160)}
+DENSITIES = [10, 50, 200]
+
+
+def _time(func: Callable[[], None], repeat: int, warmup: int = 2) -> Dict[str, float]:
+    """Return median, mean and min latency of func in milliseconds."""
+    for _ in range(warmup):
+        func()
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        samples.append((time.perf_counter() - start) * 1000)
+    return {"median_ms": float(np.median(samples)), "mean_ms": float(np.mean(samples)), "min_ms": min(samples)}
+
+
+def _time_sequence(make_step: Callable[[], Callable[[], None]], num_frames: int, repeat: int) -> Dict[str, float]:
+    """Time stateful steps (e.g. Sort.update over a video) per frame, starting from a fresh state each repeat."""
+    samples = []
+    for _ in range(repeat):
+        step = make_step()
+        start = time.perf_counter()
+        for _ in range(num_frames):
+            step()
+        samples.append((time.perf_counter() - start) * 1000 / num_frames)
+    return {"median_ms": float(np.median(samples)), "mean_ms": float(np.mean(samples)), "min_ms": min(samples)}
+
+
+def bench_detect(repeat: int) -> Dict[str, Dict]:
+    results = {}
+    detect = stub_detect(classes=[0])
+    out = np.empty((1, detect.width, detect.height, 3), dtype=np.float32)
+    for name, (width, height) in RESOLUTIONS.items():
+        img = frame(width, height)
+        results[f"preprocess/{name}"] = _time(lambda: detect.preprocess(img, out=out), repeat)
+
+    shape = (1080, 1920, 3)
+    for num in DENSITIES:
+        dets = next(crowd(num, 1))
+        output = yolo_output(dets, shape)
+        results[f"postprocess_nms/{num}"] = _time(lambda: detect.postprocess_dets(output, shape), repeat)
+
+        person_detect = stub_detect(classes=[0], outputs=[output])
+        img = frame(*RESOLUTIONS["1080p"])
+        results[f"detect_person/{num}"] = _time(lambda: detect_person(person_detect, img), repeat)
+
+    # Quantized model: integer input without float conversion, dequantization of candidate rows only.
+    int8 = stub_detect(classes=[0], quantization="int8")
+    out = np.empty((1, int8.width, int8.height, 3), dtype=np.int8)
+    img = frame(*RESOLUTIONS["1080p"])
+    results["preprocess_int8/1080p"] = _time(lambda: int8.preprocess(img, out=out), repeat)
+    dets = next(crowd(DENSITIES[-1], 1))
+    int8.interpreter.outputs = [yolo_output(dets, shape)]
+    int8.interpreter.invoke()
+    output = int8.interpreter.get_tensor(int8.output_details[0]["index"])
+    results[f"postprocess_nms_int8/{DENSITIES[-1]}"] = _time(lambda: int8.postprocess_dets(output, shape), repeat)
+
+    # Only a band around the counting line, and the whole frame in tiles merged by cross-tile NMS.
+    output = yolo_output(next(crowd(DENSITIES[-1], 1)), (640, 640, 3))
+    for name, kwargs in [("roi", dict(regions=[(0, 350, 1920, 650)])), ("tiles", dict(tile_size=640))]:
+        cropped = stub_detect(classes=[0], outputs=[output], **kwargs)
+        results[f"detect_{name}/1080p"] = _time(lambda: detect_person(cropped, img), repeat)
+    return results
+
+
+def bench_track(repeat: int, num_frames: int) -> Dict[str, Dict]:
+    results = {}
+    for num in DENSITIES:
+        dets = list(crowd(num, num_frames))
+        # Trackers are the detections of the previous frame.
+        trks = dets[0][:, :4] + np.random.default_rng(0).normal(0, 2, size=(len(dets[0]), 4))
+        results[f"associate/{num}"] = _time(lambda: associate_detections_to_trackers(dets[1], trks), repeat)
+
+        def make_sort_step():
+            sort, frames = Sort(), iter(dets)
+            return lambda: sort.update(next(frames))
+
+        results[f"sort_update/{num}"] = _time_sequence(make_sort_step, num_frames, repeat)
+
+        img = frame(*RESOLUTIONS["1080p"])
+
+        def make_tracker_step(draw: bool):
+            tracker, frames = Tracker([(0, 500), (1920, 500)], {"total": None}), iter(dets)
+            if draw:
+                return lambda: tracker.update(img, next(frames))
+            return lambda: tracker.track(next(frames))
+
+        results[f"tracker_update/{num}"] = _time_sequence(lambda: make_tracker_step(True), num_frames, repeat)
+        results[f"tracker_track/{num}"] = _time_sequence(lambda: make_tracker_step(False), num_frames, repeat)
+    return results
+
+
+def compare(results: Dict[str, Dict], baseline: Dict[str, Dict], tolerance: float) -> List[str]:
+    """Print the ratio to the baseline of every case and return the names of regressed cases."""
+    regressions = []
+    for name, result in results.items():
+        if name not in baseline:
+            print(f"{name:<24} {result['median_ms']:10.3f} ms  (new)")
+            continue
+        ratio = result["median_ms"] / max(baseline[name]["median_ms"], 1e-9)
+        regressed = ratio > 1 + tolerance
+        if regressed:
+            regressions.append(name)
+        mark = "REGRESSION" if regressed else ""
+        print(
+            f"{name:<24} {result['median_ms']:10.3f} ms  "
+            f"baseline {baseline[name]['median_ms']:10.3f} ms  x{ratio:5.2f} {mark}"
+        )
+    return regressions
+
+
+def _main(output: Optional[str], baseline: Optional[str], tolerance: float, repeat: int, num_frames: int) -> int:
+    cv2.setNumThreads(1)
+    results = {}
+    results.update(bench_detect(repeat))
+    results.update(bench_track(repeat, num_frames))
+
+    report = {
+        "meta": {
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "opencv": cv2.__version__,
+            "machine": platform.machine(),
+            "processor": platform.processor(),
+            "repeat": repeat,
+            "num_frames": num_frames,
+        },
+        "results": results,
+    }
+    if output:
+        with open(output, "w") as f:
+            json.dump(report, f, indent=2)
+
+    if baseline is None:
+        for name, result in results.items():
+            print(f"{name:<24} {result['median_ms']:10.3f} ms")
+        return 0
+
+    with open(baseline) as f:
+        regressions = compare(results, json.load(f)["results"], tolerance)
+    if regressions:
+        print(f"{len(regressions)} regression(s): {', '.join(regressions)}")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser()
+    parser.add_argument("--output", default=None, help="Path to save results as JSON.")
+    parser.add_argument("--baseline", default=None, help="Path to results JSON to compare with.")
+    parser.add_argument("--tolerance", default=0.3, type=float, help="Allowed slowdown ratio, 0.3 means 30%%.")
+    parser.add_argument("--repeat", default=20, type=int)
+    parser.add_argument("--num-frames", default=30, type=int)
+    args = parser.parse_args()
+    sys.exit(_main(**vars(args)))
@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+#
+# Copyright 2021.
+# ozora-ogino
+
+"""Stub of the tflite Interpreter returning canned YOLOv5 outputs, so Detect runs without a model."""
+
+import os
+import sys
+from typing import List, Optional
+from unittest import mock
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+import detect as detect_module
+from detect import Detect
+
+from .synthetic import NUM_CLASSES
+
+
+class StubInterpreter(object):
+    """Implement the part of tflite_runtime.interpreter.Interpreter used by Detect.
+
+    invoke fills the output with the canned outputs in `outputs`, one per batch element,
+    cycling over them. The output is empty (all zeros) if there is no canned output.
+
+    Args:
+        input_size (int): Height and width of the model input.
+        num_anchors (int): Number of output rows.
+        quantization (Optional[str]): "uint8" or "int8" to emulate a quantized model, whose input and
+                                      output are quantized like the YOLOv5 int8 export.
+    """
+
+    def __init__(
+        self,
+        model_file: Optional[str] = None,
+        input_size: int = 640,
+        num_anchors: int = 25200,
+        quantization: Optional[str] = None,
+        **kwargs,
+    ):
+        self.input_size = input_size
+        self.num_anchors = num_anchors
+        self.outputs: List[np.ndarray] = []
+        self._next = 0
+        if quantization is None:
+            self.dtype, self.input_quantization, self.output_quantization = np.float32, (0.0, 0), (0.0, 0)
+        else:
+            self.dtype = np.dtype(quantization).type
+            zero_point = -128 if self.dtype == np.int8 else 0
+            self.input_quantization, self.output_quantization = (1 / 255, zero_point), (1.2 / 255, zero_point)
+        self._input = np.zeros((1, input_size, input_size, 3), dtype=self.dtype)
+        self._output = np.zeros((1, num_anchors, 5 + NUM_CLASSES), dtype=self.dtype)
+
+    def allocate_tensors(self) -> None:
+        self._output = np.zeros((len(self._input), self.num_anchors, 5 + NUM_CLASSES), dtype=self.dtype)
+
+    def get_input_details(self):
+        return [
+            {
+                "index": 0,
+                "shape": np.array(self._input.shape),
+                "dtype": self.dtype,
+                "quantization": self.input_quantization,
+            }
+        ]
+
+    def get_output_details(self):
+        return [
+            {
+                "index": 1,
+                "shape": np.array(self._output.shape),
+                "dtype": self.dtype,
+                "quantization": self.output_quantization,
+            }
+        ]
+
+    def resize_tensor_input(self, index: int, shape: List[int], strict: bool = False) -> None:
+        self._input = np.zeros(shape, dtype=self.dtype)
+
+    def tensor(self, index: int):
+        return lambda: self._input if index == 0 else self._output
+
+    def set_tensor(self, index: int, value: np.ndarray) -> None:
+        self._input[...] = value
+
+    def invoke(self) -> None:
+        for i in range(len(self._output)):
+            if self.outputs:
+                output = self.outputs[self._next % len(self.outputs)][0]
+                if self.dtype != np.float32:
+                    scale, zero_point = self.output_quantization
+                    info = np.iinfo(self.dtype)
+                    output = np.clip(np.round(output / scale) + zero_point, info.min, info.max)
+                self._output[i] = output
+                self._next += 1
+
+    def get_tensor(self, index: int) -> np.ndarray:
+        return (self._input if index == 0 else self._output).copy()
+
+
+def stub_detect(
+    conf_thr: float = 0.2,
+    input_size: int = 640,
+    num_anchors: int = 25200,
+    outputs=None,
+    quantization: Optional[str] = None,
+    **kwargs,
+) -> Detect:
+    """Create Detect backed by StubInterpreter. kwargs are passed to Detect."""
+
+    def factory(model_file, *args, **interpreter_kwargs):
+        interpreter = StubInterpreter(
+            model_file, input_size=input_size, num_anchors=num_anchors, quantization=quantization
+        )
+        interpreter.outputs = list(outputs or [])
+        return interpreter
+
+    with mock.patch.object(detect_module, "Interpreter", new=factory):
+        return Detect("stub.tflite", conf_thr, **kwargs)
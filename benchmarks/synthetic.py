@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+#
+# Copyright 2021.
+# ozora-ogino
+
+"""Deterministic synthetic crowds and YOLOv5 outputs for benchmarks."""
+
+from typing import Iterator, Tuple
+
+import numpy as np
+
+NUM_CLASSES = 80
+
+
+def synthetic_boxes(num: int, width: int = 1920, height: int = 1080, seed: int = 0) -> np.ndarray:
+    """Random person sized boxes like [x1, y1, x2, y2, score]."""
+    rng = np.random.default_rng(seed)
+    scale = height / 1080
+    xy = rng.uniform([0, 0], [width - 60 * scale, height - 150 * scale], size=(num, 2))
+    wh = rng.uniform([20, 60], [60, 150], size=(num, 2)) * scale
+    return np.concatenate([xy, xy + wh, rng.uniform(0.3, 1.0, size=(num, 1))], axis=1)
+
+
+def crowd(num: int, num_frames: int, width: int = 1920, height: int = 1080, seed: int = 0) -> Iterator[np.ndarray]:
+    """Yield detections [x1, y1, x2, y2, score] of people walking with constant velocity.
+
+    About 5% of the people are missed in each frame, like a real detector.
+    """
+    rng = np.random.default_rng(seed)
+    boxes = synthetic_boxes(num, width, height, seed)
+    velocity = rng.normal(0, 3, size=(num, 2))
+    for i in range(num_frames):
+        dets = boxes.copy()
+        dets[:, [0, 2]] += velocity[:, :1] * i
+        dets[:, [1, 3]] += velocity[:, 1:] * i
+        dets[:, :4] += rng.normal(0, 1, size=(num, 4))
+        yield dets[rng.random(num) > 0.05]
+
+
+def yolo_output(
+    dets: np.ndarray, frame_shape: Tuple[int], num_anchors: int = 25200, duplicates: int = 3, seed: int = 0
+) -> np.ndarray:
+    """Return a YOLOv5 like output (1, num_anchors, 85) which contains the person boxes of dets.
+
+    Every box is predicted by `duplicates` anchors with a small jitter, so NMS has work to do.
+    Other anchors have low objectness and random class scores.
+    """
+    rng = np.random.default_rng(seed)
+    height, width = frame_shape[:2]
+    output = rng.random((num_anchors, 5 + NUM_CLASSES), dtype=np.float32)
+    output[:, 2:4] *= 0.1
+    output[:, 4] *= 0.05
+
+    boxes = np.repeat(dets[:, :4], duplicates, axis=0)
+    boxes = boxes + rng.normal(0, 2, size=boxes.shape)
+    rows = rng.choice(num_anchors, len(boxes), replace=False)
+    xywh = np.stack(
+        [
+            (boxes[:, 0] + boxes[:, 2]) / 2 / width,
+            (boxes[:, 1] + boxes[:, 3]) / 2 / height,
+            (boxes[:, 2] - boxes[:, 0]) / width,
+            (boxes[:, 3] - boxes[:, 1]) / height,
+        ],
+        axis=1,
+    )
+    output[rows, :4] = xywh
+    output[rows, 4] = rng.uniform(0.5, 1.0, len(rows))
+    output[rows, 5:] *= 0.05
+    output[rows, 5] = rng.uniform(0.7, 1.0, len(rows))
+    return output[None]
+
+
+def frame(width: int = 1920, height: int = 1080, seed: int = 0) -> np.ndarray:
+    """Random BGR frame."""
+    return np.random.default_rng(seed).integers(0, 255, size=(height, width, 3), dtype=np.uint8)
@@ -3,42 +3,162 @@
 # Copyright 2021.
 # ozora-ogino
 
+import io
 import os
+import shutil
+import sys
 from argparse import ArgumentParser
+from typing import Optional, Tuple
 
 import cv2
+import numpy as np
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
 
-def _main(video: str, save_dir: str, limit_frames: int) -> None:
+from archive import EXTENSION, FrameArchiveWriter
+
+
+class _JpgWriter(object):
+    """Save frames as jpg files in a directory."""
+
+    def __init__(self, save_dir: str):
+        if not os.path.exists(save_dir):
+            os.mkdir(save_dir)
+        self.save_dir = save_dir
+        self.count = 0
+
+    def write(self, image: np.ndarray) -> None:
+        cv2.imwrite(os.path.join(self.save_dir, f"frame{str(self.count).zfill(5)}.jpg"), image)
+        self.count += 1
+
+    def close(self) -> None:
+        pass
+
+
+class _ArchiveWriter(object):
+    """Save frames as jpg in a single frame archive."""
+
+    def __init__(self, path: str):
+        self.writer = FrameArchiveWriter(path)
+
+    def write(self, image: np.ndarray) -> None:
+        self.writer.write(cv2.imencode(".jpg", image)[1].tobytes())
+
+    def close(self) -> None:
+        self.writer.close()
+
+
+class _NpyWriter(object):
+    """Save raw frames in a .npy file which can be memory mapped.
+
+    The file is created for `capacity` frames and shrunk to the number of written frames on close.
+    """
+
+    def __init__(self, path: str, capacity: int):
+        self.path = path
+        self.capacity = capacity
+        self.array = None
+        self.count = 0
+
+    def write(self, image: np.ndarray) -> None:
+        if self.array is None:
+            self.array = np.lib.format.open_memmap(
+                self.path, mode="w+", dtype=np.uint8, shape=(self.capacity,) + image.shape
+            )
+        self.array[self.count] = image
+        self.count += 1
+
+    def close(self) -> None:
+        if self.array is None:
+            np.save(self.path, np.empty((0, 0, 0, 3), dtype=np.uint8))
+            return
+        shape = (self.count,) + self.array.shape[1:]
+        offset = self.array.offset
+        self.array.flush()
+        del self.array
+        if self.count == self.capacity:
+            return
+
+        # Rewrite the header with the actual number of frames and drop the unused frames.
+        header = io.BytesIO()
+        np.lib.format.write_array_header_1_0(header, {"descr": "|u1", "fortran_order": False, "shape": shape})
+        size = int(np.prod(shape))
+        if len(header.getvalue()) == offset:
+            with open(self.path, "r+b") as f:
+                f.write(header.getvalue())
+                f.truncate(offset + size)
+            return
+        # The header length changed, copy the frames to a new file.
+        with open(self.path, "rb") as src, open(self.path + ".tmp", "wb") as dst:
+            dst.write(header.getvalue())
+            src.seek(offset)
+            remaining = size
+            while remaining > 0:
+                chunk = src.read(min(remaining, 1 << 24))
+                dst.write(chunk)
+                remaining -= len(chunk)
+        shutil.move(self.path + ".tmp", self.path)
+
+
+def _main(video: str, save_dir: str, limit_frames: int, fmt: str, size: Optional[Tuple[int]]) -> None:
     """ "Convert video to images.
 
     Args:
         video(str): Path to video file.
-        save_dir(str): Directory to save images.
-        limit_frames(int): Max number of frames to save.
+        save_dir(str): Directory to save images. Packed formats are saved as <save_dir>.frames or <save_dir>.npy.
+        limit_frames(int): Max number of frames to save, 0 to save all frames.
+        fmt(str): "jpg" for one file per frame, "archive" for a single frame archive of jpg frames,
+                  or "npy" for raw frames which can be memory mapped.
+        size(Optional[Tuple[int]]): Resize frames to (width, height).
     """
     if not os.path.exists(video):
         raise Exception("Video file not found.")
 
-    if not os.path.exists(save_dir):
-        os.mkdir(save_dir)
-
     vidcap = cv2.VideoCapture(video)
+    total_frames = int(vidcap.get(cv2.CAP_PROP_FRAME_COUNT))
+    limit_frames = limit_frames or total_frames
+    save_dir = save_dir.rstrip("/")
+    if fmt == "jpg":
+        writer, output = _JpgWriter(save_dir), save_dir
+    elif fmt == "archive":
+        output = save_dir + EXTENSION
+        writer = _ArchiveWriter(output)
+    else:
+        # The npy file is allocated for the number of frames reported by the container.
+        limit_frames = min(limit_frames, total_frames) if total_frames > 0 else limit_frames
+        if limit_frames <= 0:
+            raise ValueError("The number of frames is unknown, set --limit-frames.")
+        output = save_dir + ".npy"
+        writer = _NpyWriter(output, limit_frames)
+
     success, image = vidcap.read()
     count = 0
 
     # Video to images.
     while success and count < limit_frames:
-        cv2.imwrite(os.path.join(save_dir, f"frame{str(count).zfill(5)}.jpg"), image)
+        if size is not None:
+            image = cv2.resize(image, size, interpolation=cv2.INTER_AREA)
+        writer.write(image)
         success, image = vidcap.read()
-        print("Read a new frame: ", success)
         count += 1
+        if count % 100 == 0:
+            print(f"Saved {count} frames.")
+    writer.close()
+    vidcap.release()
+    print(f"Saved {count} frames to {output}")
+
+
+def _size(value: str) -> Tuple[int]:
+    width, height = value.lower().split("x")
+    return int(width), int(height)
 
 
 if __name__ == "__main__":
     parser = ArgumentParser()
     parser.add_argument("--video", required=True)
     parser.add_argument("--save-dir", default="./data/frames/")
-    parser.add_argument("--limit-frames", default=800, type=int)
+    parser.add_argument("--limit-frames", default=800, type=int, help="Max number of frames, 0 for all frames.")
+    parser.add_argument("--format", dest="fmt", choices=["jpg", "archive", "npy"], default="jpg")
+    parser.add_argument("--size", type=_size, default=None, help="Resize frames to WIDTHxHEIGHT, e.g. 640x360.")
     args = parser.parse_args()
     _main(**vars(args))
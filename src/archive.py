@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+#
+# Copyright 2021.
+# ozora-ogino
+
+"""Frame archive: encoded frames packed in a single file.
+
+Layout:
+    header:  magic (8 bytes), number of frames (uint64), offset of the index (uint64)
+    frames:  encoded frames (e.g. JPEG) one after another
+    index:   (number of frames, 2) uint64 array of [offset, length] of each frame
+"""
+
+import mmap
+import struct
+from typing import BinaryIO, List
+
+import numpy as np
+
+MAGIC = b"FRMARC01"
+HEADER = struct.Struct("<8sQQ")
+EXTENSION = ".frames"
+
+
+class FrameArchiveWriter(object):
+    """Append encoded frames to a frame archive.
+
+    Args:
+        path (str): Path to the archive to create.
+    """
+
+    def __init__(self, path: str):
+        self.file: BinaryIO = open(path, "wb")
+        self.file.write(HEADER.pack(MAGIC, 0, 0))
+        self.index: List[List[int]] = []
+
+    def write(self, data: bytes) -> None:
+        """Append an encoded frame, e.g. the output of cv2.imencode."""
+        self.index.append([self.file.tell(), len(data)])
+        self.file.write(data)
+
+    def close(self) -> None:
+        """Write the index and close the file."""
+        index_offset = self.file.tell()
+        self.file.write(np.asarray(self.index, dtype="<u8").reshape(-1, 2).tobytes())
+        self.file.seek(0)
+        self.file.write(HEADER.pack(MAGIC, len(self.index), index_offset))
+        self.file.close()
+
+    def __enter__(self) -> "FrameArchiveWriter":
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+
+class FrameArchive(object):
+    """Read encoded frames of a frame archive from a memory map, without copying them.
+
+    Args:
+        path (str): Path to the archive.
+    """
+
+    def __init__(self, path: str):
+        with open(path, "rb") as f:
+            self.mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, count, index_offset = HEADER.unpack_from(self.mmap)
+        if magic != MAGIC:
+            raise ValueError(f"{path} is not a frame archive.")
+        self.index = np.frombuffer(self.mmap, dtype="<u8", count=count * 2, offset=index_offset).reshape(-1, 2)
+
+    def __len__(self) -> int:
+        return len(self.index)
+
+    def __getitem__(self, i: int) -> np.ndarray:
+        """Return the encoded frame i as a uint8 view of the memory map, to pass to cv2.imdecode."""
+        offset, length = self.index[i]
+        return np.frombuffer(self.mmap, dtype=np.uint8, count=int(length), offset=int(offset))
+
+    def close(self) -> None:
+        # Views returned by __getitem__ keep the memory map alive until they are released.
+        self.index = None
+        try:
+            self.mmap.close()
+        except BufferError:
+            pass
@@ -0,0 +1,310 @@
+#!/usr/bin/env python3
+#
+# Copyright 2021.
+# ozora-ogino
+
+"""Counting of line crossings and zone entries/exits for all tracks at once.
+
+Configuration file (JSON):
+    {
+        "lines": [
+            {
+                "name": "entrance",
+                "points": [[0, 500], [1920, 500]],
+                "directions": {"total": null, "inside": "bottom", "outside": "top"}
+            }
+        ],
+        "zones": [
+            {"name": "counter", "points": [[100, 100], [500, 100], [500, 400], [100, 400]]}
+        ]
+    }
+
+Directions are keys of utils.direction_config, or null to count both ways.
+"""
+
+import json
+from typing import Dict, List, NamedTuple, Optional, Sequence, Tuple
+
+import numpy as np
+
+from utils import direction_config
+
+
+class CountEvent(NamedTuple):
+    """A line crossing or a zone entry/exit of a track.
+
+    kind is "line", "enter" or "exit". key is the direction key of the line rule, or None for zones.
+    dwell is the number of frames spent in the zone for "exit", None otherwise.
+    """
+
+    kind: str
+    name: str
+    key: Optional[str]
+    track_id: int
+    frame_index: int
+    dwell: Optional[int] = None
+
+
+def _direction_code(direction: Optional[Tuple[bool]]) -> Tuple[int, int]:
+    """Encode a direction like (True, None) as (1, -1). -1 matches any movement."""
+    if direction is None:
+        return -1, -1
+    return tuple(-1 if d is None else int(d) for d in direction)
+
+
+def _ccw(p: np.ndarray, q: np.ndarray, r: np.ndarray) -> np.ndarray:
+    """utils.ccw on broadcast arrays of points like (..., 2)."""
+    return (r[..., 1] - p[..., 1]) * (q[..., 0] - p[..., 0]) > (q[..., 1] - p[..., 1]) * (r[..., 0] - p[..., 0])
+
+
+class Line(object):
+    """A counting line with direction rules.
+
+    Args:
+        name (str): Name of the line.
+        start (Tuple[int]): First end point.
+        end (Tuple[int]): Second end point.
+        directions (Dict[str, Optional[Tuple[bool]]]): Count rules as {key: direction}, where direction is
+                                                       a value of utils.direction_config, None for both ways.
+    """
+
+    def __init__(self, name: str, start: Tuple[int], end: Tuple[int], directions: Dict[str, Optional[Tuple[bool]]]):
+        self.name = name
+        self.start = tuple(int(v) for v in start)
+        self.end = tuple(int(v) for v in end)
+        self.directions = directions
+        self.counter = {key: 0 for key in directions.keys()}
+
+
+class Zone(object):
+    """A polygon zone counting entries and exits of tracks, and how long they stay in frames.
+
+    Args:
+        name (str): Name of the zone.
+        points (Sequence[Tuple[int]]): Vertices of the polygon.
+    """
+
+    def __init__(self, name: str, points: Sequence[Tuple[int]]):
+        if len(points) < 3:
+            raise ValueError(f"Zone {name} needs at least 3 points.")
+        self.name = name
+        self.points = np.asarray(points, dtype=np.float64)
+        self.entered = 0
+        self.exited = 0
+        self.occupancy = 0
+        # Dwell of tracks which left the zone, in frames.
+        self.dwell_count = 0
+        self.dwell_total = 0
+        self.dwell_max = 0
+
+    @property
+    def counter(self) -> Dict[str, int]:
+        return {"entered": self.entered, "exited": self.exited, "inside": self.occupancy}
+
+    def mean_dwell(self) -> float:
+        """Mean number of frames spent in the zone by tracks which left it."""
+        return self.dwell_total / self.dwell_count if self.dwell_count else 0.0
+
+
+class CountingEngine(object):
+    """Test motions of all tracks against all lines and zones with a few array operations.
+
+    Args:
+        lines (List[Line]): Counting lines.
+        zones (List[Zone]): Counting zones.
+    """
+
+    def __init__(self, lines: List[Line], zones: Optional[List[Zone]] = None):
+        self.lines = lines
+        self.zones = zones or []
+
+        self._starts = np.array([line.start for line in lines], dtype=np.int64).reshape(-1, 2)
+        self._ends = np.array([line.end for line in lines], dtype=np.int64).reshape(-1, 2)
+        # One rule per (line, direction key).
+        self._rules = [(i, key) for i, line in enumerate(lines) for key in line.directions.keys()]
+        codes = np.array([_direction_code(lines[i].directions[key]) for i, key in self._rules], dtype=np.int64).reshape(
+            -1, 2
+        )
+        self._rule_line = np.array([i for i, _ in self._rules], dtype=np.int64)
+        self._rule_x, self._rule_y = codes[:, 0], codes[:, 1]
+
+        # Edges of all zones, and the zone of each edge.
+        self._edge_a = np.concatenate([zone.points for zone in self.zones]) if self.zones else np.empty((0, 2))
+        self._edge_b = (
+            np.concatenate([np.roll(zone.points, -1, axis=0) for zone in self.zones])
+            if self.zones
+            else np.empty((0, 2))
+        )
+        edge_zone = np.repeat(np.arange(len(self.zones)), [len(zone.points) for zone in self.zones])
+        self._edge_zone = np.eye(len(self.zones), dtype=np.int64)[edge_zone]
+        # Tracks inside at least one zone: sorted ids, inside flags (K, Z) and frame of entry (K, Z).
+        self._zone_ids = np.empty(0, dtype=np.int64)
+        self._zone_inside = np.zeros((0, len(self.zones)), dtype=bool)
+        self._zone_since = np.zeros((0, len(self.zones)), dtype=np.int64)
+
+    @property
+    def counter(self) -> Dict[str, int]:
+        """Counts of all lines and zones as {"line:key": count, "zone:entered": count, ...}.
+
+        A single line named "" gives {key: count}, like the original single border.
+        """
+        if len(self.lines) == 1 and not self.lines[0].name and not self.zones:
+            return self.lines[0].counter
+        counter = {f"{line.name}:{key}": count for line in self.lines for key, count in line.counter.items()}
+        for zone in self.zones:
+            counter.update({f"{zone.name}:{key}": count for key, count in zone.counter.items()})
+        return counter
+
+    def segments(self) -> np.ndarray:
+        """Return all lines and zone edges as an array like (S, 2, 2)."""
+        lines = np.stack([self._starts, self._ends], axis=1).astype(np.float64)
+        edges = np.stack([self._edge_a, self._edge_b], axis=1)
+        return np.concatenate([lines, edges])
+
+    def region(self, margin: float) -> Tuple[int, int, int, int]:
+        """Return the bounding box [xmin, ymin, xmax, ymax] of all lines and zones, grown by `margin` pixels."""
+        points = self.segments().reshape(-1, 2)
+        xmin, ymin = points.min(axis=0) - margin
+        xmax, ymax = points.max(axis=0) + margin
+        return int(xmin), int(ymin), int(np.ceil(xmax)), int(np.ceil(ymax))
+
+    def crossings(self, centers: np.ndarray, prev_centers: np.ndarray) -> np.ndarray:
+        """Return a (M, R) bool array, True if motion m matches rule r: it intersects the line and goes its way.
+
+        Motions go from prev_centers to centers, both like (M, 2) int arrays.
+        """
+        a, b = prev_centers[:, None, :], centers[:, None, :]
+        c, d = self._starts[None], self._ends[None]
+        intersect = (_ccw(a, c, d) != _ccw(b, c, d)) & (_ccw(a, b, c) != _ccw(a, b, d))
+        # See utils.check_direction.
+        right = (centers[:, 0] - prev_centers[:, 0] > 0)[:, None]
+        top = (centers[:, 1] - prev_centers[:, 1] < 0)[:, None]
+        direction = ((self._rule_x < 0) | (right == (self._rule_x == 1))) & (
+            (self._rule_y < 0) | (top == (self._rule_y == 1))
+        )
+        return intersect[:, self._rule_line] & direction
+
+    def inside(self, points: np.ndarray) -> np.ndarray:
+        """Return a (N, Z) bool array, True if point n is inside zone z (even-odd rule)."""
+        p = points[:, None, :].astype(np.float64)
+        a, b = self._edge_a[None], self._edge_b[None]
+        straddle = (a[..., 1] > p[..., 1]) != (b[..., 1] > p[..., 1])
+        with np.errstate(divide="ignore", invalid="ignore"):
+            x = (b[..., 0] - a[..., 0]) * (p[..., 1] - a[..., 1]) / (b[..., 1] - a[..., 1]) + a[..., 0]
+        crossing = straddle & (p[..., 0] < x)
+        return (crossing.astype(np.int64) @ self._edge_zone) % 2 == 1
+
+    def update(
+        self,
+        frame_index: int,
+        ids: np.ndarray,
+        centers: np.ndarray,
+        prev_centers: np.ndarray,
+        has_prev: np.ndarray,
+        alive_ids: Optional[np.ndarray] = None,
+    ) -> List[CountEvent]:
+        """Count line crossings and zone entries/exits of the tracks of a frame.
+
+        Args:
+            frame_index (int): Index of the frame in the source, e.g. Tracker.frame_index.
+                               Events and dwell times are in source frames, also when frames are skipped.
+            ids (np.ndarray): Track ids like (N,).
+            centers (np.ndarray): Current centers like (N, 2).
+            prev_centers (np.ndarray): Previous centers like (N, 2), ignored where has_prev is False.
+            has_prev (np.ndarray): (N,) bool, True if the track has a previous center.
+            alive_ids (Optional[np.ndarray]): Ids of tracks which still exist but are not reported,
+                                              they keep their zones instead of leaving them.
+
+        Returns:
+            List[CountEvent]: Events of the frame.
+        """
+        ids = np.asarray(ids, dtype=np.int64)
+        centers = np.asarray(centers, dtype=np.int64).reshape(-1, 2)
+        events = []
+
+        if len(self._rules) and np.any(has_prev):
+            prev = np.asarray(prev_centers, dtype=np.int64).reshape(-1, 2)
+            crossed = self.crossings(centers[has_prev], prev[has_prev])
+            for r, count in zip(*np.unique(np.nonzero(crossed)[1], return_counts=True)):
+                line, key = self._rules[r]
+                self.lines[line].counter[key] += int(count)
+            for m, r in zip(*np.nonzero(crossed)):
+                line, key = self._rules[r]
+                events.append(CountEvent("line", self.lines[line].name, key, int(ids[has_prev][m]), frame_index))
+
+        if self.zones:
+            events += self._update_zones(frame_index, ids, centers, alive_ids)
+        return events
+
+    def _update_zones(
+        self, frame_index: int, ids: np.ndarray, centers: np.ndarray, alive_ids: Optional[np.ndarray]
+    ) -> List[CountEvent]:
+        inside = self.inside(centers)
+        all_ids = np.union1d(self._zone_ids, ids)
+        prev = np.zeros((len(all_ids), len(self.zones)), dtype=bool)
+        since = np.zeros_like(prev, dtype=np.int64)
+        rows = np.searchsorted(all_ids, self._zone_ids)
+        prev[rows], since[rows] = self._zone_inside, self._zone_since
+        current = np.zeros_like(prev)
+        current[np.searchsorted(all_ids, ids)] = inside
+        if alive_ids is not None:
+            # Tracks which are not reported but alive stay where they were.
+            hidden = np.isin(all_ids, alive_ids) & ~np.isin(all_ids, ids)
+            current[hidden] = prev[hidden]
+
+        entered, exited = current & ~prev, prev & ~current
+        since[entered] = frame_index
+        events = []
+        for k, z in zip(*np.nonzero(entered)):
+            zone = self.zones[z]
+            zone.entered += 1
+            events.append(CountEvent("enter", zone.name, None, int(all_ids[k]), frame_index))
+        for k, z in zip(*np.nonzero(exited)):
+            zone = self.zones[z]
+            dwell = int(frame_index - since[k, z])
+            zone.exited += 1
+            zone.dwell_count += 1
+            zone.dwell_total += dwell
+            zone.dwell_max = max(zone.dwell_max, dwell)
+            events.append(CountEvent("exit", zone.name, None, int(all_ids[k]), frame_index, dwell))
+        for z, occupancy in enumerate(current.sum(axis=0)):
+            self.zones[z].occupancy = int(occupancy)
+
+        keep = current.any(axis=1)
+        self._zone_ids, self._zone_inside, self._zone_since = all_ids[keep], current[keep], since[keep]
+        return events
+
+
+def _direction(value: Optional[str]) -> Optional[Tuple[bool]]:
+    if value is None:
+        return None
+    if value not in direction_config:
+        raise ValueError(f"Unknown direction {value}, choose one of {list(direction_config)} or null.")
+    return direction_config[value]
+
+
+def load_counting_config(path: str, scale: float = 1.0) -> CountingEngine:
+    """Create CountingEngine from a JSON configuration file, see the module docstring.
+
+    Args:
+        path (str): Path to the configuration file.
+        scale (float): Scale of points, e.g. the decode scale of frames.
+
+    Returns:
+        CountingEngine: Lines and zones of the configuration.
+    """
+    with open(path) as f:
+        config = json.load(f)
+
+    def points(values: Sequence[Sequence[float]]) -> List[Tuple[int, int]]:
+        return [(int(x * scale), int(y * scale)) for x, y in values]
+
+    lines = []
+    for line in config.get("lines", []):
+        if len(line["points"]) != 2:
+            raise ValueError(f"Line {line['name']} must have exactly 2 points, got {len(line['points'])}.")
+        directions = {key: _direction(value) for key, value in line.get("directions", {"total": None}).items()}
+        lines.append(Line(line["name"], *points(line["points"]), directions))
+    # Zone checks its own points.
+    zones = [Zone(zone["name"], points(zone["points"])) for zone in config.get("zones", [])]
+    return CountingEngine(lines, zones)
@@ -3,11 +3,27 @@
 # Copyright 2021.
 # ozora-ogino
 
-from typing import Tuple
+import os
+import time
+from typing import Dict, List, Optional, Tuple
 
 import cv2
 import numpy as np
-from tflite_runtime.interpreter import Interpreter
+from tflite_runtime.interpreter import Interpreter, OpResolverType, load_delegate
+
+from metrics import NullMetrics, get_metrics
+
+# Boxes closer than this to a crop edge inside the frame may be cut by the crop.
+CUT_MARGIN = 2
+
+
+def _tile_starts(start: int, end: int, size: int, overlap: float) -> np.ndarray:
+    """Return starts of tiles of `size` covering [start, end), overlapping by at least `overlap` of size."""
+    if end - start <= size:
+        return np.array([start])
+    step = max(int(size * (1 - overlap)), 1)
+    num = -(-(end - start - size) // step) + 1
+    return np.round(np.linspace(start, end - size, num)).astype(int)
 
 
 class Detect(object):
@@ -17,47 +33,419 @@ class Detect(object):
         self,
         model_file: str,
         conf_thr: float,
+        letterbox: bool = False,
+        classes: Optional[List[int]] = None,
+        iou_thr: float = 0.45,
+        metrics: Optional[NullMetrics] = None,
+        num_threads: Optional[int] = None,
+        delegate: Optional[str] = None,
+        delegate_options: Optional[Dict[str, str]] = None,
+        xnnpack: bool = True,
+        auto_tune: bool = False,
+        num_interpreters: int = 1,
+        warmup: int = 1,
+        regions: Optional[List[Tuple[int]]] = None,
+        tile_size: Optional[int] = None,
+        tile_overlap: float = 0.2,
     ):
+        """Constructor of Detect.
+
+        Args:
+            model_file (str): Path to tflite weight.
+            conf_thr (float): Confidence threshold.
+            letterbox (bool): Keep the aspect ratio of frames by padding them instead of stretching.
+            classes (Optional[List[int]]): Class indices returned by detect_dets. All classes if None.
+            iou_thr (float): IoU threshold for NMS in detect_dets.
+            metrics (Optional[NullMetrics]): Record preprocess, invoke, postprocess and nms latency.
+            num_threads (Optional[int]): Number of interpreter threads. Defaults to the runtime default,
+                                         or to the cores of the host divided by num_interpreters if it is > 1.
+            delegate (Optional[str]): Path to an external delegate library, e.g. libedgetpu.so.1.
+            delegate_options (Optional[Dict[str, str]]): Options of the external delegate.
+            xnnpack (bool): Use the XNNPACK delegate which the runtime applies by default to float models.
+            auto_tune (bool): Time a few invokes with several thread counts and keep the fastest.
+            num_interpreters (int): Number of interpreters sharing the host, e.g. workers of multistream.
+            warmup (int): Number of invokes run at construction, so the first frame does not pay
+                          for the lazy initialization of the interpreter.
+            regions (Optional[List[Tuple[int]]]): Regions of interest like [xmin, ymin, xmax, ymax] in pixels.
+                                                  detect_dets only runs on these crops of frames.
+            tile_size (Optional[int]): Split frames, or regions, into overlapping square tiles of this size,
+                                       detected in a single batch. Boxes are merged by NMS across tiles.
+            tile_overlap (float): Min overlap of two neighbouring tiles as a fraction of tile_size.
+        """
+        self.metrics = get_metrics(metrics)
+        if tile_size is not None and tile_size <= 0:
+            raise ValueError("tile_size must be greater than 0.")
+        if not 0 <= tile_overlap < 1:
+            raise ValueError("tile_overlap must be in [0, 1).")
+        self.delegate = delegate
+        self.delegate_options = delegate_options
+        self.xnnpack = xnnpack
+        cores = self.available_cores() // max(num_interpreters, 1) or 1
+        if num_threads is None and num_interpreters > 1:
+            num_threads = cores
+
         # Load model to memory.
-        self.interpreter = Interpreter(model_file)
-        self.interpreter.allocate_tensors()
+        # The runtime memory maps the model file, so processes loading the same file share its pages.
+        start = time.perf_counter()
+        timings = None
+        if auto_tune:
+            self.interpreter, num_threads, timings = self._auto_tune(model_file, cores)
+        else:
+            self.interpreter = self._create_interpreter(model_file, num_threads)
+            self.interpreter.allocate_tensors()
+        load_time = time.perf_counter() - start
+        self.metrics.observe("load", load_time)
+        # Chosen interpreter configuration, with the invoke latency of each thread count if auto-tuned.
+        self.config = {
+            "num_threads": num_threads,
+            "delegate": delegate,
+            "xnnpack": xnnpack,
+            "invoke_ms": timings,
+            "load_ms": round(load_time * 1000, 3),
+            "warmup_ms": None,
+        }
 
-        self.input_details = self.interpreter
-        _, self.width, self.height, _ = self.interpreter.get_input_details()[0]["shape"]
+        self.input_details = self.interpreter.get_input_details()
+        self.input_index = self.input_details[0]["index"]
+        self.batch_size, self.width, self.height, _ = self.input_details[0]["shape"]
         self.output_details = self.interpreter.get_output_details()
+        # Quantized models take uint8 or int8 input and return uint8 or int8 output,
+        # real value = scale * (quantized value - zero_point).
+        self.input_dtype = self.input_details[0]["dtype"]
+        self.input_scale, self.input_zero_point = self.input_details[0]["quantization"]
+        self.output_scale, self.output_zero_point = self.output_details[0]["quantization"]
+        self.output_quantized = self.output_details[0]["dtype"] != np.float32
         self.conf_thr = conf_thr
+        self.letterbox = letterbox
+        self.classes = None if classes is None else np.asarray(classes, dtype=int)
+        self.iou_thr = iou_thr
+        # Letterbox remap maps and inverse box transform for each input resolution.
+        self._letterbox_cache = {}
+        self.regions = regions
+        self.tile_size = tile_size
+        self.tile_overlap = tile_overlap
+        # Crops of detect_dets for each frame resolution.
+        self._crop_cache = {}
+
+        # Scratch buffers reused by preprocess for uint8 frames.
+        self._resized = np.empty((self.width, self.height, 3), dtype=np.uint8)
+        self._rgb = np.empty((self.width, self.height, 3), dtype=np.uint8)
+        # Quantized input value of each pixel value, as uint8 bit patterns for cv2.LUT.
+        # With the usual scale 1/255, it is a shift of pixel values by the zero point modulo 256
+        # (0 for uint8, 128 for int8), which is much faster than a lookup.
+        self._input_lut, self._input_shift = None, 0
+        if self.input_dtype != np.float32:
+            lut = self._quantize_input(np.arange(256, dtype=np.float32)).view(np.uint8)
+            if np.array_equal(lut, (np.arange(256) + lut[0]) % 256):
+                self._input_shift = int(lut[0])
+            else:
+                self._input_lut = lut
+
+        if warmup > 0:
+            self.config["warmup_ms"] = round(self.warmup(runs=warmup) * 1000, 3)
+
+    @staticmethod
+    def available_cores() -> int:
+        """Number of cores this process may run on."""
+        if hasattr(os, "sched_getaffinity"):
+            return len(os.sched_getaffinity(0))
+        return os.cpu_count() or 1
+
+    def _create_interpreter(self, model_file: str, num_threads: Optional[int]) -> Interpreter:
+        delegates = None
+        if self.delegate:
+            delegates = [load_delegate(self.delegate, self.delegate_options or {})]
+        resolver = OpResolverType.AUTO if self.xnnpack else OpResolverType.BUILTIN_WITHOUT_DEFAULT_DELEGATES
+        return Interpreter(
+            model_file,
+            experimental_delegates=delegates,
+            num_threads=num_threads,
+            experimental_op_resolver_type=resolver,
+        )
+
+    def warmup(self, batch_size: int = 1, runs: int = 1) -> float:
+        """Resize the input to `batch_size` and invoke on a blank input `runs` times.
+
+        Returns:
+            float: Elapsed time in seconds, also recorded as the "warmup" stage of metrics.
+        """
+        start = time.perf_counter()
+        self._resize_input(batch_size)
+        self.interpreter.set_tensor(
+            self.input_index, np.zeros((batch_size, self.width, self.height, 3), dtype=self.input_dtype)
+        )
+        for _ in range(runs):
+            self.interpreter.invoke()
+        elapsed = time.perf_counter() - start
+        self.metrics.observe("warmup", elapsed)
+        return elapsed
+
+    def _auto_tune(self, model_file: str, cores: int, repeat: int = 3) -> Tuple[Interpreter, int, Dict[int, float]]:
+        """Time invokes with 1, 2, 4, ... up to `cores` threads and return the fastest interpreter.
+
+        Returns:
+            Tuple[Interpreter, int, Dict[int, float]]: Interpreter, its number of threads,
+                                                       and the median invoke latency in ms of each thread count.
+        """
+        candidates = sorted({2**i for i in range(cores.bit_length()) if 2**i <= cores} | {cores})
+        best, timings = None, {}
+        for num_threads in candidates:
+            interpreter = self._create_interpreter(model_file, num_threads)
+            interpreter.allocate_tensors()
+            detail = interpreter.get_input_details()[0]
+            interpreter.set_tensor(detail["index"], np.zeros(detail["shape"], dtype=detail["dtype"]))
+            # The first invoke allocates and packs weights, it is not timed.
+            interpreter.invoke()
+            samples = []
+            for _ in range(repeat):
+                start = time.perf_counter()
+                interpreter.invoke()
+                samples.append(time.perf_counter() - start)
+            timings[num_threads] = round(float(np.median(samples)) * 1000, 3)
+            if best is None or timings[num_threads] < timings[best[1]]:
+                best = (interpreter, num_threads)
+        return best[0], best[1], timings
 
     def detect(self, img: np.ndarray, box_type="xywh") -> Tuple[np.ndarray]:
         """Detect objects.
         Returns:
            Tuple[np.ndarray]: The shape of each element is (25500, 4) (25500,) (25500,).
         """
-        img = self.preprocess(img)
-        output_data = self._detect(img)
-        boxes, scores, class_idx = self.postprocess(output_data, box_type)
+        self._set_input([img])
+        output_data = self._invoke()
+        boxes, scores, class_idx = self.postprocess(output_data, box_type, img.shape)
         return boxes, scores, class_idx
 
+    def detect_batch(self, imgs: List[np.ndarray], box_type="xywh") -> List[Tuple[np.ndarray]]:
+        """Detect objects in several frames with a single inference.
+
+        Returns:
+            List[Tuple[np.ndarray]]: boxes, scores and class_idx for each frame.
+        """
+        self._set_input(imgs)
+        output_data = self._invoke()
+        return [self.postprocess(output_data[i : i + 1], box_type, img.shape) for i, img in enumerate(imgs)]
+
+    def detect_dets(self, img: np.ndarray) -> np.ndarray:
+        """Detect objects of the target classes and apply NMS.
+
+        Only the regions of interest, or their tiles, are detected if they are set.
+
+        Returns:
+            np.ndarray: Array like [xmin, ymin, xmax, ymax, score, class_idx] in pixels.
+        """
+        if self.regions is not None or self.tile_size is not None:
+            return self._detect_crops([img])[0]
+        self._set_input([img])
+        output_data = self._invoke()
+        return self.postprocess_dets(output_data, img.shape)
+
+    def detect_dets_batch(self, imgs: List[np.ndarray]) -> List[np.ndarray]:
+        """Run detect_dets on several frames with a single inference."""
+        if self.regions is not None or self.tile_size is not None:
+            return self._detect_crops(imgs)
+        self._set_input(imgs)
+        output_data = self._invoke()
+        return [self.postprocess_dets(output_data[i : i + 1], img.shape) for i, img in enumerate(imgs)]
+
+    def crops(self, shape: Tuple[int]) -> np.ndarray:
+        """Return the crops of a frame detected by detect_dets.
+
+        Args:
+            shape (Tuple[int]): Shape of the frame.
+
+        Returns:
+            np.ndarray: Array like [xmin, ymin, xmax, ymax] in pixels, the whole frame without regions and tiles.
+        """
+        h, w = shape[:2]
+        if (h, w) in self._crop_cache:
+            return self._crop_cache[(h, w)]
+
+        crops = []
+        for region in self.regions if self.regions is not None else [(0, 0, w, h)]:
+            xmin, ymin = max(int(region[0]), 0), max(int(region[1]), 0)
+            xmax, ymax = min(int(region[2]), w), min(int(region[3]), h)
+            if xmax <= xmin or ymax <= ymin:
+                raise ValueError(f"Region {region} is outside of the frame of {w}x{h}.")
+            if self.tile_size is None:
+                crops.append((xmin, ymin, xmax, ymax))
+                continue
+            for y in _tile_starts(ymin, ymax, self.tile_size, self.tile_overlap):
+                for x in _tile_starts(xmin, xmax, self.tile_size, self.tile_overlap):
+                    crops.append((x, y, min(x + self.tile_size, xmax), min(y + self.tile_size, ymax)))
+
+        self._crop_cache[(h, w)] = np.array(crops, dtype=int)
+        return self._crop_cache[(h, w)]
+
+    def _detect_crops(self, imgs: List[np.ndarray]) -> List[np.ndarray]:
+        """Detect the crops of all frames in a single inference, and merge the boxes of each frame."""
+        crops = [self.crops(img.shape) for img in imgs]
+        # Crops are views, resized straight from the frame into the input tensor.
+        self._set_input([img[y1:y2, x1:x2] for img, frame_crops in zip(imgs, crops) for x1, y1, x2, y2 in frame_crops])
+        output_data = self._invoke()
+
+        results = []
+        index = 0
+        for img, frame_crops in zip(imgs, crops):
+            h, w = img.shape[:2]
+            candidates = []
+            for x1, y1, x2, y2 in frame_crops:
+                boxes, scores, class_idx = self._candidates(output_data[index : index + 1], (y2 - y1, x2 - x1))
+                boxes = boxes + np.array([x1, y1, x1, y1], dtype=np.float32)
+                # A box touching an edge of the crop inside the frame may be a part of an object.
+                inner = np.array([x1 > 0, y1 > 0, x2 < w, y2 < h])
+                near = np.abs(boxes - np.array([x1, y1, x2, y2])) <= CUT_MARGIN
+                candidates.append((boxes, scores, class_idx, np.any(near & inner, axis=1)))
+                index += 1
+            boxes, scores, class_idx, cut = (np.concatenate(column) for column in zip(*candidates))
+            results.append(self._merge(boxes, scores, class_idx, cut, img.shape))
+        return results
+
+    def _resize_input(self, batch_size: int) -> None:
+        """Resize the batch dimension of the input tensor if needed."""
+        if batch_size == self.batch_size:
+            return
+        self.interpreter.resize_tensor_input(self.input_index, [batch_size, self.width, self.height, 3])
+        self.interpreter.allocate_tensors()
+        self.batch_size = batch_size
+
+    def _set_input(self, imgs: List[np.ndarray]) -> None:
+        """Preprocess frames directly into the input tensor of the interpreter."""
+        with self.metrics.timer("preprocess"):
+            self._resize_input(len(imgs))
+            input_tensor = self.interpreter.tensor(self.input_index)()
+            for i, img in enumerate(imgs):
+                self.preprocess(img, out=input_tensor[i : i + 1])
+            # The interpreter refuses to invoke while a view of its buffers is alive.
+            del input_tensor
+
     def _detect(self, img: np.ndarray):
         """Inference."""
-        self.interpreter.set_tensor(0, img)
-        self.interpreter.invoke()
-        output_data = self.interpreter.get_tensor(self.output_details[0]["index"])  # get tensor  x(1, 25200, 7)
+        self._resize_input(img.shape[0])
+        self.interpreter.set_tensor(self.input_index, img)
+        return self._invoke()
+
+    def _invoke(self) -> np.ndarray:
+        """Run inference on the current input tensor."""
+        with self.metrics.timer("invoke"):
+            self.interpreter.invoke()
+        output_data = self.interpreter.get_tensor(self.output_details[0]["index"])  # get tensor  x(N, 25200, 85)
         return output_data
 
-    def preprocess(self, img: np.ndarray) -> np.ndarray:
-        """Preprocess."""
+    def _letterbox_geometry(self, shape: Tuple[int]) -> Tuple[np.ndarray]:
+        """Return remap maps and the inverse box transform for the given frame shape.
+
+        The geometry only depends on the frame resolution, so it is computed once and cached.
+
+        Returns:
+            Tuple[np.ndarray]: map1, map2 for cv2.remap, and scale, offset which convert
+                               normalized xywh from the model input to the frame.
+        """
+        h, w = shape[:2]
+        if (h, w) in self._letterbox_cache:
+            return self._letterbox_cache[(h, w)]
+
+        model_h, model_w = self.width, self.height
+        ratio = min(model_h / h, model_w / w)
+        new_h, new_w = max(int(round(h * ratio)), 1), max(int(round(w * ratio)), 1)
+        top, left = (model_h - new_h) // 2, (model_w - new_w) // 2
+
+        # Sample the frame as cv2.resize does, pixels in the padding point far outside of the frame.
+        map_x = (np.arange(model_w, dtype=np.float32) - left + 0.5) * (w / new_w) - 0.5
+        map_y = (np.arange(model_h, dtype=np.float32) - top + 0.5) * (h / new_h) - 0.5
+        map_x[(np.arange(model_w) < left) | (np.arange(model_w) >= left + new_w)] = -1e4
+        map_y[(np.arange(model_h) < top) | (np.arange(model_h) >= top + new_h)] = -1e4
+        map_x, map_y = np.meshgrid(map_x, map_y)
+        map1, map2 = cv2.convertMaps(map_x, map_y, cv2.CV_16SC2)
+
+        scale = np.array([model_w / new_w, model_h / new_h, model_w / new_w, model_h / new_h], dtype=np.float32)
+        offset = np.array([-left / new_w, -top / new_h, 0, 0], dtype=np.float32)
+
+        self._letterbox_cache[(h, w)] = (map1, map2, scale, offset)
+        return self._letterbox_cache[(h, w)]
+
+    def _resize(self, img: np.ndarray, dst: Optional[np.ndarray] = None) -> np.ndarray:
+        """Resize a frame to the model input, with letterbox padding if enabled."""
+        if self.letterbox:
+            map1, map2, _, _ = self._letterbox_geometry(img.shape)
+            return cv2.remap(
+                img,
+                map1,
+                map2,
+                cv2.INTER_LINEAR,
+                dst=dst,
+                borderMode=cv2.BORDER_CONSTANT,
+                borderValue=(114, 114, 114),
+            )
+        return cv2.resize(img, (self.height, self.width), dst=dst)
+
+    def _quantize_input(self, pixels: np.ndarray) -> np.ndarray:
+        """Quantize pixel values in [0, 255] to the input dtype of the model."""
+        info = np.iinfo(self.input_dtype)
+        quantized = np.round(pixels / 255.0 / self.input_scale) + self.input_zero_point
+        return np.clip(quantized, info.min, info.max).astype(self.input_dtype)
+
+    def _dequantize_output(self, output_data: np.ndarray) -> np.ndarray:
+        """Convert rows of a quantized output to float32."""
+        if not self.output_quantized:
+            return output_data
+        return (output_data.astype(np.float32) - self.output_zero_point) * np.float32(self.output_scale)
+
+    def preprocess(self, img: np.ndarray, out: Optional[np.ndarray] = None) -> np.ndarray:
+        """Preprocess.
+
+        uint8 frames are resized and converted to RGB in reused scratch buffers, then scaled
+        into `out` as float32, so no full-frame array is allocated per frame.
+        For quantized models, RGB pixels are written as is, or mapped by a lookup table
+        to the quantized input, without any float conversion.
+
+        Args:
+            img (np.ndarray): BGR frame.
+            out (Optional[np.ndarray]): Array of shape (1, H, W, 3) and the input dtype of the model to write into.
+                                        A new array is allocated if it is None.
+        """
+        if out is None:
+            out = np.empty((1, self.width, self.height, 3), dtype=self.input_dtype)
+
+        if img.dtype != np.uint8:
+            # Resize
+            img = self._resize(img)
+            # BGR -> RGB
+            img = img[:, :, [2, 1, 0]]
+            if self.input_dtype != np.float32:
+                out[0] = self._quantize_input(img)
+                return out
+            # Normalize
+            np.multiply(img, 1 / 255.0, out=out[0], casting="unsafe")
+            return out
+
         # Resize
-        img = cv2.resize(img, (self.height, self.width))
+        self._resize(img, dst=self._resized)
+        if self.input_dtype != np.float32:
+            # BGR -> RGB, then quantize.
+            target = out[0].view(np.uint8)
+            if self._input_lut is None:
+                cv2.cvtColor(self._resized, cv2.COLOR_BGR2RGB, dst=target)
+                if self._input_shift:
+                    np.add(target, np.uint8(self._input_shift), out=target)
+            else:
+                cv2.cvtColor(self._resized, cv2.COLOR_BGR2RGB, dst=self._rgb)
+                cv2.LUT(self._rgb, self._input_lut, dst=target)
+            return out
         # BGR -> RGB
-        img = img[:, :, [2, 1, 0]]
+        cv2.cvtColor(self._resized, cv2.COLOR_BGR2RGB, dst=self._rgb)
         # Normalize
-        img = img / 255.0
-        img = np.expand_dims(img, axis=0)
-        return img.astype(np.float32)
+        np.multiply(self._rgb, np.float32(1 / 255.0), out=out[0], dtype=np.float32)
+        return out
+
+    def postprocess(self, output_data, box_type: str, frame_shape: Optional[Tuple[int]] = None) -> Tuple[np.ndarray]:
+        """Postprocess.
 
-    def postprocess(self, output_data, box_type: str) -> Tuple[np.ndarray]:
-        """Postprocess."""
-        output_data = output_data[0]
+        Args:
+            frame_shape (Optional[Tuple[int]]): Shape of the original frame.
+                                                Required to undo the letterbox padding.
+        """
+        output_data = self._dequantize_output(output_data[0])
         # xywh
         boxes = output_data[..., :4]
         conf = output_data[..., 4:5]
@@ -66,23 +454,138 @@ class Detect(object):
         conf = np.squeeze(conf, axis=1)
         cls = np.squeeze(cls, axis=1)
 
-        if box_type == "xyxy":
-            # xywh -> xyxyx
-            boxes = self.to_xyxy(boxes)
-
         # Filter by confidence threshold.
         idxs = np.where(conf > self.conf_thr)
         boxes = boxes[idxs]
         cls = cls[idxs]
         conf = conf[idxs]
 
+        if self.letterbox and frame_shape is not None:
+            # Normalized to the model input -> normalized to the frame.
+            _, _, scale, offset = self._letterbox_geometry(frame_shape)
+            boxes = boxes * scale + offset
+
+        if box_type == "xyxy":
+            # xywh -> xyxyx
+            boxes = self.to_xyxy(boxes)
+
         return boxes, conf, cls
 
+    def postprocess_dets(self, output_data: np.ndarray, frame_shape: Tuple[int]) -> np.ndarray:
+        """Filter by score, keep target classes and apply class-aware NMS.
+
+        Rows are dropped by objectness before any class column is read, and only the
+        columns of the target classes are read, so most of the output is never touched.
+        A quantized output is compared with the threshold in the quantized domain,
+        and only the remaining rows are dequantized.
+
+        Args:
+            output_data (np.ndarray): Output of the model like (1, N, 5 + number of classes).
+            frame_shape (Tuple[int]): Shape of the original frame.
+
+        Returns:
+            np.ndarray: Array like [xmin, ymin, xmax, ymax, score, class_idx] in pixels.
+        """
+        boxes, scores, class_idx = self._candidates(output_data, frame_shape)
+        return self._nms(boxes, scores, class_idx, frame_shape)
+
+    def _candidates(self, output_data: np.ndarray, frame_shape: Tuple[int]) -> Tuple[np.ndarray]:
+        """Return boxes like [xmin, ymin, xmax, ymax] in pixels, scores and class indices above the threshold."""
+        with self.metrics.timer("postprocess"):
+            output_data = output_data[0]
+            # score = objectness * class score <= objectness.
+            if self.output_quantized:
+                threshold = self.conf_thr / self.output_scale + self.output_zero_point
+                output_data = self._dequantize_output(output_data[output_data[:, 4] > threshold])
+            else:
+                output_data = output_data[output_data[:, 4] > self.conf_thr]
+
+            if self.classes is None:
+                class_scores = output_data[:, 5:]
+            else:
+                class_scores = output_data[:, 5 + self.classes]
+            class_scores = class_scores * output_data[:, 4:5]
+
+            if class_scores.shape[1] == 1:
+                scores = class_scores[:, 0]
+                class_idx = np.zeros(len(scores), dtype=int)
+            else:
+                class_idx = np.argmax(class_scores, axis=1)
+                scores = class_scores[np.arange(len(class_idx)), class_idx]
+
+            keep = scores > self.conf_thr
+            boxes = output_data[keep, :4]
+            scores = scores[keep]
+            class_idx = class_idx[keep]
+            if self.classes is not None:
+                class_idx = self.classes[class_idx]
+
+            if self.letterbox:
+                # Normalized to the model input -> normalized to the frame.
+                _, _, scale, offset = self._letterbox_geometry(frame_shape)
+                boxes = boxes * scale + offset
+
+            # Normalized xywh -> xyxy in pixels.
+            H, W = frame_shape[:2]
+            boxes = self.to_xyxy(boxes) * np.array([W, H, W, H], dtype=np.float32)
+        return boxes, scores, class_idx
+
+    def _nms_keep(self, boxes: np.ndarray, scores: np.ndarray, class_idx: np.ndarray, frame_shape: Tuple[int]):
+        """Return indices of boxes kept by class-aware NMS."""
+        H, W = frame_shape[:2]
+        # Shift boxes by class so that NMS never suppresses boxes of other classes.
+        offset = (class_idx * (max(H, W) + 1)).reshape(-1, 1)
+        nms_boxes = boxes[:, :2] + offset
+        nms_boxes = np.concatenate([nms_boxes, boxes[:, 2:] - boxes[:, :2]], axis=1)
+        idx = cv2.dnn.NMSBoxes(nms_boxes, scores, self.conf_thr, self.iou_thr)
+        return np.asarray(idx, dtype=int).reshape(-1)
+
+    def _nms(self, boxes: np.ndarray, scores: np.ndarray, class_idx: np.ndarray, frame_shape: Tuple[int]):
+        """Apply class-aware NMS and return an array like [xmin, ymin, xmax, ymax, score, class_idx]."""
+        with self.metrics.timer("nms"):
+            if len(boxes) > 0:
+                idx = self._nms_keep(boxes, scores, class_idx, frame_shape)
+                boxes, scores, class_idx = boxes[idx], scores[idx], class_idx[idx]
+
+        return np.concatenate([boxes, scores.reshape(-1, 1), class_idx.reshape(-1, 1)], axis=1)
+
+    def _merge(
+        self,
+        boxes: np.ndarray,
+        scores: np.ndarray,
+        class_idx: np.ndarray,
+        cut: np.ndarray,
+        frame_shape: Tuple[int],
+        min_cover: float = 0.6,
+    ) -> np.ndarray:
+        """Merge boxes of overlapping crops with NMS across crops.
+
+        An object on the seam of two tiles is also seen partly by one of them, and the part often
+        has a low IoU with the whole box. Such a box touching a crop edge (cut) is dropped when
+        more than `min_cover` of it lies in a better box of the same class.
+        """
+        with self.metrics.timer("nms"):
+            if len(boxes) > 0:
+                idx = self._nms_keep(boxes, scores, class_idx, frame_shape)
+                boxes, scores, class_idx, cut = boxes[idx], scores[idx], class_idx[idx], cut[idx]
+                # idx is sorted by score, compare every cut box with the better ones.
+                rows = np.flatnonzero(cut)
+                lt = np.maximum(boxes[rows, None, :2], boxes[None, :, :2])
+                rb = np.minimum(boxes[rows, None, 2:], boxes[None, :, 2:])
+                inter = (rb[..., 0] - lt[..., 0]).clip(0) * (rb[..., 1] - lt[..., 1]).clip(0)
+                area = (boxes[rows, 2] - boxes[rows, 0]) * (boxes[rows, 3] - boxes[rows, 1])
+                cover = inter / np.maximum(area, 1e-9)[:, None]
+                better = (np.arange(len(boxes))[None, :] < rows[:, None]) & (
+                    class_idx[rows, None] == class_idx[None, :]
+                )
+                keep = np.ones(len(boxes), dtype=bool)
+                keep[rows[np.any(better & (cover > min_cover), axis=1)]] = False
+                boxes, scores, class_idx = boxes[keep], scores[keep], class_idx[keep]
+
+        return np.concatenate([boxes, scores.reshape(-1, 1), class_idx.reshape(-1, 1)], axis=1)
+
     def to_xyxy(self, boxes: np.ndarray) -> np.ndarray:
         """Covert xywh to xyxy."""
         # (x, y) is cordinate fo the center of the box.
-        x, y, w, h = boxes[..., 0], boxes[..., 1], boxes[..., 2], boxes[..., 3]
-        boxes = np.array([x - w / 2, y - h / 2, x + w / 2, y + h / 2])
-        # [4, n] -> [n, 4]
-        boxes = boxes.transpose((1, 0))
-        return boxes
+        xy, half_wh = boxes[..., :2], boxes[..., 2:4] / 2
+        return np.concatenate([xy - half_wh, xy + half_wh], axis=-1)
@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+#
+# Copyright 2021.
+# ozora-ogino
+
+"""Person detection and regions of interest shared by main.py, offline.py and multistream.py."""
+
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+from detect import Detect
+from tracker import Tracker
+
+
+def to_person_dets(dets: np.ndarray) -> np.ndarray:
+    """Convert [xyxy, score, class_idx] from Detect to the [xyxy, score] format of Tracker."""
+    # dets:  [xmin, ymin, xmax, ymax, score]
+    return np.concatenate([dets[:, :4].astype(int), dets[:, 4:5]], axis=1)
+
+
+def detect_person(detect: Detect, frame: np.ndarray) -> np.ndarray:
+    """Detect person objects in a frame.
+
+    Returns:
+        np.ndarray: Array like [xyxy, score].
+    """
+    # Detect objects in the frame, NMS and class filtering are done by Detect.
+    return to_person_dets(detect.detect_dets(frame))
+
+
+def detect_person_batch(detect: Detect, frames: List[np.ndarray]) -> List[np.ndarray]:
+    """Detect person objects in several frames with a single inference.
+
+    Returns:
+        List[np.ndarray]: Array like [xyxy, score] for each frame.
+    """
+    if len(frames) == 1:
+        return [detect_person(detect, frames[0])]
+    return [to_person_dets(dets) for dets in detect.detect_dets_batch(frames)]
+
+
+def parse_regions(
+    roi: Optional[List[str]], tracker: Tracker, margin: float, scale: float
+) -> Optional[List[Tuple[int, int, int, int]]]:
+    """Parse regions of interest.
+
+    Args:
+        roi (Optional[List[str]]): Values like "xmin,ymin,xmax,ymax" in pixels of the source,
+                                   or "auto" for the region around the lines and zones of tracker.
+        tracker (Tracker): Tracker counting in the regions.
+        margin (float): Margin in pixels of the source around the lines and zones of "auto".
+        scale (float): Decode scale of frames.
+
+    Returns:
+        Optional[List[Tuple[int, int, int, int]]]: Regions like [xmin, ymin, xmax, ymax] in pixels of frames.
+    """
+    if not roi:
+        return None
+    regions = []
+    for value in roi:
+        if value == "auto":
+            regions.append(tracker.counting.region(margin * scale))
+            continue
+        coords = value.split(",")
+        if len(coords) != 4:
+            raise ValueError(f"Invalid region {value}, use xmin,ymin,xmax,ymax or auto.")
+        regions.append(tuple(int(float(v) * scale) for v in coords))
+    return regions
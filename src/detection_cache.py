@@ -0,0 +1,192 @@
+#!/usr/bin/env python3
+#
+# Copyright 2021.
+# ozora-ogino
+
+"""On-disk cache of per-frame detections, so re-tracking runs can skip inference.
+
+Every entry is a directory named by the key, holding one .npy file per column:
+    boxes.npy     (M, 4) int32 xyxy of all detections
+    scores.npy    (M,) float32 scores of all detections
+    offsets.npy   (N + 1,) int64 detections of frame i are rows offsets[i]:offsets[i + 1]
+    detected.npy  (N,) bool whether the detector ran on frame i
+and meta.json with the parameters of the key, the number of frames and whether the run reached the end
+of the source. Columns are memory mapped when loaded.
+"""
+
+import hashlib
+import json
+import os
+import shutil
+from typing import Dict, List, Optional
+
+import numpy as np
+
+COLUMNS = ("boxes", "scores", "offsets", "detected")
+
+
+def _file_hash(path: str, samples: int = 16, chunk_size: int = 1 << 20) -> str:
+    """Hash the size and `samples` chunks spread over a file.
+
+    Reading a few chunks keeps hashing a long video fast, and any re-encode or trim changes them.
+    """
+    hasher = hashlib.sha1()
+    size = os.path.getsize(path)
+    hasher.update(str(size).encode())
+    with open(path, "rb") as f:
+        if size <= samples * chunk_size:
+            hasher.update(f.read())
+        else:
+            for offset in np.linspace(0, size - chunk_size, samples, dtype=np.int64):
+                f.seek(int(offset))
+                hasher.update(f.read(chunk_size))
+    return hasher.hexdigest()
+
+
+class CachedDetections(object):
+    """Detections of a cache entry, read from memory mapped columns."""
+
+    def __init__(self, path: str):
+        self.path = path
+        columns = {name: np.load(os.path.join(path, f"{name}.npy"), mmap_mode="r") for name in COLUMNS}
+        self.boxes = columns["boxes"]
+        self.scores = columns["scores"]
+        self.offsets = columns["offsets"]
+        self.detected = columns["detected"]
+        with open(os.path.join(path, "meta.json")) as f:
+            self.meta = json.load(f)
+
+    def __len__(self) -> int:
+        return len(self.detected)
+
+    def is_detected(self, index: int) -> bool:
+        """Return True if detections of frame `index` are cached."""
+        return index < len(self.detected) and bool(self.detected[index])
+
+    def complete(self) -> bool:
+        """Return True if the entry covers the whole source and the detector ran on every frame."""
+        return bool(self.meta.get("ended", False)) and bool(np.all(self.detected))
+
+    def __getitem__(self, index: int) -> np.ndarray:
+        """Return detections of frame `index` like [xyxy, score], as returned by detection.detect_person."""
+        start, end = self.offsets[index], self.offsets[index + 1]
+        return np.concatenate([self.boxes[start:end], self.scores[start:end, None]], axis=1).astype(np.float64)
+
+
+class DetectionCacheWriter(object):
+    """Collect detections of a run, then store them as a cache entry with commit.
+
+    Detections of `base`, a partial entry of the same key, are kept so a run only adds the missing frames.
+    """
+
+    def __init__(self, cache: "DetectionCache", key: str, meta: Dict, base: Optional[CachedDetections] = None):
+        self.cache = cache
+        self.key = key
+        self.meta = meta
+        self.dets: Dict[int, np.ndarray] = {}
+        self.base_frames = 0
+        if base is not None:
+            self.dets = {i: base[i] for i in np.flatnonzero(base.detected).tolist()}
+            self.base_frames = len(base)
+        # Number of frames appended since the writer was created.
+        self.appended = 0
+
+    def append(self, index: int, dets: np.ndarray) -> None:
+        """Add detections like [xyxy, score] of frame `index`."""
+        self.dets[index] = dets
+        self.appended += 1
+
+    def commit(self, num_frames: int, ended: bool = True) -> None:
+        """Store the entry for a run of `num_frames` frames and evict old entries.
+
+        Args:
+            num_frames (int): Number of frames read from the source.
+            ended (bool): Whether the run reached the end of the source. Only such entries are complete.
+        """
+        num_frames = max(num_frames, self.base_frames)
+        dets: List[np.ndarray] = [self.dets.get(i, np.empty((0, 5))) for i in range(num_frames)]
+        counts = np.array([len(d) for d in dets], dtype=np.int64)
+        rows = np.concatenate(dets, axis=0) if dets else np.empty((0, 5))
+        columns = {
+            "boxes": rows[:, :4].astype(np.int32),
+            "scores": rows[:, 4].astype(np.float32),
+            "offsets": np.concatenate([[0], np.cumsum(counts)]).astype(np.int64),
+            "detected": np.array([i in self.dets for i in range(num_frames)], dtype=bool),
+        }
+
+        # Write to a temporary directory so an interrupted run never leaves a broken entry.
+        path = self.cache.path(self.key)
+        tmp = f"{path}.tmp-{os.getpid()}"
+        os.makedirs(tmp, exist_ok=True)
+        for name, column in columns.items():
+            np.save(os.path.join(tmp, f"{name}.npy"), column)
+        with open(os.path.join(tmp, "meta.json"), "w") as f:
+            json.dump(dict(self.meta, num_frames=num_frames, ended=ended), f)
+        if os.path.exists(path):
+            shutil.rmtree(path)
+        os.rename(tmp, path)
+        self.cache.evict(keep=self.key)
+
+
+class DetectionCache(object):
+    """Directory of cached detections keyed by source, model and detection parameters.
+
+    Entries are evicted in least recently used order when the cache exceeds `max_bytes`.
+
+    Args:
+        cache_dir (str): Directory of the cache.
+        max_bytes (int): Max total size of the entries.
+    """
+
+    def __init__(self, cache_dir: str, max_bytes: int = 1 << 30):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def key(self, src: str, model: str, **params) -> str:
+        """Return the key of detections of `src` by `model` with `params`, e.g. thresholds."""
+        meta = {"src": _file_hash(src), "model": _file_hash(model), "params": params}
+        return hashlib.sha1(json.dumps(meta, sort_keys=True).encode()).hexdigest()
+
+    def path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, key)
+
+    def load(self, key: str) -> Optional[CachedDetections]:
+        """Return cached detections, or None if the entry does not exist."""
+        path = self.path(key)
+        if not os.path.exists(os.path.join(path, "meta.json")):
+            return None
+        # The modification time of meta.json orders entries for eviction.
+        os.utime(os.path.join(path, "meta.json"))
+        return CachedDetections(path)
+
+    def writer(self, key: str, base: Optional[CachedDetections] = None, **meta) -> DetectionCacheWriter:
+        """Return a writer which stores the entry `key`, extending `base` if given.
+
+        meta is saved in meta.json for reference.
+        """
+        return DetectionCacheWriter(self, key, meta, base)
+
+    def _entries(self) -> List[str]:
+        return [
+            name
+            for name in os.listdir(self.cache_dir)
+            if os.path.exists(os.path.join(self.cache_dir, name, "meta.json"))
+        ]
+
+    def _size(self, key: str) -> int:
+        path = self.path(key)
+        return sum(os.path.getsize(os.path.join(path, name)) for name in os.listdir(path))
+
+    def evict(self, keep: Optional[str] = None) -> None:
+        """Remove least recently used entries, except `keep`, until the cache fits in max_bytes."""
+        entries = sorted(self._entries(), key=lambda key: os.path.getmtime(os.path.join(self.path(key), "meta.json")))
+        sizes = {key: self._size(key) for key in entries}
+        total = sum(sizes.values())
+        for key in entries:
+            if total <= self.max_bytes:
+                break
+            if key == keep:
+                continue
+            shutil.rmtree(self.path(key))
+            total -= sizes[key]
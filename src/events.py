@@ -0,0 +1,251 @@
+#!/usr/bin/env python3
+#
+# Copyright 2021.
+# ozora-ogino
+
+"""Count events as structured records, written to files, sockets or databases from a background thread.
+
+Sinks are opened from URIs:
+    events.jsonl              JSON lines
+    events.csv                CSV with a header
+    events.db, events.sqlite  SQLite table "events"
+    udp://127.0.0.1:9999      one JSON datagram per event
+    unix:///tmp/events.sock   one JSON datagram per event on a Unix datagram socket
+"""
+
+import csv
+import json
+import os
+import socket
+import sqlite3
+import threading
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from counting import CountEvent
+
+FIELDS = ("time", "stream", "frame_index", "track_id", "kind", "name", "direction", "dwell", "x1", "y1", "x2", "y2")
+
+
+def count_records(
+    events: List[CountEvent],
+    tracks: np.ndarray,
+    frame_index: int,
+    timestamp: float,
+    stream: Optional[str] = None,
+) -> List[Dict]:
+    """Return a record per event, with the box of the track.
+
+    Args:
+        events (List[CountEvent]): Events of a frame, e.g. Tracker.events.
+        tracks (np.ndarray): Tracks like [xyxy, id] of the frame, e.g. Tracker.tracks.
+        frame_index (int): Index of the frame in the source.
+        timestamp (float): Time of the frame in seconds since the epoch.
+        stream (Optional[str]): Name of the source.
+
+    Returns:
+        List[Dict]: Records with FIELDS as keys. The box is None for tracks missing from tracks,
+                    e.g. zone exits of tracks dropped by Sort.
+    """
+    boxes = {int(track[4]): track[:4].astype(int).tolist() for track in tracks}
+    records = []
+    for event in events:
+        box = boxes.get(event.track_id, [None] * 4)
+        records.append(
+            dict(
+                zip(
+                    FIELDS,
+                    [timestamp, stream, frame_index, event.track_id, event.kind, event.name, event.key, event.dwell]
+                    + box,
+                )
+            )
+        )
+    return records
+
+
+class EventSink(object):
+    """Destination of records, write is only called from the flusher thread of EventWriter."""
+
+    def write(self, records: List[Dict]) -> None:
+        raise NotImplementedError
+
+    def close(self) -> None:
+        pass
+
+
+class JsonLinesSink(EventSink):
+    def __init__(self, path: str):
+        self.file = open(path, "a")
+
+    def write(self, records: List[Dict]) -> None:
+        self.file.write("".join(json.dumps(record) + "\n" for record in records))
+        self.file.flush()
+
+    def close(self) -> None:
+        self.file.close()
+
+
+class CsvSink(EventSink):
+    def __init__(self, path: str):
+        is_new = not os.path.exists(path) or os.path.getsize(path) == 0
+        self.file = open(path, "a", newline="")
+        self.writer = csv.DictWriter(self.file, fieldnames=FIELDS)
+        if is_new:
+            self.writer.writeheader()
+
+    def write(self, records: List[Dict]) -> None:
+        self.writer.writerows(records)
+        self.file.flush()
+
+    def close(self) -> None:
+        self.file.close()
+
+
+class SocketSink(EventSink):
+    """Send a JSON datagram per record, to "udp://host:port" or "unix:///path".
+
+    Datagrams are dropped without error when nobody listens, they are counted in `dropped`.
+    """
+
+    def __init__(self, uri: str):
+        if uri.startswith("udp://"):
+            host, port = uri[len("udp://") :].rsplit(":", 1)
+            self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            self.address = (host, int(port))
+        elif uri.startswith("unix://"):
+            self.socket = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+            self.address = uri[len("unix://") :]
+        else:
+            raise ValueError(f"Unknown socket URI {uri}, use udp://host:port or unix:///path.")
+        self.dropped = 0
+
+    def write(self, records: List[Dict]) -> None:
+        for record in records:
+            try:
+                self.socket.sendto(json.dumps(record).encode(), self.address)
+            except OSError:
+                self.dropped += 1
+
+    def close(self) -> None:
+        self.socket.close()
+
+
+class SqliteSink(EventSink):
+    def __init__(self, path: str, table: str = "events"):
+        # Opened by the caller, written by the flusher thread.
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.table = table
+        columns = ", ".join(FIELDS)
+        self.connection.execute(f"CREATE TABLE IF NOT EXISTS {table} ({columns})")
+        self.connection.commit()
+        self.insert = f"INSERT INTO {table} ({columns}) VALUES ({', '.join('?' * len(FIELDS))})"
+
+    def write(self, records: List[Dict]) -> None:
+        with self.connection:
+            self.connection.executemany(self.insert, [[record[field] for field in FIELDS] for record in records])
+
+    def close(self) -> None:
+        self.connection.close()
+
+
+def open_sink(uri: str) -> EventSink:
+    """Open a sink from a URI, see the module docstring."""
+    if uri.startswith(("udp://", "unix://")):
+        return SocketSink(uri)
+    extension = os.path.splitext(uri)[1].lower()
+    if extension == ".jsonl":
+        return JsonLinesSink(uri)
+    if extension == ".csv":
+        return CsvSink(uri)
+    if extension in (".db", ".sqlite"):
+        return SqliteSink(uri)
+    raise ValueError(f"Unknown event sink {uri}, use .jsonl, .csv, .db, .sqlite, udp:// or unix://.")
+
+
+class EventWriter(object):
+    """Buffer records and write them to all sinks in batches from a thread.
+
+    emit never blocks on I/O: records are written every `flush_interval` seconds,
+    or as soon as `batch_size` records are waiting.
+    A sink which raises does not stop the thread nor the other sinks, failed writes are counted in `failures`
+    and the last exception is kept in `error`. When a sink is slower than the events, the oldest records
+    beyond `max_buffer` are dropped and counted in `dropped`.
+
+    Args:
+        sinks (List[EventSink]): Destinations of records.
+        batch_size (int): Number of waiting records which triggers a write.
+        flush_interval (float): Max seconds a record waits before it is written.
+        max_buffer (int): Max number of waiting records.
+    """
+
+    def __init__(
+        self, sinks: List[EventSink], batch_size: int = 256, flush_interval: float = 0.5, max_buffer: int = 100000
+    ):
+        self.sinks = sinks
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_buffer = max_buffer
+        self.written = 0
+        self.dropped = 0
+        self.failures = 0
+        self.error: Optional[Exception] = None
+        self._buffer: List[Dict] = []
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self.thread = threading.Thread(target=self._run, name="event-writer", daemon=True)
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            self.flush()
+
+    def emit(self, records: List[Dict]) -> None:
+        """Queue records to write."""
+        if not records:
+            return
+        with self._lock:
+            self._buffer.extend(records)
+            overflow = len(self._buffer) - self.max_buffer
+            if overflow > 0:
+                del self._buffer[:overflow]
+                self.dropped += overflow
+            full = len(self._buffer) >= self.batch_size
+        if full:
+            self._wake.set()
+
+    def flush(self) -> None:
+        """Write waiting records now."""
+        with self._flush_lock:
+            with self._lock:
+                records, self._buffer = self._buffer, []
+            if not records:
+                return
+            for sink in self.sinks:
+                try:
+                    sink.write(records)
+                except Exception as e:
+                    if self.failures == 0:
+                        print(f"Event sink {type(sink).__name__} failed: {e!r}")
+                    self.failures += 1
+                    self.error = e
+            self.written += len(records)
+
+    def start(self) -> "EventWriter":
+        self.thread.start()
+        return self
+
+    def close(self) -> None:
+        """Stop the thread, write the last records, close the sinks and report failures."""
+        self._stop.set()
+        self._wake.set()
+        if self.thread.is_alive():
+            self.thread.join()
+        self.flush()
+        for sink in self.sinks:
+            sink.close()
+        if self.failures or self.dropped:
+            print(f"Event writes failed: {self.failures}, last error: {self.error!r}, dropped records: {self.dropped}")
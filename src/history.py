@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+#
+# Copyright 2021.
+# ozora-ogino
+
+from typing import Optional, Tuple
+
+import numpy as np
+
+
+class TrackHistory(object):
+    """Last positions of live tracks in fixed size ring buffers.
+
+    Each track owns a slot of stacked arrays, holding its last `length` boxes and the frame index
+    of each. Slots of tracks dropped by Sort are freed by evict and reused, so memory only depends
+    on the number of live tracks, not on how long the stream runs.
+
+    Args:
+        length (int): Number of positions kept per track.
+        capacity (int): Initial number of slots, they grow when more tracks are alive.
+    """
+
+    def __init__(self, length: int = 32, capacity: int = 64):
+        if length < 1:
+            raise ValueError("length must be greater than 0.")
+        self.length = length
+        self.capacity = 0
+        # Track id of each slot, -1 if the slot is free.
+        self.id = np.zeros(0, dtype=np.int64)
+        self.boxes = np.zeros((0, length, 4), dtype=np.int32)
+        self.frames = np.zeros((0, length), dtype=np.int64)
+        # Number of positions written to each slot, the newest one is at (count - 1) % length.
+        self.count = np.zeros(0, dtype=np.int64)
+        self._grow(max(capacity, 1))
+
+    def _grow(self, capacity: int) -> None:
+        extra = capacity - self.capacity
+        self.id = np.concatenate([self.id, np.full(extra, -1, dtype=np.int64)])
+        self.boxes = np.concatenate([self.boxes, np.zeros((extra, self.length, 4), dtype=np.int32)])
+        self.frames = np.concatenate([self.frames, np.zeros((extra, self.length), dtype=np.int64)])
+        self.count = np.concatenate([self.count, np.zeros(extra, dtype=np.int64)])
+        self.capacity = capacity
+
+    def __len__(self) -> int:
+        """Number of tracks in the history."""
+        return int(np.count_nonzero(self.id >= 0))
+
+    def slots(self, ids: np.ndarray) -> np.ndarray:
+        """Return the slot of each track id, -1 for tracks without history."""
+        ids = np.asarray(ids, dtype=np.int64).reshape(-1)
+        used = np.flatnonzero(self.id >= 0)
+        if len(used) == 0:
+            return np.full(len(ids), -1, dtype=np.int64)
+        used = used[np.argsort(self.id[used])]
+        pos = np.minimum(np.searchsorted(self.id[used], ids), len(used) - 1)
+        return np.where(self.id[used[pos]] == ids, used[pos], -1)
+
+    def last(self, ids: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """Return the newest box of each track like (N, 4), and a (N,) bool array of tracks which have one."""
+        slots = self.slots(ids)
+        found = slots >= 0
+        boxes = self.boxes[slots, (self.count[slots] - 1) % self.length]
+        boxes[~found] = 0
+        return boxes, found
+
+    def append(self, ids: np.ndarray, boxes: np.ndarray, frame_index: int) -> None:
+        """Add boxes like (N, 4) of tracks `ids` seen on frame `frame_index`."""
+        ids = np.asarray(ids, dtype=np.int64).reshape(-1)
+        slots = self.slots(ids)
+        new = slots < 0
+        if np.any(new):
+            free = np.flatnonzero(self.id < 0)
+            missing = np.count_nonzero(new) - len(free)
+            if missing > 0:
+                self._grow(max(2 * self.capacity, self.capacity + missing))
+                free = np.flatnonzero(self.id < 0)
+            slots[new] = free[: np.count_nonzero(new)]
+            self.id[slots[new]] = ids[new]
+            self.count[slots[new]] = 0
+        pos = self.count[slots] % self.length
+        self.boxes[slots, pos] = boxes
+        self.frames[slots, pos] = frame_index
+        self.count[slots] += 1
+
+    def evict(self, alive_ids: np.ndarray) -> None:
+        """Free the slots of tracks which are not in `alive_ids`, e.g. Sort.live_ids()."""
+        self.id[(self.id >= 0) & ~np.isin(self.id, alive_ids)] = -1
+
+    def _centers(self, slots: np.ndarray, pos: np.ndarray) -> np.ndarray:
+        boxes = self.boxes[slots, pos].astype(np.float64)
+        return (boxes[..., :2] + boxes[..., 2:]) / 2
+
+    def trajectory(self, track_id: int, n: Optional[int] = None) -> np.ndarray:
+        """Return the last `n` positions of a track, all kept positions if None.
+
+        Returns:
+            np.ndarray: Array like [frame index, center x, center y], oldest first.
+        """
+        slot = int(self.slots([track_id])[0])
+        if slot < 0:
+            return np.empty((0, 3))
+        k = min(int(self.count[slot]), self.length, n if n is not None else self.length)
+        pos = (self.count[slot] - k + np.arange(k)) % self.length
+        return np.concatenate([self.frames[slot, pos, None], self._centers(slot, pos)], axis=1)
+
+    def speed(self, ids: np.ndarray, n: int = 2) -> np.ndarray:
+        """Return the speed of each track in pixels per frame over its last `n` positions.
+
+        Tracks with less than 2 positions get nan.
+        """
+        slots = self.slots(ids)
+        count = np.where(slots >= 0, self.count[slots], 0)
+        k = np.minimum(np.minimum(count, self.length), max(n, 2))
+        newest, oldest = (count - 1) % self.length, (count - k) % self.length
+        distance = np.linalg.norm(self._centers(slots, newest) - self._centers(slots, oldest), axis=1)
+        frames = self.frames[slots, newest] - self.frames[slots, oldest]
+        with np.errstate(divide="ignore", invalid="ignore"):
+            return np.where(k >= 2, distance / frames, np.nan)
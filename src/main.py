@@ -4,52 +4,57 @@
 # ozora-ogino
 
 import argparse
+import ast
 import os
+import sys
 import time
-from typing import Dict, Tuple
+from collections import deque
+from typing import Deque, Dict, Iterator, List, Optional, Tuple
 
 import cv2
 import numpy as np
 
+from counting import load_counting_config
 from detect import Detect
-from streams import VideoStream
-from tracker import Tracker
+from detection import detect_person_batch, parse_regions
+from detection_cache import DetectionCache
+from events import EventWriter, count_records, open_sink
+from metrics import Metrics, MetricsLogger, MetricsServer, NullMetrics, get_metrics
+from pipeline import Pipeline, run_serial
+from streams import LiveStream, VideoStream
+from tracker import DetectionScheduler, Tracker
 from utils import direction_config
 
+CAPTURE_BACKENDS = {"any": cv2.CAP_ANY, "ffmpeg": cv2.CAP_FFMPEG, "gstreamer": cv2.CAP_GSTREAMER}
 
-def _detect_person(
-    detect: Detect,
-    frame: np.ndarray,
-    confidence: float,
-    iou_threshold: float,
-) -> np.ndarray:
-    """Detect person objects in a frame.
-
-    Returns:
-        np.ndarray: Array like [xyxy, score].
-    """
-
-    # Detect objects in the frame.
-    boxes, scores, class_idx = detect.detect(frame)
 
-    # NMS
-    idx = cv2.dnn.NMSBoxes(boxes, scores, confidence, iou_threshold)
-    boxes = boxes[idx]
-    scores = scores[idx]
-    class_idx = class_idx[idx]
+def _read_frames(
+    stream: VideoStream,
+    batch_size: int = 1,
+    metrics: Optional[NullMetrics] = None,
+    timestamps: Optional[Deque[float]] = None,
+) -> Iterator[List[np.ndarray]]:
+    """Yield lists of up to `batch_size` frames until the stream is exhausted.
 
-    # Filter only person object (class index = 0).
-    person_idx = np.where(class_idx == 0)[0]
-    boxes = boxes[person_idx]
-    scores = scores[person_idx]
-
-    # Scale boxes by frame size.
-    H, W = frame.shape[:2]
-    boxes = detect.to_xyxy(boxes) * np.array([W, H, W, H])
+    With timestamps, the capture time of every frame of a LiveStream is appended to it.
+    """
+    metrics = get_metrics(metrics)
+    frames = []
+    while True:
+        # Read the next frame from stream.
+        with metrics.timer("decode"):
+            is_finish, frame = stream.next()
 
-    # dets:  [xmin, ymin, xmax, ymax, score]
-    dets = np.concatenate([boxes.astype(int), scores.reshape(-1, 1)], axis=1)
-    return dets
+        if not is_finish:
+            break
+        frames.append(frame)
+        if timestamps is not None:
+            timestamps.append(stream.timestamp)
+        if len(frames) == batch_size:
+            yield frames
+            frames = []
+    if frames:
+        yield frames
 
 
 def main(
@@ -60,6 +65,38 @@ def main(
     confidence: float,
     iou_threshold: float,
     directions: Dict[str, Tuple[bool]],
+    pipeline: bool = False,
+    queue_depth: int = 4,
+    batch_size: int = 1,
+    letterbox: bool = False,
+    detect_every: int = 1,
+    adaptive_detect: bool = False,
+    border_margin: float = 50.0,
+    headless: bool = False,
+    preview_every: Optional[int] = None,
+    metrics_port: int = 0,
+    metrics_log: Optional[str] = None,
+    metrics_interval: float = 10.0,
+    decode_buffer: int = 0,
+    decode_threads: int = 0,
+    decode_backend: str = "any",
+    hw_decode: bool = False,
+    frame_stride: int = 1,
+    decode_scale: float = 1.0,
+    det_cache: Optional[str] = None,
+    det_cache_size: float = 10.0,
+    num_threads: Optional[int] = None,
+    delegate: Optional[str] = None,
+    no_xnnpack: bool = False,
+    auto_tune: bool = False,
+    counting_config: Optional[str] = None,
+    events: Optional[List[str]] = None,
+    events_interval: float = 0.5,
+    live: bool = False,
+    roi: Optional[List[str]] = None,
+    roi_margin: float = 150.0,
+    tile_size: Optional[int] = None,
+    tile_overlap: float = 0.2,
 ):
     """Track human objects and count the number of human.
 
@@ -69,59 +106,310 @@ def main(
         model (str): Path to tflite weight.
         confidence (float): Confidence threshold.
         iou_threshold (float): IoU threshold for NMS.
+        pipeline (bool): Run decode, detect, track and encode on separate threads.
+        queue_depth (int): Max number of batches waiting between two pipeline stages.
+        batch_size (int): Number of frames passed to the detector in a single inference.
+                          With detect_every, batch_size * detect_every frames are read per batch.
+        letterbox (bool): Keep the aspect ratio of frames by padding them to the model input.
+        detect_every (int): Run the detector every N frames, tracks are only predicted on the other frames.
+        adaptive_detect (bool): Also run the detector when a track is near the border or uncertain.
+        border_margin (float): Distance in pixels to the border which triggers detection with adaptive_detect.
+        headless (bool): Only track and count, without drawing or encoding the output video.
+        preview_every (Optional[int]): Draw and save a preview JPEG every N frames, 0 to disable.
+                                       Defaults to every frame, or disabled with headless.
+        metrics_port (int): Serve per-stage metrics on http://127.0.0.1:<port>/metrics, 0 to disable.
+        metrics_log (Optional[str]): File to append metrics as JSON lines, "-" for stdout.
+        metrics_interval (float): Seconds between two lines of metrics_log.
+        decode_buffer (int): Number of frames decoded ahead on a background thread, 0 to decode in the loop.
+        decode_threads (int): Number of decoder threads, 0 lets the backend decide.
+        decode_backend (str): Capture backend, one of the keys of CAPTURE_BACKENDS.
+        hw_decode (bool): Use hardware accelerated decode if available.
+        frame_stride (int): Process every N-th frame of the source, the others are skipped without decoding.
+        decode_scale (float): Downscale frames by this factor at decode, e.g. 0.5 for 4K sources.
+        det_cache (Optional[str]): Directory to cache detections, reruns with the same source, model and
+                                   thresholds skip inference. With headless, frames are not even decoded.
+        det_cache_size (float): Max size of det_cache in GiB, least recently used entries are evicted.
+        num_threads (Optional[int]): Number of interpreter threads, the runtime default if None.
+        delegate (Optional[str]): Path to an external delegate library, e.g. libedgetpu.so.1.
+        no_xnnpack (bool): Disable the default XNNPACK delegate.
+        auto_tune (bool): Pick the fastest number of interpreter threads at startup.
+        counting_config (Optional[str]): JSON file of lines and zones to count, replaces the border and directions.
+        events (Optional[List[str]]): Sinks to write a record per count event, see events.open_sink.
+        events_interval (float): Max seconds an event waits before it is written to the sinks.
+        live (bool): Read src as a live camera, e.g. an RTSP URL or a device index. Only the latest frame
+                     is processed, the source is reconnected on failure and capture to count latency is reported.
+        roi (Optional[List[str]]): Regions of interest like "xmin,ymin,xmax,ymax" in pixels of the source,
+                                   or "auto" around the counting lines and zones. Only they are detected.
+        roi_margin (float): Margin in pixels around the lines and zones of the "auto" region.
+        tile_size (Optional[int]): Detect frames, or regions, in overlapping tiles of this size.
+        tile_overlap (float): Min overlap of neighbouring tiles as a fraction of tile_size.
     """
+    if preview_every is None:
+        preview_every = 0 if headless else 1
+    if adaptive_detect and (pipeline or batch_size > 1):
+        raise ValueError("adaptive_detect needs the latest tracks, it cannot be used with pipeline or batch_size.")
+    if live and (det_cache or decode_buffer or frame_stride != 1 or decode_scale != 1.0):
+        raise ValueError("live cannot be used with det_cache, decode_buffer, frame_stride or decode_scale.")
+
     if not os.path.exists(dest):
         os.mkdir(dest)
 
-    # The line to count.
+    model_name = os.path.basename(model).split(".")[0]
+    video_name = os.path.basename(src).split(".")[0]
+    basename = f"{video_name}_{model_name}"
+
+    metrics = None
+    if metrics_port or metrics_log or live:
+        metrics = Metrics(stream=video_name)
+
+    # The line to count, in pixels of the source video.
     border = [(0, 500), (1920, 500)]
+    border = [(int(x * decode_scale), int(y * decode_scale)) for x, y in border]
     directions = {key: direction_config.get(d_str) for key, d_str in directions.items()}
-    tracker = Tracker(border, directions)
-    detect = Detect(model, confidence)
-    stream = VideoStream(src)
+    counting = load_counting_config(counting_config, decode_scale) if counting_config else None
+    tracker = Tracker(border, directions, metrics=metrics, counting=counting)
+    regions = parse_regions(roi, tracker, roi_margin, decode_scale)
+    if regions is not None:
+        print(f"Regions of interest: {regions}")
+    scheduler = DetectionScheduler(tracker, detect_every, adaptive_detect, border_margin)
+
+    cached, cache_writer = None, None
+    if det_cache:
+        cache = DetectionCache(det_cache, int(det_cache_size * 2**30))
+        cache_params = dict(
+            confidence=confidence,
+            iou_threshold=iou_threshold,
+            letterbox=letterbox,
+            classes=[0],
+            frame_stride=frame_stride,
+            decode_scale=decode_scale,
+            regions=regions,
+            tile_size=tile_size,
+            tile_overlap=tile_overlap,
+        )
+        cache_key = cache.key(src, model, **cache_params)
+        cached = cache.load(cache_key)
+        if cached is not None:
+            print(f"Using cached detections of {len(cached)} frames.")
+        if cached is None or not cached.complete():
+            # Frames missing from a partial entry, e.g. of a run with a larger detect_every, are added to it.
+            cache_writer = cache.writer(cache_key, base=cached, src=src, model=model, **cache_params)
+
+    # The model is loaded on the first frame missing in the cache.
+    detect = None
+
+    def get_detect() -> Detect:
+        nonlocal detect
+        if detect is None:
+            # Person is class index 0.
+            detect = Detect(
+                model,
+                confidence,
+                letterbox=letterbox,
+                classes=[0],
+                iou_thr=iou_threshold,
+                metrics=metrics,
+                num_threads=num_threads,
+                delegate=delegate,
+                xnnpack=not no_xnnpack,
+                auto_tune=auto_tune,
+                regions=regions,
+                tile_size=tile_size,
+                tile_overlap=tile_overlap,
+            )
+            if batch_size > 1:
+                # Resizing the input for batches allocates tensors again, do it before the first frame too.
+                detect.config["warmup_ms"] += round(detect.warmup(batch_size) * 1000, 3)
+            print(f"Detect config: {detect.config}")
+        return detect
+
+    if cached is None:
+        get_detect()
+
+    # Frames of a batch hold batch_size frames to detect, so every inference has the same batch size
+    # and the input of the interpreter is never resized.
+    frames_per_batch = batch_size * detect_every if batch_size > 1 else 1
+
+    # Counting only needs the cached detections, frames are neither decoded nor drawn.
+    skip_decode = cached is not None and cached.complete() and headless and preview_every == 0
+    stream = None
+    # Capture time of each frame of a live stream, until it is tracked.
+    capture_times = None
+    if skip_decode:
+        total_frames = len(cached)
+    elif live:
+        stream = LiveStream(src, backend=CAPTURE_BACKENDS[decode_backend], metrics=metrics)
+        capture_times = deque()
+        total_frames = 0
+    else:
+        # Frames in use after decode: a batch in serial mode, or the 3 queues and the threads of the pipeline.
+        hold = frames_per_batch if not pipeline else 3 * (queue_depth + 2) * frames_per_batch
+        stream = VideoStream(
+            src,
+            backend=CAPTURE_BACKENDS[decode_backend],
+            hw_accel=hw_decode,
+            decode_threads=decode_threads,
+            buffer_size=decode_buffer,
+            hold=hold,
+            stride=frame_stride,
+            scale=decode_scale,
+        )
+        total_frames = len(stream)
     writer = None
 
-    total_frames = len(stream)
     if total_frames:
-        print(f"Total frames: {len(stream)}")
+        print(f"Total frames: {total_frames}")
 
-    while True:
-        # Read the next frame from stream.
-        is_finish, frame = stream.next()
+    server, logger, log_file = None, None, None
+    if metrics_port:
+        server = MetricsServer(lambda: [metrics], port=metrics_port).start()
+        print(f"Serving metrics on http://127.0.0.1:{server.port}/metrics")
+    if metrics_log:
+        log_file = sys.stdout if metrics_log == "-" else open(metrics_log, "a")
+        logger = MetricsLogger(lambda: [metrics], log_file, metrics_interval).start()
 
-        if not is_finish:
-            break
+    event_writer = None
+    if events:
+        event_writer = EventWriter([open_sink(uri) for uri in events], flush_interval=events_interval).start()
+
+    detect_index = 0
 
+    def detect_stage(frames: List[np.ndarray]) -> Tuple[List[np.ndarray], List[Optional[np.ndarray]], float]:
+        nonlocal detect_index
         start = time.time()
-        dets = _detect_person(detect, frame, confidence, iou_threshold)
+        # dets is None for frames where the detector is skipped.
+        dets = [None] * len(frames)
+        targets = [i for i in range(len(frames)) if scheduler.should_detect()]
+        if targets:
+            missing = []
+            for i in targets:
+                if cached is not None and cached.is_detected(detect_index + i):
+                    dets[i] = cached[detect_index + i]
+                else:
+                    missing.append(i)
+            if missing:
+                batch = [frames[i] for i in missing]
+                if batch_size > 1:
+                    # Pad the last batch, or frames missing from the cache, up to the batch size of the warmup.
+                    batch += [batch[-1]] * (batch_size - len(batch))
+                results = detect_person_batch(get_detect(), batch)
+                for i, result in zip(missing, results):
+                    dets[i] = result
+                    if cache_writer is not None:
+                        cache_writer.append(detect_index + i, result)
+        detect_index += len(frames)
         end = time.time()
+        return frames, dets, (end - start) / len(frames)
+
+    frame_index = 0
+    is_first = True
+
+    def track_stage(
+        item: Tuple[List[np.ndarray], List[Optional[np.ndarray]], float],
+    ) -> Tuple[List[Tuple[np.ndarray, bool]], float]:
+        nonlocal frame_index
+        frames, dets, second_per_frame = item
+        rendered = []
+        for frame, d in zip(frames, dets):
+            # Update tracker and counter.
+            # dets:  [xmin, ymin, xmax, ymax, score]
+            timestamp = capture_times.popleft() if capture_times is not None else time.time()
+            tracker.track(d)
+            if capture_times is not None:
+                metrics.observe("latency", time.time() - timestamp)
+            if event_writer is not None and tracker.events:
+                records = count_records(
+                    tracker.events, tracker.tracks, frame_index * frame_stride, timestamp, video_name
+                )
+                event_writer.emit(records)
+            is_preview = preview_every > 0 and frame_index % preview_every == 0
+            # Draw bounding boxes in frame only if it is encoded or saved.
+            if not headless or is_preview:
+                tracker.draw(frame)
+            rendered.append((frame, is_preview))
+            frame_index += 1
+        return rendered, second_per_frame
+
+    def encode_stage(item: Tuple[List[Tuple[np.ndarray, bool]], float]) -> None:
+        rendered, second_per_frame = item
+        if metrics is None:
+            _encode(rendered, second_per_frame)
+            return
+
+        with metrics.timer("encode"):
+            _encode(rendered, second_per_frame)
+        for _ in rendered:
+            metrics.mark_frame()
+        if pipeline_runner is not None:
+            for name, size in zip(["detect", "track", "encode"], pipeline_runner.qsizes()):
+                metrics.set_gauge("queue_depth", size, queue=name)
+
+    def _encode(rendered: List[Tuple[np.ndarray, bool]], second_per_frame: float) -> None:
+        nonlocal writer, is_first
+
+        for frame, is_preview in rendered:
+            # Executed only first time.
+            if is_first:
+                is_first = False
+                # Estimate total time.
+                print(f"Computation time per a frame: {second_per_frame:.4f} seconds")
+                if total_frames:
+                    print(f"Estimated total time: {second_per_frame * total_frames:.4f}")
+
+            # Save frame as an image and video.
+            if is_preview:
+                cv2.imwrite(os.path.join(dest, f"{basename}.jpg"), frame)
+
+            if headless:
+                continue
+
+            if writer is None:
+                # Initialize video writer.
+                codecs = {"mp4": "MP4V", "avi": "MJPG"}
+                output_video = os.path.join(dest, f"{basename}.{video_fmt}")
+                fourcc = cv2.VideoWriter_fourcc(*codecs[video_fmt])
+                writer = cv2.VideoWriter(output_video, fourcc, 30, (frame.shape[1], frame.shape[0]), True)
+            writer.write(frame)
+
+    stages = [detect_stage, track_stage]
+    if skip_decode:
+        frames = (
+            [None] * min(frames_per_batch, total_frames - start) for start in range(0, total_frames, frames_per_batch)
+        )
+    else:
+        frames = _read_frames(stream, frames_per_batch, metrics, capture_times)
+    pipeline_runner = None
+    interrupted = False
+    try:
+        if pipeline:
+            pipeline_runner = Pipeline(frames, stages, encode_stage, queue_depth)
+            pipeline_runner.run()
+        else:
+            run_serial(frames, stages, encode_stage)
+    except KeyboardInterrupt:
+        # Live streams never end, stop on Ctrl+C and still write the results.
+        print("Interrupted.")
+        interrupted = True
 
-        # Update tracker and draw bounding boxes in frame.
-        # dets:  [xmin, ymin, xmax, ymax, score]
-        frame = tracker.update(frame, dets)
-
-        # Executed only first time.
-        if writer is None:
-            # Initialize video writer.
-            model_name = os.path.basename(model).split(".")[0]
-            video_name = os.path.basename(src).split(".")[0]
-            codecs = {"mp4": "MP4V", "avi": "MJPG"}
-            basename = f"{video_name}_{model_name}"
-            output_video = os.path.join(dest, f"{basename}.{video_fmt}")
-            fourcc = cv2.VideoWriter_fourcc(*codecs[video_fmt])
-            writer = cv2.VideoWriter(output_video, fourcc, 30, (frame.shape[1], frame.shape[0]), True)
-
-            # Estimate total time.
-            second_per_frame = end - start
-            print(f"Computation time per a frame: {second_per_frame:.4f} seconds")
-            print(f"Estimated total time: {second_per_frame * total_frames:.4f}")
-
-        # Save frame as an image and video.
-        cv2.imwrite(os.path.join(dest, f"{basename}.jpg"), frame)
-        writer.write(frame)
-
-    writer.release()
-    stream.release()
+    if writer is not None:
+        writer.release()
+    if stream is not None:
+        stream.release()
+    # Detections of an interrupted run do not cover the whole source, they are discarded.
+    if cache_writer is not None and cache_writer.appended and not interrupted:
+        cache_writer.commit(detect_index)
+    if event_writer is not None:
+        event_writer.close()
+    if logger is not None:
+        logger.stop()
+        if log_file is not sys.stdout:
+            log_file.close()
+    if server is not None:
+        server.stop()
+    if live:
+        print(f"Capture to count latency (ms): {metrics.snapshot()['stages'].get('latency')}")
+        print(f"Dropped frames: {stream.dropped}, reconnects: {stream.reconnects}")
+    print(f"Counter: {tracker.counter}")
     print("Done!")
 
 
@@ -134,7 +422,54 @@ if __name__ == "__main__":
     parser.add_argument("--video-fmt", help="Format of output video file.", choices=["mp4", "avi"], default="mp4")
     parser.add_argument("--confidence", type=float, default=0.2, help="Confidence threshold.")
     parser.add_argument("--iou-threshold", type=float, default=0.2, help="IoU threshold for NMS.")
-    parser.add_argument("--directions", default={"total": None}, type=eval, help="Directions")
+    parser.add_argument("--directions", default={"total": None}, type=ast.literal_eval, help="Directions")
+    parser.add_argument("--counting-config", default=None, help="JSON file of lines and zones to count.")
+    parser.add_argument(
+        "--events", nargs="+", default=None, help="Write count events to .jsonl, .csv, .db, udp:// or unix:// sinks."
+    )
+    parser.add_argument("--events-interval", type=float, default=0.5, help="Max seconds before events are written.")
+    parser.add_argument(
+        "--live", action="store_true", help="Read --src as a live camera (RTSP URL or device index), latest frame only."
+    )
+    parser.add_argument(
+        "--roi", nargs="+", default=None, help="Regions to detect as xmin,ymin,xmax,ymax, or auto around the lines."
+    )
+    parser.add_argument("--roi-margin", type=float, default=150.0, help="Margin of the --roi auto region in pixels.")
+    parser.add_argument("--tile-size", type=int, default=None, help="Detect in overlapping tiles of this size.")
+    parser.add_argument("--tile-overlap", type=float, default=0.2, help="Min overlap of tiles, fraction of the size.")
+    parser.add_argument(
+        "--pipeline", action="store_true", help="Run decode, detect, track and encode stages on separate threads."
+    )
+    parser.add_argument("--queue-depth", type=int, default=4, help="Max batches waiting between pipeline stages.")
+    parser.add_argument("--batch-size", type=int, default=1, help="Number of frames per inference.")
+    parser.add_argument("--letterbox", action="store_true", help="Keep aspect ratio when resizing to the model input.")
+    parser.add_argument("--detect-every", type=int, default=1, help="Run the detector every N frames.")
+    parser.add_argument(
+        "--adaptive-detect", action="store_true", help="Also detect when a track is near the border or uncertain."
+    )
+    parser.add_argument("--border-margin", type=float, default=50.0, help="Border distance for --adaptive-detect.")
+    parser.add_argument("--headless", action="store_true", help="Only count, without drawing or encoding video.")
+    parser.add_argument(
+        "--preview-every",
+        type=int,
+        default=None,
+        help="Save a preview JPEG every N frames, 0 to disable. Defaults to 1, or 0 with --headless.",
+    )
+    parser.add_argument("--metrics-port", type=int, default=0, help="Serve Prometheus metrics on this port.")
+    parser.add_argument("--metrics-log", default=None, help="Append metrics as JSON lines to this file, - for stdout.")
+    parser.add_argument("--metrics-interval", type=float, default=10.0, help="Seconds between metrics log lines.")
+    parser.add_argument("--decode-buffer", type=int, default=0, help="Frames decoded ahead on a background thread.")
+    parser.add_argument("--decode-threads", type=int, default=0, help="Number of decoder threads, 0 for auto.")
+    parser.add_argument("--decode-backend", choices=list(CAPTURE_BACKENDS), default="any", help="Capture backend.")
+    parser.add_argument("--hw-decode", action="store_true", help="Use hardware accelerated decode if available.")
+    parser.add_argument("--frame-stride", type=int, default=1, help="Process every N-th frame of the source.")
+    parser.add_argument("--decode-scale", type=float, default=1.0, help="Downscale frames at decode, e.g. 0.5.")
+    parser.add_argument("--det-cache", default=None, help="Directory to cache detections for reruns.")
+    parser.add_argument("--det-cache-size", type=float, default=10.0, help="Max size of --det-cache in GiB.")
+    parser.add_argument("--num-threads", type=int, default=None, help="Number of interpreter threads.")
+    parser.add_argument("--delegate", default=None, help="Path to an external delegate library.")
+    parser.add_argument("--no-xnnpack", action="store_true", help="Disable the default XNNPACK delegate.")
+    parser.add_argument("--auto-tune", action="store_true", help="Pick the fastest number of interpreter threads.")
 
     args = vars(parser.parse_args())
     main(**args)
@@ -0,0 +1,244 @@
+#!/usr/bin/env python3
+#
+# Copyright 2021.
+# ozora-ogino
+
+import json
+import threading
+import time
+from collections import defaultdict, deque
+from contextlib import contextmanager, nullcontext
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, Iterator, List, Optional, TextIO, Tuple
+
+import numpy as np
+
+QUANTILES = (0.5, 0.95, 0.99)
+
+
+class NullMetrics(object):
+    """Metrics which record nothing, used when instrumentation is disabled."""
+
+    def timer(self, stage: str):
+        return nullcontext()
+
+    def observe(self, stage: str, seconds: float) -> None:
+        pass
+
+    def inc(self, name: str, value: int = 1) -> None:
+        pass
+
+    def set_gauge(self, name: str, value: float, **labels) -> None:
+        pass
+
+    def mark_frame(self) -> None:
+        pass
+
+
+class Metrics(NullMetrics):
+    """Per-stage latency, counters and gauges of a stream.
+
+    Latencies are kept for the last `window` samples of each stage to report quantiles.
+
+    Args:
+        stream (str): Name of the stream, used as a label.
+        window (int): Number of samples kept per stage and for FPS.
+    """
+
+    def __init__(self, stream: str = "default", window: int = 1000):
+        self.stream = stream
+        self.window = window
+        self._lock = threading.Lock()
+        self._samples: Dict[str, deque] = defaultdict(lambda: deque(maxlen=window))
+        self._sums: Dict[str, float] = defaultdict(float)
+        self._counts: Dict[str, int] = defaultdict(int)
+        self._counters: Dict[str, int] = defaultdict(int)
+        self._gauges: Dict[Tuple[str, Tuple], float] = {}
+        self._frame_times = deque(maxlen=window)
+
+    @contextmanager
+    def timer(self, stage: str) -> Iterator[None]:
+        """Measure the time spent in the with block as a sample of `stage`."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(stage, time.perf_counter() - start)
+
+    def observe(self, stage: str, seconds: float) -> None:
+        """Add a latency sample of `stage` in seconds."""
+        with self._lock:
+            self._samples[stage].append(seconds)
+            self._sums[stage] += seconds
+            self._counts[stage] += 1
+
+    def inc(self, name: str, value: int = 1) -> None:
+        """Increase a counter such as dropped_frames."""
+        with self._lock:
+            self._counters[name] += value
+
+    def set_gauge(self, name: str, value: float, **labels) -> None:
+        """Set a gauge such as queue_depth."""
+        with self._lock:
+            self._gauges[(name, tuple(sorted(labels.items())))] = value
+
+    def mark_frame(self) -> None:
+        """Count a processed frame, used for FPS."""
+        with self._lock:
+            self._frame_times.append(time.perf_counter())
+            self._counters["frames"] += 1
+
+    def fps(self) -> float:
+        """Frames per second over the last `window` frames."""
+        with self._lock:
+            if len(self._frame_times) < 2:
+                return 0.0
+            elapsed = self._frame_times[-1] - self._frame_times[0]
+            return (len(self._frame_times) - 1) / elapsed if elapsed > 0 else 0.0
+
+    def snapshot(self) -> Dict:
+        """Return all metrics as a JSON serializable dict. Latencies are in milliseconds."""
+        fps = self.fps()
+        with self._lock:
+            stages = {}
+            for stage, samples in self._samples.items():
+                values = np.quantile(np.asarray(samples), QUANTILES) * 1000
+                stages[stage] = {f"p{int(q * 100)}": float(v) for q, v in zip(QUANTILES, values)}
+                stages[stage]["mean"] = self._sums[stage] / self._counts[stage] * 1000
+                stages[stage]["count"] = self._counts[stage]
+            gauges = {}
+            for (name, labels), value in self._gauges.items():
+                key = name + "".join(f"[{v}]" for _, v in labels)
+                gauges[key] = value
+            return {
+                "stream": self.stream,
+                "fps": fps,
+                "stages": stages,
+                "counters": dict(self._counters),
+                "gauges": gauges,
+            }
+
+    def prometheus_families(self) -> Dict[Tuple[str, str], List[str]]:
+        """Return Prometheus text lines grouped by (metric family, type)."""
+        fps = self.fps()
+        families = defaultdict(list)
+        with self._lock:
+            for stage, samples in self._samples.items():
+                labels = f'stream="{self.stream}",stage="{stage}"'
+                lines = families[("tracking_stage_seconds", "summary")]
+                for q, v in zip(QUANTILES, np.quantile(np.asarray(samples), QUANTILES)):
+                    lines.append(f'tracking_stage_seconds{{{labels},quantile="{q}"}} {v:.6f}')
+                lines.append(f"tracking_stage_seconds_sum{{{labels}}} {self._sums[stage]:.6f}")
+                lines.append(f"tracking_stage_seconds_count{{{labels}}} {self._counts[stage]}")
+            for name, value in self._counters.items():
+                families[(f"tracking_{name}_total", "counter")].append(
+                    f'tracking_{name}_total{{stream="{self.stream}"}} {value}'
+                )
+            for (name, labels), value in self._gauges.items():
+                label_str = "".join(f',{k}="{v}"' for k, v in labels)
+                families[(f"tracking_{name}", "gauge")].append(
+                    f'tracking_{name}{{stream="{self.stream}"{label_str}}} {value}'
+                )
+        families[("tracking_fps", "gauge")].append(f'tracking_fps{{stream="{self.stream}"}} {fps:.3f}')
+        return families
+
+
+def to_prometheus(metrics: List[Metrics]) -> str:
+    """Render metrics of several streams in the Prometheus text exposition format."""
+    families = defaultdict(list)
+    for m in metrics:
+        for key, lines in m.prometheus_families().items():
+            families[key].extend(lines)
+
+    text = []
+    for (name, metric_type), lines in families.items():
+        text.append(f"# TYPE {name} {metric_type}")
+        text.extend(lines)
+    return "\n".join(text) + "\n"
+
+
+class MetricsServer(object):
+    """Serve metrics in the Prometheus text format on http://<host>:<port>/metrics from a thread.
+
+    Args:
+        metrics (Callable[[], List[Metrics]]): Return metrics to serve.
+        port (int): Port to listen. 0 picks a free port, see `port` after start.
+        host (str): Host to listen.
+    """
+
+    def __init__(self, metrics: Callable[[], List[Metrics]], port: int = 9100, host: str = "127.0.0.1"):
+        metrics_source = metrics
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):  # pylint: disable=invalid-name
+                if self.path.split("?")[0] not in ("/metrics", "/metrics.json"):
+                    self.send_error(404)
+                    return
+                if self.path.startswith("/metrics.json"):
+                    body = json.dumps([m.snapshot() for m in metrics_source()]).encode()
+                    content_type = "application/json"
+                else:
+                    body = to_prometheus(metrics_source()).encode()
+                    content_type = "text/plain; version=0.0.4"
+                self.send_response(200)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):  # pylint: disable=redefined-builtin
+                pass
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.port = self.server.server_address[1]
+        self.thread = threading.Thread(target=self.server.serve_forever, name="metrics-server", daemon=True)
+
+    def start(self) -> "MetricsServer":
+        self.thread.start()
+        return self
+
+    def stop(self) -> None:
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class MetricsLogger(object):
+    """Write a JSON line with the snapshot of every stream every `interval` seconds from a thread.
+
+    Args:
+        metrics (Callable[[], List[Metrics]]): Return metrics to log.
+        output (TextIO): File to write, e.g. sys.stdout.
+        interval (float): Seconds between two lines.
+    """
+
+    def __init__(self, metrics: Callable[[], List[Metrics]], output: TextIO, interval: float = 10.0):
+        self.metrics = metrics
+        self.output = output
+        self.interval = interval
+        self._stop = threading.Event()
+        self.thread = threading.Thread(target=self._run, name="metrics-logger", daemon=True)
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            self.log()
+
+    def log(self) -> None:
+        """Write a line now."""
+        line = {"time": time.time(), "streams": [m.snapshot() for m in self.metrics()]}
+        self.output.write(json.dumps(line) + "\n")
+        self.output.flush()
+
+    def start(self) -> "MetricsLogger":
+        self.thread.start()
+        return self
+
+    def stop(self) -> None:
+        """Stop the thread and write the last line."""
+        self._stop.set()
+        self.thread.join()
+        self.log()
+
+
+def get_metrics(metrics: Optional[NullMetrics]) -> NullMetrics:
+    """Return `metrics`, or metrics recording nothing if it is None."""
+    return NullMetrics() if metrics is None else metrics
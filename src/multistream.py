@@ -0,0 +1,295 @@
+#!/usr/bin/env python3
+#
+# Copyright 2021.
+# ozora-ogino
+
+import argparse
+import ast
+import threading
+from collections import deque
+from typing import Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from counting import load_counting_config
+from detect import Detect
+from detection import detect_person
+from metrics import Metrics, MetricsServer
+from streams import BaseStream, VideoStream
+from tracker import Tracker
+from utils import direction_config
+
+
+class _Source(object):
+    """State of a single stream in MultiStreamRunner."""
+
+    def __init__(self, name: str, stream: BaseStream, tracker: Tracker, max_pending: int):
+        self.name = name
+        self.stream = stream
+        self.tracker = tracker
+        # Frames waiting for detection as (frame index, frame).
+        self.pending = deque(maxlen=max_pending)
+        self.metrics = Metrics(stream=name)
+        self.frame_count = 0
+        self.processed = 0
+        self.dropped = 0
+        # True while a worker is processing a frame of this stream.
+        self.busy = False
+        # True when the stream has no more frames.
+        self.finished = False
+
+
+class MultiStreamRunner(object):
+    """Track many streams in one process with a shared pool of Detect interpreters.
+
+    Every stream has its own reader thread, Tracker and counters. Worker threads, one per
+    Detect, take frames from the streams in round-robin order. Only one worker processes a
+    given stream at a time, so the frames of each stream reach its Tracker in order.
+    When a stream has `max_pending` frames waiting, the oldest one is dropped.
+
+    Args:
+        streams (Dict[str, BaseStream]): Streams by name.
+        detects (List[Detect]): Interpreter pool. Each instance is used by one worker.
+        tracker_factory (Callable[[], Tracker]): Create a Tracker for each stream.
+        max_pending (int): Max number of frames waiting for detection per stream.
+        drop_oldest (bool): Drop the oldest frame when a stream falls behind.
+                            If False, the reader waits instead (e.g. for video files).
+        frame_callback (Optional[Callable]): Called with (name, frame index, frame) after tracking.
+    """
+
+    def __init__(
+        self,
+        streams: Dict[str, BaseStream],
+        detects: List[Detect],
+        tracker_factory: Callable[[], Tracker],
+        max_pending: int = 4,
+        drop_oldest: bool = True,
+        frame_callback: Optional[Callable[[str, int, np.ndarray], None]] = None,
+    ):
+        if not detects:
+            raise ValueError("At least one Detect is required.")
+        self.sources = [_Source(name, stream, tracker_factory(), max_pending) for name, stream in streams.items()]
+        self.detects = detects
+        self.drop_oldest = drop_oldest
+        self.frame_callback = frame_callback
+        self._cond = threading.Condition()
+        self._next = 0
+        self._error: Optional[BaseException] = None
+
+    def _read(self, source: _Source) -> None:
+        """Read frames of a stream until it is exhausted."""
+        try:
+            while self._error is None:
+                is_finish, frame = source.stream.next()
+                if not is_finish:
+                    break
+                with self._cond:
+                    if len(source.pending) == source.pending.maxlen:
+                        if self.drop_oldest:
+                            source.dropped += 1
+                            source.metrics.inc("dropped_frames")
+                        else:
+                            self._cond.wait_for(
+                                lambda: len(source.pending) < source.pending.maxlen or self._error is not None
+                            )
+                    source.pending.append((source.frame_count, frame))
+                    source.frame_count += 1
+                    source.metrics.set_gauge("queue_depth", len(source.pending), queue="pending")
+                    self._cond.notify_all()
+        except BaseException as e:
+            self._fail(e)
+        finally:
+            with self._cond:
+                source.finished = True
+                self._cond.notify_all()
+
+    def _take(self) -> Optional[Tuple[_Source, int, np.ndarray]]:
+        """Wait for the next stream in round-robin order with a frame and no active worker.
+
+        Returns None when all streams are finished.
+        """
+        with self._cond:
+            while self._error is None:
+                for i in range(len(self.sources)):
+                    source = self.sources[(self._next + i) % len(self.sources)]
+                    if source.pending and not source.busy:
+                        self._next = (self._next + i + 1) % len(self.sources)
+                        source.busy = True
+                        index, frame = source.pending.popleft()
+                        self._cond.notify_all()
+                        return source, index, frame
+                if all(source.finished and not source.pending for source in self.sources):
+                    return None
+                self._cond.wait()
+            return None
+
+    def _work(self, detect: Detect) -> None:
+        """Detect and track frames with a Detect of the pool."""
+        try:
+            while True:
+                task = self._take()
+                if task is None:
+                    return
+                source, index, frame = task
+                try:
+                    with source.metrics.timer("detect"):
+                        dets = detect_person(detect, frame)
+                    with source.metrics.timer("track"):
+                        source.tracker.track(dets)
+                    # Draw only when somebody consumes the frames.
+                    if self.frame_callback:
+                        with source.metrics.timer("draw"):
+                            frame = source.tracker.draw(frame)
+                        self.frame_callback(source.name, index, frame)
+                    source.metrics.mark_frame()
+                finally:
+                    with self._cond:
+                        source.busy = False
+                        source.processed += 1
+                        self._cond.notify_all()
+        except BaseException as e:
+            self._fail(e)
+
+    def _fail(self, error: BaseException) -> None:
+        with self._cond:
+            if self._error is None:
+                self._error = error
+            self._cond.notify_all()
+
+    def run(self) -> None:
+        """Process all streams until they are exhausted.
+
+        Raises the first exception raised by a reader or a worker.
+        """
+        threads = [
+            threading.Thread(target=self._read, args=(source,), name=f"reader-{source.name}", daemon=True)
+            for source in self.sources
+        ]
+        threads += [
+            threading.Thread(target=self._work, args=(detect,), name=f"worker-{i}", daemon=True)
+            for i, detect in enumerate(self.detects)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        for source in self.sources:
+            source.stream.release()
+
+        if self._error is not None:
+            raise self._error
+
+    def metrics(self) -> List[Metrics]:
+        """Return metrics of every stream."""
+        return [source.metrics for source in self.sources]
+
+    def stats(self) -> Dict[str, Dict]:
+        """Return counters, processed and dropped frames of each stream."""
+        with self._cond:
+            return {
+                source.name: {
+                    "counter": dict(source.tracker.counter),
+                    "processed": source.processed,
+                    "dropped": source.dropped,
+                }
+                for source in self.sources
+            }
+
+
+def main(
+    src: List[str],
+    model: str,
+    confidence: float,
+    iou_threshold: float,
+    directions: Dict[str, Tuple[bool]],
+    workers: int,
+    max_pending: int,
+    drop: bool,
+    metrics_port: int,
+    num_threads: Optional[int] = None,
+    auto_tune: bool = False,
+    counting_config: Optional[str] = None,
+):
+    """Track human objects in several videos with a shared interpreter pool.
+
+    Args:
+        src (List[str]): Source videos.
+        model (str): Path to tflite weight.
+        confidence (float): Confidence threshold.
+        iou_threshold (float): IoU threshold for NMS.
+        workers (int): Number of Detect interpreters shared by all streams.
+        max_pending (int): Max number of frames waiting for detection per stream.
+        drop (bool): Drop the oldest waiting frame when a stream falls behind the workers, e.g. for live cameras.
+                     Otherwise the reader waits, so every frame of a video file is counted.
+        metrics_port (int): Serve per-stream metrics on http://127.0.0.1:<port>/metrics, 0 to disable.
+        num_threads (Optional[int]): Threads of each interpreter. Defaults to the cores split between workers.
+        auto_tune (bool): Pick the fastest number of threads for each interpreter within its share of cores.
+        counting_config (Optional[str]): JSON file of lines and zones to count, replaces the border and directions.
+    """
+    # The line to count.
+    border = [(0, 500), (1920, 500)]
+    directions = {key: direction_config.get(d_str) for key, d_str in directions.items()}
+    # Person is class index 0.
+    # Latency of preprocess, invoke, postprocess and nms is shared by all streams.
+    pool_metrics = Metrics(stream="detect-pool")
+    detects = [
+        Detect(
+            model,
+            confidence,
+            classes=[0],
+            iou_thr=iou_threshold,
+            metrics=pool_metrics,
+            num_threads=num_threads,
+            auto_tune=auto_tune,
+            num_interpreters=workers,
+        )
+        for _ in range(workers)
+    ]
+    print(f"Detect config: {detects[0].config}")
+    streams = {f"{i}:{path}": VideoStream(path) for i, path in enumerate(src)}
+
+    runner = MultiStreamRunner(
+        streams,
+        detects,
+        # Every stream counts on its own lines and zones.
+        lambda: Tracker(
+            border, directions, counting=load_counting_config(counting_config) if counting_config else None
+        ),
+        max_pending=max_pending,
+        drop_oldest=drop,
+    )
+    server = None
+    if metrics_port:
+        server = MetricsServer(lambda: runner.metrics() + [pool_metrics], port=metrics_port).start()
+        print(f"Serving metrics on http://127.0.0.1:{server.port}/metrics")
+    runner.run()
+    if server is not None:
+        server.stop()
+
+    for name, stats in runner.stats().items():
+        print(f"{name}: {stats}")
+    print("Done!")
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--src", nargs="+", help="Paths to video sources.", required=True)
+    parser.add_argument("--model", help="Path to YOLOv5 tflite file", default="./models/yolov5n6-fp16.tflite")
+    parser.add_argument("--confidence", type=float, default=0.2, help="Confidence threshold.")
+    parser.add_argument("--iou-threshold", type=float, default=0.2, help="IoU threshold for NMS.")
+    parser.add_argument("--directions", default={"total": None}, type=ast.literal_eval, help="Directions")
+    parser.add_argument("--counting-config", default=None, help="JSON file of lines and zones to count.")
+    parser.add_argument("--workers", type=int, default=2, help="Number of shared Detect interpreters.")
+    parser.add_argument("--max-pending", type=int, default=4, help="Max frames waiting per stream.")
+    parser.add_argument(
+        "--drop",
+        action="store_true",
+        help="Drop the oldest waiting frame when a stream falls behind, for live sources. Counts of files are lossy.",
+    )
+    parser.add_argument("--metrics-port", type=int, default=0, help="Serve Prometheus metrics on this port.")
+    parser.add_argument("--num-threads", type=int, default=None, help="Threads of each interpreter.")
+    parser.add_argument("--auto-tune", action="store_true", help="Pick the fastest number of interpreter threads.")
+
+    args = vars(parser.parse_args())
+    main(**args)
@@ -0,0 +1,212 @@
+#!/usr/bin/env python3
+#
+# Copyright 2021.
+# ozora-ogino
+
+import argparse
+import ast
+import os
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+import cv2
+import numpy as np
+
+from counting import load_counting_config
+from detect import Detect
+from detection import detect_person, parse_regions
+from events import EventWriter, count_records, open_sink
+from streams import VideoStream
+from tracker import Tracker
+from utils import direction_config
+
+# Detect of the worker process, created once by _init_worker.
+_worker_detect = None
+
+
+def _init_worker(detect_factory: Callable[[], Detect]) -> None:
+    global _worker_detect
+    _worker_detect = detect_factory()
+
+
+def _detect_chunk(src: str, start: int, end: Optional[int], detect_every: int) -> List[Optional[np.ndarray]]:
+    """Detect person objects in frames [start, end) of a video, until the end of the video if end is None.
+
+    Returns:
+        List[Optional[np.ndarray]]: Array like [xyxy, score] for each frame, None on frames skipped by detect_every.
+    """
+    stream = VideoStream(src)
+    try:
+        if start > 0:
+            stream.stream.set(cv2.CAP_PROP_POS_FRAMES, start)
+            if int(stream.stream.get(cv2.CAP_PROP_POS_FRAMES)) != start:
+                raise RuntimeError(f"Failed to seek {src} to frame {start}.")
+
+        dets = []
+        index = start
+        while end is None or index < end:
+            is_finish, frame = stream.next()
+            if not is_finish:
+                break
+            dets.append(detect_person(_worker_detect, frame) if index % detect_every == 0 else None)
+            index += 1
+        return dets
+    finally:
+        stream.release()
+
+
+def detect_chunks(
+    src: str,
+    detect_factory: Callable[[], Detect],
+    workers: int,
+    chunk_frames: int = 300,
+    detect_every: int = 1,
+) -> Iterator[Optional[np.ndarray]]:
+    """Detect person objects in chunks of a video on a process pool, and yield detections in frame order.
+
+    Each worker process creates its own Detect with detect_factory, which must be picklable
+    (e.g. functools.partial of Detect). At most 2 chunks per worker are in flight, so memory
+    stays bounded however long the video is.
+
+    Args:
+        src (str): Source video, seekable by frame index.
+        detect_factory (Callable[[], Detect]): Create Detect in a worker.
+        workers (int): Number of worker processes.
+        chunk_frames (int): Number of frames of a chunk.
+        detect_every (int): Run the detector on frames 0, N, 2N, ... like DetectionScheduler, None on the others.
+
+    Yields:
+        Optional[np.ndarray]: Array like [xyxy, score] of each frame of the video.
+    """
+    stream = VideoStream(src)
+    total_frames = len(stream) or 0
+    stream.release()
+
+    # The last chunk reads until the end of the video, in case the frame count is not exact.
+    starts = list(range(0, max(total_frames, 1), chunk_frames))
+    chunks = [(start, starts[i + 1] if i + 1 < len(starts) else None) for i, start in enumerate(starts)]
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(detect_factory,)) as pool:
+        chunks = iter(chunks)
+        pending = deque()
+
+        def submit() -> None:
+            chunk = next(chunks, None)
+            if chunk is not None:
+                pending.append(pool.submit(_detect_chunk, src, *chunk, detect_every))
+
+        for _ in range(2 * workers):
+            submit()
+        while pending:
+            dets = pending.popleft().result()
+            submit()
+            yield from dets
+
+
+def main(
+    src: str,
+    model: str,
+    confidence: float,
+    iou_threshold: float,
+    directions: Dict[str, Tuple[bool]],
+    workers: int,
+    chunk_frames: int = 300,
+    letterbox: bool = False,
+    detect_every: int = 1,
+    num_threads: Optional[int] = None,
+    counting_config: Optional[str] = None,
+    events: Optional[List[str]] = None,
+    roi: Optional[List[str]] = None,
+    roi_margin: float = 150.0,
+    tile_size: Optional[int] = None,
+    tile_overlap: float = 0.2,
+):
+    """Count human objects in a video file, with detection split across processes.
+
+    Tracking and counting run in a single sequential pass over the detections,
+    so track IDs and counts are the same as main.py --headless.
+
+    Args:
+        src (str): Source video.
+        model (str): Path to tflite weight.
+        confidence (float): Confidence threshold.
+        iou_threshold (float): IoU threshold for NMS.
+        workers (int): Number of worker processes, e.g. the number of cores.
+        chunk_frames (int): Number of frames processed by a worker at a time.
+        letterbox (bool): Keep the aspect ratio of frames by padding them to the model input.
+        detect_every (int): Run the detector every N frames, tracks are only predicted on the other frames.
+        num_threads (Optional[int]): Threads of each interpreter. Defaults to the cores split between workers.
+        counting_config (Optional[str]): JSON file of lines and zones to count, replaces the border and directions.
+        events (Optional[List[str]]): Sinks to write a record per count event, see events.open_sink.
+        roi (Optional[List[str]]): Regions of interest like "xmin,ymin,xmax,ymax", or "auto" around the lines.
+        roi_margin (float): Margin in pixels around the lines and zones of the "auto" region.
+        tile_size (Optional[int]): Detect frames, or regions, in overlapping tiles of this size.
+        tile_overlap (float): Min overlap of neighbouring tiles as a fraction of tile_size.
+    """
+    # The line to count.
+    border = [(0, 500), (1920, 500)]
+    directions = {key: direction_config.get(d_str) for key, d_str in directions.items()}
+    counting = load_counting_config(counting_config) if counting_config else None
+    tracker = Tracker(border, directions, counting=counting)
+    regions = parse_regions(roi, tracker, roi_margin, 1.0)
+    # Person is class index 0.
+    detect_factory = partial(
+        Detect,
+        model,
+        confidence,
+        letterbox=letterbox,
+        classes=[0],
+        iou_thr=iou_threshold,
+        num_threads=num_threads,
+        num_interpreters=workers,
+        regions=regions,
+        tile_size=tile_size,
+        tile_overlap=tile_overlap,
+    )
+
+    event_writer = EventWriter([open_sink(uri) for uri in events]).start() if events else None
+    stream_name = os.path.basename(src).split(".")[0]
+
+    num_frames = 0
+    for dets in detect_chunks(src, detect_factory, workers, chunk_frames, detect_every):
+        tracker.track(dets)
+        if event_writer is not None and tracker.events:
+            event_writer.emit(count_records(tracker.events, tracker.tracks, num_frames, time.time(), stream_name))
+        num_frames += 1
+    if event_writer is not None:
+        event_writer.close()
+
+    print(f"Frames: {num_frames}")
+    print(f"Counter: {tracker.counter}")
+    print("Done!")
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--src", help="Path to video source.", required=True)
+    parser.add_argument("--model", help="Path to YOLOv5 tflite file", default="./models/yolov5n6-fp16.tflite")
+    parser.add_argument("--confidence", type=float, default=0.2, help="Confidence threshold.")
+    parser.add_argument("--iou-threshold", type=float, default=0.2, help="IoU threshold for NMS.")
+    parser.add_argument("--directions", default={"total": None}, type=ast.literal_eval, help="Directions")
+    parser.add_argument("--counting-config", default=None, help="JSON file of lines and zones to count.")
+    parser.add_argument(
+        "--events", nargs="+", default=None, help="Write count events to .jsonl, .csv, .db, udp:// or unix:// sinks."
+    )
+    parser.add_argument("--workers", type=int, default=4, help="Number of worker processes.")
+    parser.add_argument("--chunk-frames", type=int, default=300, help="Number of frames per chunk.")
+    parser.add_argument("--letterbox", action="store_true", help="Keep aspect ratio when resizing to the model input.")
+    parser.add_argument("--detect-every", type=int, default=1, help="Run the detector every N frames.")
+    parser.add_argument("--num-threads", type=int, default=None, help="Threads of each interpreter.")
+    parser.add_argument(
+        "--roi", nargs="+", default=None, help="Regions to detect as xmin,ymin,xmax,ymax, or auto around the lines."
+    )
+    parser.add_argument("--roi-margin", type=float, default=150.0, help="Margin of the --roi auto region in pixels.")
+    parser.add_argument("--tile-size", type=int, default=None, help="Detect in overlapping tiles of this size.")
+    parser.add_argument("--tile-overlap", type=float, default=0.2, help="Min overlap of tiles, fraction of the size.")
+
+    args = vars(parser.parse_args())
+    main(**args)
@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+#
+# Copyright 2021.
+# ozora-ogino
+
+import queue
+import threading
+from typing import Any, Callable, Iterable, List, Optional
+
+# Marker put on a queue when the upstream stage has no more items.
+_END = object()
+
+
+def run_serial(source: Iterable, stages: List[Callable], sink: Callable) -> None:
+    """Run every stage one after another on a single thread.
+
+    Args:
+        source (Iterable): Yields the input items (e.g. decoded frames).
+        stages (List[Callable]): Functions applied in order to each item.
+        sink (Callable): Receives the output of the last stage.
+    """
+    for item in source:
+        for stage in stages:
+            item = stage(item)
+        sink(item)
+
+
+class Pipeline(object):
+    """Run source, stages and sink concurrently, one thread per stage.
+
+    Stages are connected with bounded FIFO queues, so items are kept in order and
+    a slow stage blocks its producers once `queue_depth` items are waiting for it.
+    The sink is called from the thread which calls `run`.
+
+    Args:
+        source (Iterable): Yields the input items (e.g. decoded frames).
+        stages (List[Callable]): Functions applied in order to each item.
+        sink (Callable): Receives the output of the last stage.
+        queue_depth (int): Max number of items waiting between two stages.
+    """
+
+    def __init__(
+        self,
+        source: Iterable,
+        stages: List[Callable],
+        sink: Callable,
+        queue_depth: int = 4,
+    ):
+        if queue_depth < 1:
+            raise ValueError("queue_depth must be greater than 0.")
+        self.source = source
+        self.stages = stages
+        self.sink = sink
+        self.queues = [queue.Queue(maxsize=queue_depth) for _ in range(len(stages) + 1)]
+        self._stop = threading.Event()
+        self._error: Optional[BaseException] = None
+
+    def _put(self, q: queue.Queue, item: Any) -> bool:
+        """Put an item, giving up when the pipeline is stopped."""
+        while not self._stop.is_set():
+            try:
+                q.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _get(self, q: queue.Queue) -> Any:
+        """Get an item, returning `_END` when the pipeline is stopped."""
+        while not self._stop.is_set():
+            try:
+                return q.get(timeout=0.1)
+            except queue.Empty:
+                continue
+        return _END
+
+    def _fail(self, error: BaseException) -> None:
+        if self._error is None:
+            self._error = error
+        self._stop.set()
+
+    def _produce(self) -> None:
+        try:
+            for item in self.source:
+                if not self._put(self.queues[0], item):
+                    return
+            self._put(self.queues[0], _END)
+        except BaseException as e:
+            self._fail(e)
+
+    def _work(self, stage: Callable, in_queue: queue.Queue, out_queue: queue.Queue) -> None:
+        try:
+            while True:
+                item = self._get(in_queue)
+                if item is _END:
+                    self._put(out_queue, _END)
+                    return
+                if not self._put(out_queue, stage(item)):
+                    return
+        except BaseException as e:
+            self._fail(e)
+
+    def run(self) -> None:
+        """Run the pipeline until the source is exhausted.
+
+        Raises the first exception raised by any stage.
+        """
+        threads = [threading.Thread(target=self._produce, name="pipeline-source", daemon=True)]
+        for i, stage in enumerate(self.stages):
+            threads.append(
+                threading.Thread(
+                    target=self._work,
+                    args=(stage, self.queues[i], self.queues[i + 1]),
+                    name=f"pipeline-stage-{i}",
+                    daemon=True,
+                )
+            )
+        for thread in threads:
+            thread.start()
+
+        try:
+            while True:
+                item = self._get(self.queues[-1])
+                if item is _END:
+                    break
+                self.sink(item)
+        except BaseException as e:
+            self._fail(e)
+        finally:
+            self._stop.set()
+            for thread in threads:
+                thread.join()
+
+        if self._error is not None:
+            raise self._error
+
+    def qsizes(self) -> List[int]:
+        """Return the number of items waiting in each queue."""
+        return [q.qsize() for q in self.queues]
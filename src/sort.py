@@ -14,11 +14,15 @@
 """
 from __future__ import print_function
 
+import time
+
 import numpy as np
 from filterpy.kalman import KalmanFilter
 from numba import jit
 from scipy.optimize import linear_sum_assignment as linear_assignment
 
+from metrics import get_metrics
+
 
 @jit
 def iou(bb_test, bb_gt):
@@ -38,6 +42,28 @@ def iou(bb_test, bb_gt):
     return o
 
 
+def iou_batch(bb_test, bb_gt):
+    """
+    Computes IOU between every pair of bboxes in the form [x1,y1,x2,y2]
+    Returns a matrix of shape (len(bb_test), len(bb_gt))
+    """
+    bb_test = np.expand_dims(bb_test[:, :4], 1)
+    bb_gt = np.expand_dims(bb_gt[:, :4], 0)
+    xx1 = np.maximum(bb_test[..., 0], bb_gt[..., 0])
+    yy1 = np.maximum(bb_test[..., 1], bb_gt[..., 1])
+    xx2 = np.minimum(bb_test[..., 2], bb_gt[..., 2])
+    yy2 = np.minimum(bb_test[..., 3], bb_gt[..., 3])
+    w = np.maximum(0.0, xx2 - xx1)
+    h = np.maximum(0.0, yy2 - yy1)
+    wh = w * h
+    o = wh / (
+        (bb_test[..., 2] - bb_test[..., 0]) * (bb_test[..., 3] - bb_test[..., 1])
+        + (bb_gt[..., 2] - bb_gt[..., 0]) * (bb_gt[..., 3] - bb_gt[..., 1])
+        - wh
+    )
+    return o
+
+
 def convert_bbox_to_z(bbox):
     """
     Takes a bounding box in the form [x1,y1,x2,y2] and returns z in the form
@@ -140,6 +166,155 @@ class KalmanBoxTracker(object):
         return convert_x_to_bbox(self.kf.x)
 
 
+class BatchKalmanBoxTracker(object):
+    """
+    Holds the state of all tracked objects in stacked arrays and runs the constant velocity
+    Kalman filter of KalmanBoxTracker for all of them at once.
+    Each track lives in a slot, slots of deleted tracks are reused through a free list.
+    """
+
+    def __init__(self, capacity=64):
+        """
+        Allocates arrays for `capacity` tracks, they grow when more tracks are alive.
+        """
+        # same constant velocity model as KalmanBoxTracker
+        self.F = np.eye(7)
+        self.F[0, 4] = self.F[1, 5] = self.F[2, 6] = 1.0
+        self.R = np.eye(4)
+        self.R[2:, 2:] *= 10.0
+        self.P0 = np.eye(7)
+        self.P0[4:, 4:] *= 1000.0  # give high uncertainty to the unobservable initial velocities
+        self.P0 *= 10.0
+        self.Q = np.eye(7)
+        self.Q[-1, -1] *= 0.01
+        self.Q[4:, 4:] *= 0.01
+        self.I = np.eye(7)
+
+        self.capacity = 0
+        self.x = np.zeros((0, 7))
+        self.P = np.zeros((0, 7, 7))
+        self.id = np.zeros(0, dtype=int)
+        self.time_since_update = np.zeros(0, dtype=int)
+        self.hits = np.zeros(0, dtype=int)
+        self.hit_streak = np.zeros(0, dtype=int)
+        self.age = np.zeros(0, dtype=int)
+        self.alive = np.zeros(0, dtype=bool)
+        self.free = []
+        self._grow(capacity)
+
+    def _grow(self, capacity):
+        """
+        Extends all arrays to `capacity` slots.
+        """
+        extra = capacity - self.capacity
+        self.x = np.concatenate([self.x, np.zeros((extra, 7))])
+        self.P = np.concatenate([self.P, np.zeros((extra, 7, 7))])
+        self.id = np.concatenate([self.id, np.zeros(extra, dtype=int)])
+        self.time_since_update = np.concatenate([self.time_since_update, np.zeros(extra, dtype=int)])
+        self.hits = np.concatenate([self.hits, np.zeros(extra, dtype=int)])
+        self.hit_streak = np.concatenate([self.hit_streak, np.zeros(extra, dtype=int)])
+        self.age = np.concatenate([self.age, np.zeros(extra, dtype=int)])
+        self.alive = np.concatenate([self.alive, np.zeros(extra, dtype=bool)])
+        # Pop from the end, so the lowest slot is used first.
+        self.free = list(range(capacity - 1, self.capacity - 1, -1)) + self.free
+        self.capacity = capacity
+
+    def add(self, bboxes):
+        """
+        Creates tracks from bboxes in the form [x1,y1,x2,y2,...] and returns their slots.
+        """
+        slots = []
+        for bbox in bboxes:
+            if not self.free:
+                self._grow(max(2 * self.capacity, 1))
+            slot = self.free.pop()
+            self.x[slot] = 0.0
+            self.x[slot, :4] = convert_bbox_to_z(bbox)[:, 0]
+            self.P[slot] = self.P0
+            self.id[slot] = KalmanBoxTracker.count
+            KalmanBoxTracker.count += 1
+            self.time_since_update[slot] = 0
+            self.hits[slot] = 0
+            self.hit_streak[slot] = 0
+            self.age[slot] = 0
+            self.alive[slot] = True
+            slots.append(slot)
+        return np.array(slots, dtype=int)
+
+    def remove(self, slots):
+        """
+        Deletes the tracks in slots.
+        """
+        self.alive[slots] = False
+        self.free.extend(int(slot) for slot in slots)
+
+    def live_slots(self):
+        """
+        Returns the slots of alive tracks in creation order.
+        """
+        slots = np.where(self.alive)[0]
+        return slots[np.argsort(self.id[slots], kind="stable")]
+
+    def advance(self, slots):
+        """
+        Advances the state vectors by one frame without touching the track counters.
+        """
+        x = self.x[slots]
+        x[x[:, 6] + x[:, 2] <= 0, 6] = 0.0
+        self.x[slots] = x @ self.F.T
+        self.P[slots] = self.F @ self.P[slots] @ self.F.T + self.Q
+
+    def predict(self, slots):
+        """
+        Advances the state vectors and returns the predicted bounding boxes.
+        """
+        self.advance(slots)
+        self.age[slots] += 1
+        self.hit_streak[slots[self.time_since_update[slots] > 0]] = 0
+        self.time_since_update[slots] += 1
+        return self.get_state(slots)
+
+    def update(self, slots, bboxes):
+        """
+        Updates the state vectors with observed bboxes.
+        """
+        if len(slots) == 0:
+            return
+        self.time_since_update[slots] = 0
+        self.hits[slots] += 1
+        self.hit_streak[slots] += 1
+
+        bboxes = np.asarray(bboxes, dtype=float)
+        w = bboxes[:, 2] - bboxes[:, 0]
+        h = bboxes[:, 3] - bboxes[:, 1]
+        z = np.stack([bboxes[:, 0] + w / 2.0, bboxes[:, 1] + h / 2.0, w * h, w / h], axis=1)
+
+        x, P = self.x[slots], self.P[slots]
+        # H selects the first 4 elements of the state.
+        y = z - x[:, :4]
+        PHT = P[:, :, :4]
+        S = PHT[:, :4, :] + self.R
+        K = PHT @ np.linalg.inv(S)
+        self.x[slots] = x + (K @ y[:, :, None])[:, :, 0]
+        I_KH = self.I - np.concatenate([K, np.zeros((len(slots), 7, 3))], axis=2)
+        self.P[slots] = I_KH @ P @ I_KH.transpose(0, 2, 1) + K @ self.R @ K.transpose(0, 2, 1)
+
+    def position_std(self, slots):
+        """
+        Returns the standard deviation of the estimated centre positions.
+        """
+        return np.sqrt(self.P[slots, 0, 0] + self.P[slots, 1, 1])
+
+    def get_state(self, slots):
+        """
+        Returns the current bounding box estimates.
+        """
+        x = self.x[slots]
+        w = np.sqrt(x[:, 2] * x[:, 3])
+        h = x[:, 2] / w
+        return np.stack([x[:, 0] - w / 2.0, x[:, 1] - h / 2.0, x[:, 0] + w / 2.0, x[:, 1] + h / 2.0], axis=1)
+
+
 def associate_detections_to_trackers(detections, trackers, iou_threshold=0.3):
     """
     Assigns detections to tracked object (both represented as bounding boxes)
@@ -147,52 +322,38 @@ def associate_detections_to_trackers(detections, trackers, iou_threshold=0.3):
     """
     if (len(trackers) == 0) or (len(detections) == 0):
         return np.empty((0, 2), dtype=int), np.arange(len(detections)), np.empty((0, 5), dtype=int)
-    iou_matrix = np.zeros((len(detections), len(trackers)), dtype=np.float32)
-
-    for d, det in enumerate(detections):
-        for t, trk in enumerate(trackers):
-            iou_matrix[d, t] = iou(det, trk)
+    iou_matrix = iou_batch(np.asarray(detections), np.asarray(trackers)).astype(np.float32)
 
     # https://stackoverflow.com/questions/57369848/how-do-i-resolve-use-scipy-optimize-linear-sum-assignment-instead
     matched_indices = linear_assignment(-iou_matrix)
     matched_indices = np.asarray(matched_indices)
     matched_indices = np.transpose(matched_indices)
 
-    unmatched_detections = []
-    for d, det in enumerate(detections):
-        if d not in matched_indices[:, 0]:
-            unmatched_detections.append(d)
-
-    unmatched_trackers = []
-    for t, trk in enumerate(trackers):
-        if t not in matched_indices[:, 1]:
-            unmatched_trackers.append(t)
+    unmatched_detections = np.ones(len(detections), dtype=bool)
+    unmatched_detections[matched_indices[:, 0]] = False
+    unmatched_trackers = np.ones(len(trackers), dtype=bool)
+    unmatched_trackers[matched_indices[:, 1]] = False
 
     # filter out matched with low IOU
-    matches = []
-    for m in matched_indices:
-        if iou_matrix[m[0], m[1]] < iou_threshold:
-            unmatched_detections.append(m[0])
-            unmatched_trackers.append(m[1])
-        else:
-            matches.append(m.reshape(1, 2))
-    if len(matches) == 0:
-        matches = np.empty((0, 2), dtype=int)
-    else:
-        matches = np.concatenate(matches, axis=0)
+    low_iou = iou_matrix[matched_indices[:, 0], matched_indices[:, 1]] < iou_threshold
+    unmatched_detections = np.concatenate([np.where(unmatched_detections)[0], matched_indices[low_iou, 0]])
+    unmatched_trackers = np.concatenate([np.where(unmatched_trackers)[0], matched_indices[low_iou, 1]])
+    matches = matched_indices[~low_iou].reshape(-1, 2)
 
-    return matches, np.array(unmatched_detections), np.array(unmatched_trackers)
+    return matches, unmatched_detections, unmatched_trackers
 
 
 class Sort(object):
-    def __init__(self, max_age=1, min_hits=3):
+    def __init__(self, max_age=1, min_hits=3, metrics=None):
         """
         Sets key parameters for SORT
+        metrics records association and kalman latency if given
         """
         self.max_age = max_age
         self.min_hits = min_hits
-        self.trackers = []
+        self.trackers = BatchKalmanBoxTracker()
         self.frame_count = 0
+        self.metrics = get_metrics(metrics)
 
     def update(self, dets):
         """
@@ -204,38 +365,68 @@ class Sort(object):
         """
         self.frame_count += 1
         # get predicted locations from existing trackers.
-        trks = np.zeros((len(self.trackers), 5))
-        to_del = []
-        ret = []
-        for t, trk in enumerate(trks):
-            pos = self.trackers[t].predict()[0]
-            trk[:] = [pos[0], pos[1], pos[2], pos[3], 0]
-            if np.any(np.isnan(pos)):
-                to_del.append(t)
-        trks = np.ma.compress_rows(np.ma.masked_invalid(trks))
-        for t in reversed(to_del):
-            self.trackers.pop(t)
-        matched, unmatched_dets, unmatched_trks = associate_detections_to_trackers(dets, trks)
+        start = time.perf_counter()
+        slots = self.trackers.live_slots()
+        trks = self.trackers.predict(slots)
+        to_del = np.any(np.isnan(trks), axis=1)
+        self.trackers.remove(slots[to_del])
+        slots, trks = slots[~to_del], trks[~to_del]
+        kalman_time = time.perf_counter() - start
+
+        with self.metrics.timer("association"):
+            matched, unmatched_dets, _ = associate_detections_to_trackers(dets, trks)
 
+        start = time.perf_counter()
         # update matched trackers with assigned detections
-        for t, trk in enumerate(self.trackers):
-            if t not in unmatched_trks:
-                d = matched[np.where(matched[:, 1] == t)[0], 0]
-                trk.update(dets[d, :][0])
+        self.trackers.update(slots[matched[:, 1]], dets[matched[:, 0], :4])
 
         # create and initialise new trackers for unmatched detections
-        for i in unmatched_dets:
-            trk = KalmanBoxTracker(dets[i, :])
-            self.trackers.append(trk)
-        i = len(self.trackers)
-        for trk in reversed(self.trackers):
-            d = trk.get_state()[0]
-            if (trk.time_since_update < 1) and (trk.hit_streak >= self.min_hits or self.frame_count <= self.min_hits):
-                ret.append(np.concatenate((d, [trk.id + 1])).reshape(1, -1))  # +1 as MOT benchmark requires positive
-            i -= 1
-            # remove dead tracklet
-            if trk.time_since_update > self.max_age:
-                self.trackers.pop(i)
-        if len(ret) > 0:
-            return np.concatenate(ret)
-        return np.empty((0, 5))
+        self.trackers.add(dets[unmatched_dets.astype(int)])
+        self.metrics.observe("kalman", kalman_time + time.perf_counter() - start)
+
+        # newest trackers first
+        slots = self.trackers.live_slots()[::-1]
+        ret = self._confirmed(slots)
+
+        # remove dead tracklet
+        self.trackers.remove(slots[self.trackers.time_since_update[slots] > self.max_age])
+        return ret
+
+    def predict(self):
+        """
+        Advances all tracks by one frame without detections, for frames where the detector is skipped.
+        Track counters are not changed, so skipped frames do not count towards max_age.
+        Returns the tracks which were returned by the last update, at their predicted positions.
+        """
+        with self.metrics.timer("kalman"):
+            slots = self.trackers.live_slots()
+            self.trackers.advance(slots)
+        return self._confirmed(slots[::-1])
+
+    def position_std(self):
+        """
+        Returns the standard deviation of the estimated centre position of every alive track.
+        """
+        return self.trackers.position_std(self.trackers.live_slots())
+
+    def live_ids(self):
+        """
+        Returns the ids of every alive track, as in the output of update, including unconfirmed tracks.
+        """
+        return self.trackers.id[self.trackers.live_slots()] + 1
+
+    def _confirmed(self, slots):
+        """
+        Returns [x1,y1,x2,y2,id] of the tracks in slots which were matched in the last update
+        and have enough hits.
+        """
+        time_since_update = self.trackers.time_since_update[slots]
+        hit_streak = self.trackers.hit_streak[slots]
+        is_output = (time_since_update < 1) & ((hit_streak >= self.min_hits) | (self.frame_count <= self.min_hits))
+        output = slots[is_output]
+        if len(output) == 0:
+            return np.empty((0, 5))
+        # +1 as MOT benchmark requires positive
+        return np.concatenate(
+            [self.trackers.get_state(output), (self.trackers.id[output] + 1).reshape(-1, 1)], axis=1
+        ).astype(float)
@@ -4,11 +4,27 @@
 # ozora-ogino
 
 import os
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from glob import glob
-from typing import Any, Tuple
+from typing import Any, List, Optional, Tuple
 
 import cv2
 import imutils
+import numpy as np
+
+from archive import FrameArchive
+from metrics import NullMetrics, get_metrics
+
+READ_FLAGS = {
+    1: cv2.IMREAD_COLOR,
+    2: cv2.IMREAD_REDUCED_COLOR_2,
+    4: cv2.IMREAD_REDUCED_COLOR_4,
+    8: cv2.IMREAD_REDUCED_COLOR_8,
+}
 
 
 class BaseStream(object):
@@ -24,10 +40,102 @@ class BaseStream(object):
 
 
 class VideoStream(BaseStream):
-    """Video stream."""
+    """Video stream.
+
+    By default frames are decoded on the thread calling next. With buffer_size > 0, a background
+    thread decodes up to buffer_size frames ahead into a ring of reused buffers.
+    A frame returned by next is then overwritten after `hold` more calls of next, so copy it
+    if it is kept longer.
+
+    Args:
+        file (str): Path to video file.
+        backend (int): Capture backend, e.g. cv2.CAP_FFMPEG or cv2.CAP_GSTREAMER.
+        hw_accel (bool): Use hardware accelerated decode if the backend supports it.
+        decode_threads (int): Number of decoder threads, 0 lets the backend decide.
+        buffer_size (int): Number of frames decoded ahead on a background thread, 0 to decode in next.
+        hold (int): Number of frames returned by next which are still in use by the caller.
+        stride (int): Return every `stride`-th frame. The frames in between are only grabbed,
+                      which skips their color conversion and copy.
+        scale (float): Downscale frames by this factor on the decode thread, e.g. 0.5.
+    """
+
+    def __init__(
+        self,
+        file: str,
+        backend: int = cv2.CAP_ANY,
+        hw_accel: bool = False,
+        decode_threads: int = 0,
+        buffer_size: int = 0,
+        hold: int = 1,
+        stride: int = 1,
+        scale: float = 1.0,
+    ):
+        if stride < 1:
+            raise ValueError("stride must be greater than 0.")
+        if not 0 < scale <= 1:
+            raise ValueError("scale must be in (0, 1].")
+        params = []
+        if hw_accel and hasattr(cv2, "CAP_PROP_HW_ACCELERATION"):
+            params += [cv2.CAP_PROP_HW_ACCELERATION, cv2.VIDEO_ACCELERATION_ANY]
+        if decode_threads and hasattr(cv2, "CAP_PROP_N_THREADS"):
+            params += [cv2.CAP_PROP_N_THREADS, decode_threads]
+        self.stream = cv2.VideoCapture(file, backend, params) if params else cv2.VideoCapture(file, backend)
+        self.stride = stride
+        self.scale = scale
+        self.hold = hold
+        # Full resolution frame reused when downscaling.
+        self._full = None
+        # Number of frames to grab before the next read.
+        self._skip = 0
 
-    def __init__(self, file: str):
-        self.stream = cv2.VideoCapture(file)
+        self._thread = None
+        if buffer_size > 0:
+            self._buffers: List[Optional[np.ndarray]] = [None] * (buffer_size + hold)
+            # A buffer can be written when it is free, i.e. not waiting in _ready nor held by the caller.
+            self._free = threading.Semaphore(len(self._buffers))
+            self._ready = queue.Queue()
+            self._held = 0
+            self._stop = threading.Event()
+            self._error: Optional[BaseException] = None
+            self._thread = threading.Thread(target=self._decode, name="video-decode", daemon=True)
+            self._thread.start()
+
+    def _read(self, dst: Optional[np.ndarray] = None) -> Tuple[bool, Optional[np.ndarray]]:
+        """Grab skipped frames, then decode a frame into dst if possible."""
+        # Frames 0, stride, 2 * stride, ... are returned.
+        for _ in range(self._skip):
+            if not self.stream.grab():
+                return False, None
+        self._skip = self.stride - 1
+        if self.scale == 1.0:
+            return self.stream.read(dst) if dst is not None else self.stream.read()
+
+        is_finish, self._full = self.stream.read(self._full) if self._full is not None else self.stream.read()
+        if not is_finish:
+            return False, None
+        h, w = self._full.shape[:2]
+        size = (max(int(round(w * self.scale)), 1), max(int(round(h * self.scale)), 1))
+        return True, cv2.resize(self._full, size, dst=dst, interpolation=cv2.INTER_AREA)
+
+    def _decode(self) -> None:
+        """Decode frames into the ring of buffers until the end of the video."""
+        index = 0
+        try:
+            while True:
+                self._free.acquire()
+                if self._stop.is_set():
+                    break
+                slot = index % len(self._buffers)
+                is_finish, frame = self._read(self._buffers[slot])
+                if not is_finish:
+                    break
+                self._buffers[slot] = frame
+                self._ready.put(frame)
+                index += 1
+        except BaseException as e:
+            self._error = e
+        finally:
+            self._ready.put(None)
 
     def next(self) -> Tuple[bool, Any]:
         """Read next frame.
@@ -36,11 +144,31 @@ class VideoStream(BaseStream):
             if_finish(bool): Return True if no frame exists.
             frame(Any): Return np.ndarray if frame exists.
         """
-        if_finish, frame = self.stream.read()
-        return if_finish, frame
+        if self._thread is None:
+            if_finish, frame = self._read()
+            return if_finish, frame
+
+        frame = self._ready.get()
+        if frame is None:
+            # Keep the end marker for the following calls.
+            self._ready.put(None)
+            if self._error is not None:
+                raise self._error
+            return False, None
+        # The oldest frame held by the caller can be overwritten.
+        self._held += 1
+        if self._held > self.hold:
+            self._held -= 1
+            self._free.release()
+        return True, frame
 
     def release(self):
         """Release video stream."""
+        if self._thread is not None:
+            self._stop.set()
+            # Wake up the decode thread if it waits for a free buffer.
+            self._free.release()
+            self._thread.join()
         self.stream.release()
 
     def __len__(self):
@@ -48,37 +176,261 @@ class VideoStream(BaseStream):
         try:
             prop = cv2.cv.CV_CAP_PROP_FRAME_COUNT if imutils.is_cv2() else cv2.CAP_PROP_FRAME_COUNT
             total_frames = int(self.stream.get(prop))
-            return total_frames
+            return -(-total_frames // self.stride)
         # pylint: disable=bare-except
         except:
             return None
 
 
+class LiveStream(BaseStream):
+    """Live stream of a camera, e.g. RTSP or a webcam.
+
+    A background thread reads frames as fast as the source delivers them and keeps only the
+    latest one, so a slow consumer skips frames instead of falling behind the camera.
+    After next, `timestamp` is the capture time (time.time()) of the returned frame and
+    `frame_index` its index among all captured frames.
+    When the source fails or ends, it is opened again after a delay doubled on every failure.
+
+    Args:
+        source (str): URL like rtsp://..., a device index like "0", or a video file for testing.
+        backend (int): Capture backend, e.g. cv2.CAP_FFMPEG or cv2.CAP_GSTREAMER.
+        realtime (bool): Read at the frame rate of the source, like a camera.
+                         Only useful for files, which are read as fast as they decode otherwise.
+        reconnect (bool): Open the source again when it fails or ends.
+        max_retries (Optional[int]): Give up after this many failures in a row, None to retry forever.
+        backoff (float): Seconds before the first reconnect.
+        max_backoff (float): Max seconds between two reconnects.
+        metrics (Optional[NullMetrics]): Count dropped_frames and reconnects, observe capture_age.
+    """
+
+    def __init__(
+        self,
+        source: str,
+        backend: int = cv2.CAP_ANY,
+        realtime: bool = False,
+        reconnect: bool = True,
+        max_retries: Optional[int] = None,
+        backoff: float = 0.5,
+        max_backoff: float = 10.0,
+        metrics: Optional[NullMetrics] = None,
+    ):
+        self.source = int(source) if str(source).isdigit() else source
+        self.backend = backend
+        self.realtime = realtime
+        self.reconnect = reconnect
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.metrics = get_metrics(metrics)
+        self.timestamp: Optional[float] = None
+        self.frame_index = -1
+        self.dropped = 0
+        self.reconnects = 0
+
+        self._cond = threading.Condition()
+        # Latest frame not returned yet, its capture time and index.
+        self._frame: Optional[np.ndarray] = None
+        self._timestamp = 0.0
+        self._captured = 0
+        self._finished = False
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._capture, name="live-capture", daemon=True)
+        self._thread.start()
+
+    def _open(self) -> Optional[cv2.VideoCapture]:
+        stream = cv2.VideoCapture(self.source, self.backend)
+        if not stream.isOpened():
+            stream.release()
+            return None
+        # Frames are read continuously, the backend does not need to queue them.
+        stream.set(cv2.CAP_PROP_BUFFERSIZE, 1)
+        return stream
+
+    def _read_all(self, stream: cv2.VideoCapture) -> bool:
+        """Read frames until the source fails or ends. Return True if at least a frame was read."""
+        fps = stream.get(cv2.CAP_PROP_FPS) if self.realtime else 0
+        interval = 1.0 / fps if fps > 0 else 0.0
+        deadline = time.perf_counter()
+        read = False
+        while not self._stop.is_set():
+            ok, frame = stream.read()
+            if not ok:
+                break
+            read = True
+            with self._cond:
+                if self._frame is not None:
+                    self.dropped += 1
+                    self.metrics.inc("dropped_frames")
+                self._frame, self._timestamp = frame, time.time()
+                self._captured += 1
+                self._cond.notify_all()
+            if interval:
+                deadline += interval
+                self._stop.wait(max(deadline - time.perf_counter(), 0.0))
+        return read
+
+    def _capture(self) -> None:
+        delay, failures = self.backoff, 0
+        try:
+            while not self._stop.is_set():
+                stream = self._open()
+                if stream is not None:
+                    try:
+                        if self._read_all(stream):
+                            delay, failures = self.backoff, 0
+                    finally:
+                        stream.release()
+                if self._stop.is_set() or not self.reconnect:
+                    break
+                failures += 1
+                if self.max_retries is not None and failures > self.max_retries:
+                    break
+                self.reconnects += 1
+                self.metrics.inc("reconnects")
+                self._stop.wait(delay)
+                delay = min(delay * 2, self.max_backoff)
+        finally:
+            with self._cond:
+                self._finished = True
+                self._cond.notify_all()
+
+    def next(self) -> Tuple[bool, Any]:
+        """Wait for a frame newer than the last returned one.
+
+        Returns (False, None) once the source ended and cannot be reconnected.
+        """
+        with self._cond:
+            self._cond.wait_for(lambda: self._frame is not None or self._finished)
+            if self._frame is None:
+                return False, None
+            frame, self.timestamp = self._frame, self._timestamp
+            self.frame_index = self._captured - 1
+            self._frame = None
+        self.metrics.observe("capture_age", time.time() - self.timestamp)
+        return True, frame
+
+    def release(self):
+        """Stop the capture thread."""
+        self._stop.set()
+        # A blocking read of a network source may take a while, the thread is a daemon anyway.
+        self._thread.join(timeout=5.0)
+
+    def __len__(self):
+        """Live streams have no length."""
+        return 0
+
+
 class ImageFileStream(BaseStream):
     """Image file stream.
 
+    Frames are read from a directory of jpg files or from a frame archive (see archive.py).
+    A thread pool decodes the next `prefetch` frames in parallel, cv2 releases the GIL while decoding.
+
     Args:
-        src_dir(str): Path to directory which contain frames as jpg files.
+        src_dir(str): Path to directory which contain frames as jpg files, or to a frame archive.
+        prefetch(int): Number of frames decoded ahead, 0 to decode in next.
+        workers(int): Number of decode threads. Defaults to the number of CPUs.
+        reduce(int): Decode frames at 1/reduce of their resolution, one of 1, 2, 4 or 8.
     """
 
-    def __init__(self, src_dir: str):
-        # Generate sorted list.
-        # Assume that frames are generated by /data/video2img.py.
-        self.images = sorted(glob(os.path.join(src_dir, "*.jpg")))
+    def __init__(self, src_dir: str, prefetch: int = 0, workers: Optional[int] = None, reduce: int = 1):
+        if reduce not in READ_FLAGS:
+            raise ValueError(f"reduce must be one of {list(READ_FLAGS)}.")
+        self.flags = READ_FLAGS[reduce]
+        self.archive = None
+        if os.path.isfile(src_dir):
+            self.archive = FrameArchive(src_dir)
+            self.images = None
+        else:
+            # Generate sorted list.
+            # Assume that frames are generated by /data/video2img.py.
+            self.images = sorted(glob(os.path.join(src_dir, "*.jpg")))
         self.index = 0
 
+        self.prefetch = prefetch
+        self._pool = ThreadPoolExecutor(max_workers=workers) if prefetch > 0 else None
+        # Frames being decoded, in order.
+        self._futures = deque()
+        self._next_submit = 0
+
+    def _load(self, index: int) -> np.ndarray:
+        if self.archive is not None:
+            return cv2.imdecode(self.archive[index], self.flags)
+        return cv2.imread(self.images[index], self.flags)
+
     def next(self) -> Tuple[bool, Any]:
         """Read next frame."""
-        try:
-            frame = cv2.imread(self.images[self.idx])
-            self.index += 1
-            return True, frame
+        if self.index >= len(self):
+            return False, None
+
+        if self._pool is None:
+            frame = self._load(self.index)
+        else:
+            while self._next_submit < min(self.index + self.prefetch + 1, len(self)):
+                self._futures.append(self._pool.submit(self._load, self._next_submit))
+                self._next_submit += 1
+            frame = self._futures.popleft().result()
+        self.index += 1
+        return True, frame
+
+    def release(self):
+        if self._pool is not None:
+            for future in self._futures:
+                future.cancel()
+            self._pool.shutdown(wait=True)
+        if self.archive is not None:
+            self.archive.close()
+
+    def __len__(self):
+        return len(self.archive) if self.archive is not None else len(self.images)
+
+
+class PackedFrameStream(BaseStream):
+    """Random access stream over frames packed by data/video2img.py.
+
+    A frame archive (.frames) is memory mapped and frames are decoded on read.
+    Raw frames in a .npy file are returned as views of a copy-on-write memory map, so reads
+    neither copy nor decode anything, and drawing on a frame never changes the file.
+
+    Args:
+        path(str): Path to a frame archive or a .npy file.
+        start(int): Index of the first frame returned by next.
+        reduce(int): Decode frames of a frame archive at 1/reduce of their resolution.
+    """
+
+    def __init__(self, path: str, start: int = 0, reduce: int = 1):
+        if reduce not in READ_FLAGS:
+            raise ValueError(f"reduce must be one of {list(READ_FLAGS)}.")
+        self.flags = READ_FLAGS[reduce]
+        self.archive, self.frames = None, None
+        if path.endswith(".npy"):
+            self.frames = np.load(path, mmap_mode="c")
+        else:
+            self.archive = FrameArchive(path)
+        self.index = start
+
+    def __getitem__(self, index: int) -> np.ndarray:
+        """Return frame `index`."""
+        if self.frames is not None:
+            return self.frames[index]
+        return cv2.imdecode(self.archive[index], self.flags)
 
-        except (IndexError):
+    def seek(self, index: int) -> None:
+        """Set the index of the frame returned by the next call of next."""
+        self.index = index
+
+    def next(self) -> Tuple[bool, Any]:
+        """Read next frame."""
+        if self.index >= len(self):
             return False, None
+        frame = self[self.index]
+        self.index += 1
+        return True, frame
 
     def release(self):
-        pass
+        if self.archive is not None:
+            self.archive.close()
+        self.frames = None
 
     def __len__(self):
-        return len(self.images)
+        return len(self.frames) if self.frames is not None else len(self.archive)
@@ -3,120 +3,154 @@
 # Copyright 2021.
 # ozora-ogino
 
-from typing import Callable, List, Optional, Tuple
+from typing import Callable, Dict, List, Optional, Tuple
 
 import cv2
 import numpy as np
 
+from counting import CountingEngine, Line
+from history import TrackHistory
+from metrics import NullMetrics, get_metrics
 from sort import Sort
-from utils import check_direction, is_intersect
 
 
 class Tracker(object):
     def __init__(
         self,
-        border: List[Tuple[int]],
-        directions: Tuple[bool],
+        border: Optional[List[Tuple[int]]] = None,
+        directions: Optional[Dict[str, Optional[Tuple[bool]]]] = None,
         count_callback: Optional[Callable] = None,
+        metrics: Optional[NullMetrics] = None,
+        counting: Optional[CountingEngine] = None,
+        history_length: int = 32,
     ):
         """Constructor of Tracker.
 
         Args:
-            border (List[Tuple[int]]): Border to detect count.
+            border (Optional[List[Tuple[int]]]): Border to detect count, ignored if counting is given.
+            directions (Optional[Dict[str, Optional[Tuple[bool]]]]): Count rules of the border like {"total": None}.
             count_callback (Optional[Callable], optional): Callback function which will be called when the counter is up.
-                                                           Take counter(int) for arguments.
+                                                           Take counter(dict) for arguments.
+            metrics (Optional[NullMetrics]): Record association, kalman and draw latency.
+            counting (Optional[CountingEngine]): Lines and zones to count, e.g. from counting.load_counting_config.
+            history_length (int): Number of positions kept per live track in history.
         """
-        self.tracker = Sort()
+        if counting is None:
+            if border is None:
+                raise ValueError("Either border or counting is required.")
+            counting = CountingEngine([Line("", border[0], border[1], directions or {"total": None})])
+        self.metrics = get_metrics(metrics)
+        self.tracker = Sort(metrics=self.metrics)
+        self.counting = counting
         self.border = border
-        self.count_callback = count_callback
-        self.memory = {}
-        self.counter = {key: 0 for key in directions.keys()}
         self.directions = directions
+        self.count_callback = count_callback
+        # Positions of live tracks on frames with detections.
+        self.history = TrackHistory(history_length)
+        self.frame_index = 0
+        # Tracks [xyxy, id] of the last update.
+        self.tracks = np.empty((0, 5))
+        self.motions = {}
+        # CountEvents of the last update.
+        self.events = []
 
         np.random.seed(2021)
         self.COLORS = np.random.randint(0, 255, size=(200, 3), dtype="uint8")
 
-    def _is_count(
-        self,
-        center: Tuple[int],
-        center_prev: Tuple[int],
-        border: List[Tuple[int]],
-        key: str,
-    ) -> bool:
-        """Check whether count or not.
+    @property
+    def counter(self) -> Dict[str, int]:
+        return self.counting.counter
 
-        1. check_direction: Check the direction of human movement.
-                            If direction is not specified, return True.
-        2. is_intersect: Check whether the border and the human movement intersect.
+    def update(self, frame: np.ndarray, dets: Optional[np.ndarray] = None) -> np.ndarray:
+        """Update tracker and draw bounding box in a frame.
 
         Args:
-            center(Tuple[int]): Current center position.
-            center_prev(Tuple[int]): Previous center position.
-            border(List[Tuple[int]]): Border.
-            key(str): "inside", "outside" or "total".
-        """
+            frame (np.ndarray): Target frame.
+            dets (Optional[np.ndarray]): Array like [xyxy + score].
+                                         If None, the detector was skipped for this frame:
+                                         tracks are only predicted and nothing is counted.
 
-        return check_direction(center, center_prev, self.directions[key]) and is_intersect(
-            center, center_prev, border[0], border[1]
-        )
+        Returns:
+            np.ndarray: Frame with bounding box and count.
+        """
+        self.track(dets)
+        return self.draw(frame)
 
-    def update(self, frame: np.ndarray, dets: np.ndarray) -> np.ndarray:
-        """Update tracker and draw bounding box in a frame.
+    def track(self, dets: Optional[np.ndarray] = None) -> np.ndarray:
+        """Update tracker and counter without drawing anything.
 
         Args:
-            frame (np.ndarray): Target frame.
-            dets (np.ndarray): Array like [xyxy + score].
+            dets (Optional[np.ndarray]): Array like [xyxy + score].
+                                         If None, the detector was skipped for this frame:
+                                         tracks are only predicted and nothing is counted.
 
         Returns:
-            np.ndarray: Frame with bounding box and count.
+            np.ndarray: Tracks like [xyxy + id].
         """
         # Update Sort.
-        tracks = self.tracker.update(dets)
+        if dets is None:
+            tracks = self.tracker.predict()
+        else:
+            tracks = self.tracker.update(dets)
+        self.tracks = tracks
+
+        # Motion of each track as {id: (center, previous center)}, used by draw.
+        self.motions = {}
+        self.events = []
+        boxes = tracks[:, :4].astype(int)
+        ids = tracks[:, 4].astype(int)
+        # Center of the bounding boxes, truncated like int().
+        centers = (boxes[:, :2] + (boxes[:, 2:] - boxes[:, :2]) / 2).astype(int)
+        prev_boxes, has_prev = self.history.last(ids)
+        prev_centers = (prev_boxes[:, :2] + (prev_boxes[:, 2:] - prev_boxes[:, :2]) / 2).astype(int)
+
+        # Only positions on frames with detections are kept, counting compares two of them.
+        live_ids = self.tracker.live_ids()
+        if dets is not None:
+            self.history.append(ids, boxes, self.frame_index)
+            # Forget tracks deleted by Sort, their ids never come back.
+            self.history.evict(live_ids)
+        for index_id, center, center_prev in zip(ids[has_prev], centers[has_prev], prev_centers[has_prev]):
+            self.motions[int(index_id)] = (tuple(center.tolist()), tuple(center_prev.tolist()))
+
+        # Count only on frames with detections.
+        if dets is not None:
+            self.events = self.counting.update(self.frame_index, ids, centers, prev_centers, has_prev, live_ids)
+            if self.count_callback and self.events:
+                self.count_callback(self.counter)
+        self.frame_index += 1
+
+        return tracks
+
+    def draw(self, frame: np.ndarray) -> np.ndarray:
+        """Draw bounding boxes, motions, borders, zones and counter of the last track call in a frame.
 
-        boxes = []
-        index_ids = []
-        previous = self.memory.copy()
+        Args:
+            frame (np.ndarray): Target frame, drawn in place.
 
-        for track in tracks.astype(int):
-            boxes.append([track[0], track[1], track[2], track[3]])
-            index_ids.append(track[4])
-            # Add index id and box to memory.
-            self.memory[index_ids[-1]] = boxes[-1]
+        Returns:
+            np.ndarray: Frame with bounding box and count.
+        """
+        with self.metrics.timer("draw"):
+            return self._draw(frame)
 
-        if len(boxes) == 0:
+    def _draw(self, frame: np.ndarray) -> np.ndarray:
+        if len(self.tracks) == 0:
             return frame
 
-        for i, box in enumerate(boxes):
-            xmin, ymin, xmax, ymax = box
-
-            color = [int(c) for c in self.COLORS[index_ids[i] % len(self.COLORS)]]
+        for xmin, ymin, xmax, ymax, index_id in self.tracks.astype(int):
+            color = [int(c) for c in self.COLORS[index_id % len(self.COLORS)]]
             cv2.rectangle(frame, (xmin, ymin), (xmax, ymax), color, 2)
 
-            if index_ids[i] in previous:
-                previous_box = previous[index_ids[i]]
-                xmin2, ymin2, wmax2, ymax2 = previous_box
-
-                # Calculate the center of the bounding box.
-                center = (int(xmin + (xmax - xmin) / 2), int(ymin + (ymax - ymin) / 2))
-                center_prev = (int(xmin2 + (wmax2 - xmin2) / 2), int(ymin2 + (ymax2 - ymin2) / 2))
-
+            if index_id in self.motions:
                 # Draw a motion of bounding box.
+                center, center_prev = self.motions[index_id]
                 cv2.line(frame, center, center_prev, color, 3)
 
-                callback = False
-                for key in self.directions.keys():
-                    if self._is_count(center, center_prev, self.border, key):
-                        self.counter[key] += 1
-                        callback = True
-
-                # Execute callback.
-                if self.count_callback and callback:
-                    self.count_callback(self.counter)
-
             # Put ID on the box.
             cv2.putText(
                 frame,
-                str(index_ids[i]),
+                str(index_id),
                 (xmin, ymin - 5),
                 cv2.FONT_HERSHEY_SIMPLEX,
                 0.5,
@@ -124,8 +158,11 @@ class Tracker(object):
                 2,
             )
 
-        # Draw border.
-        cv2.line(frame, self.border[0], self.border[1], (10, 255, 0), 3)
+        # Draw borders and zones.
+        for line in self.counting.lines:
+            cv2.line(frame, line.start, line.end, (10, 255, 0), 3)
+        for zone in self.counting.zones:
+            cv2.polylines(frame, [zone.points.astype(np.int32)], True, (255, 160, 0), 3)
         # Put counter in the top left corner.
         for i, (key, count) in enumerate(self.counter.items()):
             cv2.putText(
@@ -138,3 +175,57 @@ class Tracker(object):
                 5,
             )
         return frame
+
+    def near_border(self, margin: float) -> bool:
+        """Return True if the center of a track is within `margin` pixels of a border or a zone edge."""
+        if len(self.tracks) == 0:
+            return False
+        centers = (self.tracks[:, :2] + self.tracks[:, 2:4]) / 2
+        segments = self.counting.segments()
+        start, segment = segments[:, 0], segments[:, 1] - segments[:, 0]
+        # Project centers on every segment and clip to its end points, like (N, S).
+        offset = centers[:, None, :] - start[None]
+        t = np.clip(np.sum(offset * segment, axis=2) / np.maximum(np.sum(segment * segment, axis=1), 1e-9), 0.0, 1.0)
+        distance = np.linalg.norm(offset - t[..., None] * segment, axis=2)
+        return bool(np.any(distance <= margin))
+
+
+class DetectionScheduler(object):
+    """Decide on which frames the detector runs.
+
+    On the other frames, Tracker.update is called with dets=None and tracks are only predicted.
+
+    Args:
+        tracker (Tracker): Tracker of the stream.
+        detect_every (int): Run the detector at least every N frames.
+        adaptive (bool): Also run the detector when a track is near the border or its position is uncertain.
+        border_margin (float): Distance in pixels to the border which triggers detection in adaptive mode.
+        max_position_std (float): Std of a track center in pixels which triggers detection in adaptive mode.
+    """
+
+    def __init__(
+        self,
+        tracker: Tracker,
+        detect_every: int = 1,
+        adaptive: bool = False,
+        border_margin: float = 50.0,
+        max_position_std: float = 20.0,
+    ):
+        if detect_every < 1:
+            raise ValueError("detect_every must be greater than 0.")
+        self.tracker = tracker
+        self.detect_every = detect_every
+        self.adaptive = adaptive
+        self.border_margin = border_margin
+        self.max_position_std = max_position_std
+        self.frames_since_detection = None
+
+    def should_detect(self) -> bool:
+        """Return True if the detector should run on the next frame."""
+        detect = self.frames_since_detection is None or self.frames_since_detection + 1 >= self.detect_every
+        if not detect and self.adaptive:
+            position_std = self.tracker.tracker.position_std()
+            detect = self.tracker.near_border(self.border_margin) or bool(np.any(position_std > self.max_position_std))
+
+        self.frames_since_detection = 0 if detect else self.frames_since_detection + 1
+        return detect
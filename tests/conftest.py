@@ -0,0 +1,5 @@
+import os
+import sys
+
+# Modules in src/ import each other as top level modules (e.g. `from sort import Sort`).
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
@@ -0,0 +1,32 @@
+import json
+
+import numpy as np
+
+from benchmarks.run import _main
+from benchmarks.stub import stub_detect
+from benchmarks.synthetic import crowd, frame, yolo_output
+from src.sort import iou_batch
+
+
+class TestBenchmarks:
+    def test_stub_detect(self):
+        """Check that Detect finds the people of a synthetic crowd on the stub interpreter."""
+        shape = (1080, 1920, 3)
+        dets = next(crowd(20, 1))
+        detect = stub_detect(classes=[0], iou_thr=0.45, outputs=[yolo_output(dets, shape)])
+        result = detect.detect_dets(frame(shape[1], shape[0]))
+        assert len(result) == len(dets)
+        # Every person is found once, up to the jitter of the anchors.
+        assert np.all(iou_batch(dets, result).max(axis=1) > 0.5)
+
+    def test_regression(self, tmp_path):
+        """Check that a run passes against its own results and fails against a faster baseline."""
+        output = tmp_path / "bench.json"
+        assert _main(str(output), None, 0.3, repeat=1, num_frames=2) == 0
+        report = json.loads(output.read_text())
+        assert "sort_update/200" in report["results"]
+
+        for result in report["results"].values():
+            result["median_ms"] /= 100
+        output.write_text(json.dumps(report))
+        assert _main(None, str(output), 0.3, repeat=1, num_frames=2) == 1
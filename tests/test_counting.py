@@ -0,0 +1,111 @@
+import json
+
+import numpy as np
+import pytest
+
+from src.counting import CountingEngine, Line, Zone, load_counting_config
+from src.tracker import Tracker
+from src.utils import check_direction, direction_config, is_intersect
+
+
+def _walk(num_frames, x=120, start_y=400, speed=10):
+    """Detections of a single person walking down."""
+    for i in range(num_frames):
+        y = start_y + speed * i
+        yield np.array([[x - 20, y - 50, x + 20, y + 50, 0.9]])
+
+
+class TestCountingEngine:
+    def test_same_as_utils(self):
+        """Check that crossings of random motions match utils.check_direction and utils.is_intersect."""
+        rng = np.random.default_rng(0)
+        directions = {key: direction_config[key] for key in ["right", "top", "leftbottom"]}
+        directions["total"] = None
+        lines = [Line(str(i), *rng.integers(0, 200, size=(2, 2)), directions) for i in range(5)]
+        engine = CountingEngine(lines)
+        centers, prev_centers = rng.integers(0, 200, size=(2, 500, 2))
+
+        crossed = engine.crossings(centers, prev_centers)
+        for m in range(len(centers)):
+            center, prev = tuple(centers[m].tolist()), tuple(prev_centers[m].tolist())
+            for r, (i, key) in enumerate(engine._rules):
+                expect = check_direction(center, prev, directions[key]) and is_intersect(
+                    center, prev, lines[i].start, lines[i].end
+                )
+                assert crossed[m, r] == expect
+        assert crossed.any()
+
+    def test_zone(self):
+        zone = Zone("zone", [(0, 0), (100, 0), (100, 100), (0, 100)])
+        engine = CountingEngine([], [zone])
+        no_prev = np.zeros(2, dtype=bool)
+        # Track 1 enters on frame 1 and leaves on frame 4, track 2 stays outside.
+        for frame_index, y in enumerate([-10, 10, 50, 90, 110]):
+            events = engine.update(frame_index, [1, 2], [(50, y), (200, y)], None, no_prev)
+            if y == 10:
+                assert [(e.kind, e.track_id) for e in events] == [("enter", 1)]
+        assert [(e.kind, e.track_id, e.dwell) for e in events] == [("exit", 1, 3)]
+        assert zone.counter == {"entered": 1, "exited": 1, "inside": 0}
+        assert zone.mean_dwell() == 3
+
+    def test_dwell_in_source_frames(self):
+        """Check that dwell counts frames of the source when only every 3rd frame is updated."""
+        zone = Zone("zone", [(0, 0), (100, 0), (100, 100), (0, 100)])
+        engine = CountingEngine([], [zone])
+        no_prev = np.zeros(1, dtype=bool)
+        engine.update(0, [1], [(50, 50)], None, no_prev)
+        engine.update(3, [1], [(50, 50)], None, no_prev)
+        events = engine.update(6, [1], [(150, 50)], None, no_prev)
+        assert [(e.kind, e.frame_index, e.dwell) for e in events] == [("exit", 6, 6)]
+
+    def test_zone_keeps_hidden_tracks(self):
+        """Check that an alive track missing from an update does not leave the zone."""
+        zone = Zone("zone", [(0, 0), (100, 0), (100, 100), (0, 100)])
+        engine = CountingEngine([], [zone])
+        engine.update(0, [1], [(50, 50)], None, np.zeros(1, dtype=bool))
+        engine.update(1, [], np.empty((0, 2)), None, np.zeros(0, dtype=bool), alive_ids=np.array([1]))
+        assert zone.counter == {"entered": 1, "exited": 0, "inside": 1}
+        engine.update(2, [], np.empty((0, 2)), None, np.zeros(0, dtype=bool), alive_ids=np.array([]))
+        assert zone.counter == {"entered": 1, "exited": 1, "inside": 0}
+
+
+class TestTrackerCounting:
+    def test_config(self, tmp_path):
+        config = {
+            "lines": [
+                {"name": "a", "points": [[0, 500], [1920, 500]], "directions": {"down": "bottom", "up": "top"}},
+                {"name": "b", "points": [[0, 600], [1920, 600]]},
+            ],
+            "zones": [{"name": "z", "points": [[0, 520], [300, 520], [300, 580], [0, 580]]}],
+        }
+        path = tmp_path / "counting.json"
+        path.write_text(json.dumps(config))
+        tracker = Tracker(counting=load_counting_config(str(path)))
+        frame = np.zeros((1080, 1920, 3), dtype=np.uint8)
+        for dets in _walk(30):
+            tracker.track(dets)
+        assert tracker.counter == {
+            "a:down": 1,
+            "a:up": 0,
+            "b:total": 1,
+            "z:entered": 1,
+            "z:exited": 1,
+            "z:inside": 0,
+        }
+        assert tracker.draw(frame).any()
+        assert tracker.near_border(100) and not tracker.near_border(50)
+
+    @pytest.mark.parametrize(
+        "config",
+        [
+            {"lines": [{"name": "a", "points": [[0, 500], [960, 400], [1920, 500]]}]},
+            {"lines": [{"name": "a", "points": [[0, 500]]}]},
+            {"zones": [{"name": "z", "points": [[0, 520], [300, 520]]}]},
+        ],
+    )
+    def test_invalid_config(self, tmp_path, config):
+        """Check that polylines and degenerate zones are rejected instead of silently changed."""
+        path = tmp_path / "counting.json"
+        path.write_text(json.dumps(config))
+        with pytest.raises(ValueError):
+            load_counting_config(str(path))
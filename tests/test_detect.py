@@ -1,7 +1,11 @@
+import cv2
 import numpy as np
 import pytest
 
+from benchmarks.stub import stub_detect
+from benchmarks.synthetic import crowd, yolo_output
 from src.detect import Detect
+from src.metrics import Metrics
 
 
 class TestDetect:
@@ -21,8 +25,161 @@ class TestDetect:
         assert result.shape == (1, self.detect.height, self.detect.width, 3)
         assert result.dtype == np.float32
 
+    def test_preprocess_uint8(self):
+        dummy_img = np.random.randint(0, 255, size=(300, 400, 3), dtype=np.uint8)
+        out = np.empty((1, self.detect.width, self.detect.height, 3), dtype=np.float32)
+        result = self.detect.preprocess(dummy_img, out=out)
+        assert result is out
+        expect = cv2.resize(dummy_img, (self.detect.height, self.detect.width))[:, :, ::-1] / 255.0
+        assert np.allclose(result[0], expect, atol=1e-6)
+
+    def test_preprocess_letterbox(self):
+        detect = Detect("./models/yolov5n6-fp16.tflite", conf_thr=0.4, letterbox=True)
+        dummy_img = np.random.randint(0, 255, size=(detect.width // 2, detect.height, 3), dtype=np.uint8)
+        result = detect.preprocess(dummy_img)
+        pad = detect.width // 4
+        # Top and bottom are padded, the frame is kept in the middle.
+        assert np.allclose(result[0, :pad], 114 / 255.0)
+        assert np.allclose(result[0, -pad:], 114 / 255.0)
+        assert np.allclose(result[0, pad:-pad], dummy_img[:, :, ::-1] / 255.0, atol=1e-6)
+
+    def test_postprocess_letterbox(self):
+        detect = Detect("./models/yolov5n6-fp16.tflite", conf_thr=0.4, letterbox=True)
+        # A box covering the whole frame which is placed in the middle half of the model input.
+        output_data = np.zeros((1, 1, 85), dtype=np.float32)
+        output_data[0, 0, :5] = [0.5, 0.5, 1.0, 0.5, 0.9]
+        boxes, _, _ = detect.postprocess(output_data, "xywh", (detect.width // 2, detect.height, 3))
+        assert np.allclose(boxes, [[0.5, 0.5, 1.0, 1.0]])
+
+    def test_postprocess_dets(self):
+        output_data = np.zeros((1, 4, 85), dtype=np.float32)
+        # Two overlapping persons, a dog (class 16) at the same place and a low score person.
+        output_data[0, 0, [0, 1, 2, 3, 4, 5]] = [0.5, 0.5, 0.2, 0.4, 0.9, 0.9]
+        output_data[0, 1, [0, 1, 2, 3, 4, 5]] = [0.51, 0.5, 0.2, 0.4, 0.8, 0.9]
+        output_data[0, 2, [0, 1, 2, 3, 4, 21]] = [0.5, 0.5, 0.2, 0.4, 0.9, 0.8]
+        output_data[0, 3, [0, 1, 2, 3, 4, 5]] = [0.1, 0.1, 0.1, 0.1, 0.9, 0.1]
+
+        detect = Detect("./models/yolov5n6-fp16.tflite", conf_thr=0.4, classes=[0], iou_thr=0.5)
+        dets = detect.postprocess_dets(output_data, (100, 200, 3))
+        assert np.allclose(dets, [[80, 30, 120, 70, 0.81, 0]])
+
+        # NMS is applied per class.
+        detect.classes = None
+        dets = detect.postprocess_dets(output_data, (100, 200, 3))
+        assert sorted(dets[:, 5]) == [0, 16]
+
     def test_to_xyxy(self):
         xywh = np.array([[100, 100, 200, 200]])
         expect = np.array([[0, 0, 200, 200]])
         result = self.detect.to_xyxy(xywh)
         assert (result == expect).all()
+
+    def test_detect_batch(self):
+        dummy_imgs = [np.random.randn(300, 300, 3), np.random.randn(200, 400, 3)]
+        results = self.detect.detect_batch(dummy_imgs)
+        assert len(results) == 2
+        for boxes, scores, class_idx in results:
+            assert boxes.shape[1] == 4
+            assert len(boxes) == len(scores) == len(class_idx)
+
+    def test_auto_tune(self):
+        """Check that auto-tune keeps the fastest thread count within the share of cores."""
+        detect = Detect("./models/yolov5n6-fp16.tflite", conf_thr=0.4, auto_tune=True, num_interpreters=2)
+        timings = detect.config["invoke_ms"]
+        assert max(timings) <= max(Detect.available_cores() // 2, 1)
+        assert timings[detect.config["num_threads"]] == min(timings.values())
+        assert detect.detect_dets(np.zeros((300, 400, 3), dtype=np.uint8)).shape[1] == 6
+
+    def test_interpreter_options(self):
+        detect = Detect("./models/yolov5n6-fp16.tflite", conf_thr=0.4, num_threads=2, xnnpack=False)
+        expect = {"num_threads": 2, "delegate": None, "xnnpack": False, "invoke_ms": None}
+        assert {key: detect.config[key] for key in expect} == expect
+        assert detect.detect_dets(np.zeros((300, 400, 3), dtype=np.uint8)).shape[1] == 6
+
+    def test_warmup(self):
+        """Check that load and warmup are timed separately, and that warmup can be skipped."""
+        metrics = Metrics()
+        detect = Detect("./models/yolov5n6-fp16.tflite", conf_thr=0.4, metrics=metrics)
+        assert detect.config["load_ms"] > 0 and detect.config["warmup_ms"] > 0
+        assert metrics.snapshot()["stages"]["load"]["count"] == 1
+        assert metrics.snapshot()["stages"]["warmup"]["count"] == 1
+        detect.warmup(batch_size=2)
+        assert detect.batch_size == 2
+
+        detect = Detect("./models/yolov5n6-fp16.tflite", conf_thr=0.4, warmup=0)
+        assert detect.config["warmup_ms"] is None
+
+
+class TestQuantizedDetect:
+    @pytest.mark.parametrize("quantization", ["uint8", "int8"])
+    def test_preprocess(self, quantization):
+        """Check that quantized input is the RGB frame shifted by the zero point."""
+        detect = stub_detect(quantization=quantization)
+        img = np.random.randint(0, 255, size=(300, 400, 3), dtype=np.uint8)
+        result = detect.preprocess(img)
+        assert result.dtype == np.dtype(quantization)
+        expect = cv2.resize(img, (detect.height, detect.width))[:, :, ::-1].astype(int)
+        zero_point = -128 if quantization == "int8" else 0
+        np.testing.assert_array_equal(result[0].astype(int), expect + zero_point)
+        # Float frames give the same input, up to the rounding of the resized pixels.
+        assert np.abs(detect.preprocess(img.astype(np.float32)).astype(int) - result).max() <= 1
+
+    @pytest.mark.parametrize("quantization", ["uint8", "int8"])
+    def test_detect_dets(self, quantization):
+        """Check that detections of a quantized output are the detections of the dequantized output."""
+        shape = (1080, 1920, 3)
+        img = np.zeros(shape, dtype=np.uint8)
+        output = yolo_output(next(crowd(30, 1)), shape)
+        detect = stub_detect(classes=[0], outputs=[output], quantization=quantization)
+        result = detect.detect_dets(img)
+
+        dequantized = detect._dequantize_output(detect.interpreter.get_tensor(detect.output_details[0]["index"]))
+        expect = stub_detect(classes=[0], outputs=[dequantized]).detect_dets(img)
+        assert len(result) > 20
+        np.testing.assert_allclose(result, expect, rtol=1e-5)
+
+
+def _single_box_output(box, crop_shape, score):
+    """YOLOv5 like output with a single person box in pixels of the crop."""
+    output = yolo_output(np.array([box]), crop_shape, duplicates=1)
+    output[0, output[0, :, 4] > 0.5, 4:6] = [score, 1.0]
+    return output
+
+
+class TestCrops:
+    def test_tiles(self):
+        detect = stub_detect(tile_size=640, tile_overlap=0.2)
+        crops = detect.crops((1080, 1920, 3))
+        assert len(crops) == 8
+        assert np.all(crops[:, 2:] - crops[:, :2] == 640)
+        covered = np.zeros((1080, 1920), dtype=bool)
+        for x1, y1, x2, y2 in crops:
+            covered[y1:y2, x1:x2] = True
+        assert covered.all()
+        # Neighbouring tiles overlap by at least 20% of the tile.
+        assert np.diff(np.unique(crops[:, 0])).max() <= 512
+
+    @pytest.mark.parametrize("tile_size, tile_overlap", [(0, 0.2), (-640, 0.2), (640, 1.0), (640, -0.1)])
+    def test_invalid_tiles(self, tile_size, tile_overlap):
+        with pytest.raises(ValueError):
+            stub_detect(tile_size=tile_size, tile_overlap=tile_overlap)
+
+    def test_region(self):
+        """Check that boxes of a region are shifted back to frame coordinates."""
+        output = _single_box_output([50, 60, 110, 260], (640, 640), 0.9)
+        detect = stub_detect(classes=[0], regions=[(100, 200, 740, 840)], outputs=[output])
+        result = detect.detect_dets(np.zeros((1080, 1920, 3), dtype=np.uint8))
+        assert len(result) == 1
+        np.testing.assert_allclose(result[0, :4], [150, 260, 210, 460], atol=8)
+
+    def test_merge_cut(self):
+        """Check that the part of a person cut by a tile edge is merged into the whole box of the other tile."""
+        # Tiles are x in [0, 640) and [512, 1152), the person at x in [600, 700) is cut by the first one.
+        outputs = [
+            _single_box_output([600, 100, 640, 300], (640, 640), 0.6),
+            _single_box_output([88, 100, 188, 300], (640, 640), 0.9),
+        ]
+        detect = stub_detect(classes=[0], tile_size=640, outputs=outputs, warmup=0)
+        result = detect.detect_dets_batch([np.zeros((640, 1152, 3), dtype=np.uint8)])[0]
+        assert len(result) == 1
+        np.testing.assert_allclose(result[0, :4], [600, 100, 700, 300], atol=8)
@@ -0,0 +1,107 @@
+import os
+
+import numpy as np
+
+from src.detection_cache import DetectionCache
+
+
+def _dets(num, seed):
+    rng = np.random.default_rng(seed)
+    xy = rng.integers(0, 1000, size=(num, 2))
+    boxes = np.concatenate([xy, xy + 50], axis=1)
+    scores = rng.uniform(0.2, 1.0, size=(num, 1)).astype(np.float32)
+    return np.concatenate([boxes, scores], axis=1)
+
+
+class TestDetectionCache:
+    def _files(self, tmp_path):
+        src, model = tmp_path / "video.mp4", tmp_path / "model.tflite"
+        src.write_bytes(os.urandom(1000))
+        model.write_bytes(os.urandom(100))
+        return str(src), str(model)
+
+    def test_roundtrip(self, tmp_path):
+        """Check that cached detections are the same as the stored ones."""
+        src, model = self._files(tmp_path)
+        cache = DetectionCache(str(tmp_path / "cache"))
+        key = cache.key(src, model, confidence=0.2)
+        assert cache.load(key) is None
+
+        writer = cache.writer(key)
+        expect = {i: _dets(i % 4, i) for i in range(0, 10, 2)}
+        for i, dets in expect.items():
+            writer.append(i, dets)
+        writer.commit(10)
+
+        cached = cache.load(key)
+        assert len(cached) == 10
+        assert not cached.complete()
+        for i in range(10):
+            assert cached.is_detected(i) == (i in expect)
+            if i in expect:
+                assert cached[i].dtype == expect[i].dtype
+                assert np.array_equal(cached[i], expect[i])
+        assert not cached.is_detected(10)
+
+    def test_complete(self, tmp_path):
+        """Check that only entries of runs which reached the end of the source are complete."""
+        src, model = self._files(tmp_path)
+        cache = DetectionCache(str(tmp_path / "cache"))
+        key = cache.key(src, model, confidence=0.2)
+        writer = cache.writer(key)
+        for i in range(5):
+            writer.append(i, _dets(2, i))
+        writer.commit(5, ended=False)
+        assert not cache.load(key).complete()
+        writer.commit(5)
+        assert cache.load(key).complete()
+
+    def test_extend(self, tmp_path):
+        """Check that a writer with a base keeps its detections and adds the missing frames."""
+        src, model = self._files(tmp_path)
+        cache = DetectionCache(str(tmp_path / "cache"))
+        key = cache.key(src, model, confidence=0.2)
+        writer = cache.writer(key)
+        for i in range(0, 6, 2):
+            writer.append(i, _dets(3, i))
+        writer.commit(6)
+
+        writer = cache.writer(key, base=cache.load(key))
+        assert writer.appended == 0
+        for i in range(1, 6, 2):
+            writer.append(i, _dets(1, i))
+        writer.commit(6)
+
+        cached = cache.load(key)
+        assert cached.complete()
+        for i in range(6):
+            assert np.array_equal(cached[i], _dets(3 if i % 2 == 0 else 1, i))
+
+    def test_key(self, tmp_path):
+        src, model = self._files(tmp_path)
+        cache = DetectionCache(str(tmp_path / "cache"))
+        key = cache.key(src, model, confidence=0.2)
+        assert key == cache.key(src, model, confidence=0.2)
+        assert key != cache.key(src, model, confidence=0.3)
+        with open(src, "ab") as f:
+            f.write(b"0")
+        assert key != cache.key(src, model, confidence=0.2)
+
+    def test_evict(self, tmp_path):
+        """Check that least recently used entries are evicted."""
+        src, model = self._files(tmp_path)
+        cache = DetectionCache(str(tmp_path / "cache"), max_bytes=1 << 40)
+        keys = [cache.key(src, model, confidence=c) for c in (0.1, 0.2, 0.3)]
+        for i, key in enumerate(keys[:2]):
+            writer = cache.writer(key)
+            writer.append(0, _dets(100, i))
+            writer.commit(1)
+            os.utime(os.path.join(cache.path(key), "meta.json"), (i, i))
+
+        cache.max_bytes = cache._size(keys[0]) * 2
+        writer = cache.writer(keys[2])
+        writer.append(0, _dets(100, 2))
+        writer.commit(1)
+        assert cache.load(keys[0]) is None
+        assert cache.load(keys[1]) is not None
+        assert cache.load(keys[2]) is not None
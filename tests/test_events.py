@@ -0,0 +1,110 @@
+import csv
+import json
+import socket
+import sqlite3
+
+import numpy as np
+import pytest
+
+from src.counting import CountEvent
+from src.events import FIELDS, EventSink, EventWriter, SocketSink, count_records, open_sink
+
+
+def _records():
+    events = [CountEvent("line", "a", "total", 3, 5), CountEvent("exit", "z", None, 9, 5, 12)]
+    tracks = np.array([[10.5, 20.0, 30.0, 40.0, 3.0]])
+    return count_records(events, tracks, frame_index=10, timestamp=1.5, stream="cam")
+
+
+class TestEvents:
+    def test_count_records(self):
+        line, exit = _records()
+        assert line == dict(
+            time=1.5,
+            stream="cam",
+            frame_index=10,
+            track_id=3,
+            kind="line",
+            name="a",
+            direction="total",
+            dwell=None,
+            x1=10,
+            y1=20,
+            x2=30,
+            y2=40,
+        )
+        # Track 9 is not in tracks anymore.
+        assert exit["dwell"] == 12 and exit["x1"] is None
+
+    @pytest.mark.parametrize("name", ["events.jsonl", "events.csv", "events.db"])
+    def test_file_sinks(self, tmp_path, name):
+        path = str(tmp_path / name)
+        writer = EventWriter([open_sink(path)], flush_interval=60).start()
+        writer.emit(_records())
+        writer.emit(_records())
+        writer.close()
+        assert writer.written == 4
+
+        if name.endswith(".jsonl"):
+            with open(path) as f:
+                rows = [json.loads(line) for line in f]
+            assert rows[0] == _records()[0]
+        elif name.endswith(".csv"):
+            with open(path) as f:
+                rows = list(csv.DictReader(f))
+            assert rows[0]["name"] == "a" and rows[0]["x2"] == "30"
+        else:
+            with sqlite3.connect(path) as connection:
+                rows = connection.execute(f"SELECT {', '.join(FIELDS)} FROM events").fetchall()
+            assert rows[1] == tuple(_records()[1][field] for field in FIELDS)
+        assert len(rows) == 4
+
+    def test_batch(self, tmp_path):
+        """Check that a full batch is written without waiting for the interval."""
+        path = str(tmp_path / "events.jsonl")
+        writer = EventWriter([open_sink(path)], batch_size=2, flush_interval=60).start()
+        writer.emit(_records())
+        writer._stop.set()
+        writer.thread.join(timeout=5)
+        assert writer.written == 2
+        writer.close()
+
+    def test_failing_sink(self, tmp_path):
+        """Check that a failing sink neither stops the thread nor the other sinks."""
+
+        class FailingSink(EventSink):
+            def write(self, records):
+                raise OSError("disk full")
+
+        path = str(tmp_path / "events.jsonl")
+        writer = EventWriter([FailingSink(), open_sink(path)], batch_size=2, flush_interval=60).start()
+        for _ in range(3):
+            writer.emit(_records())
+            writer.flush()
+        assert writer.thread.is_alive()
+        writer.close()
+        assert writer.failures == 3 and isinstance(writer.error, OSError)
+        with open(path) as f:
+            assert len(f.readlines()) == 6
+
+    def test_max_buffer(self):
+        """Check that the oldest records are dropped when the buffer is full."""
+        writer = EventWriter([], max_buffer=3)
+        writer.emit(_records())
+        writer.emit(_records())
+        assert writer.dropped == 1
+        assert writer._buffer == _records()[1:] + _records()
+
+    def test_udp(self):
+        server = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        server.bind(("127.0.0.1", 0))
+        server.settimeout(5)
+        sink = SocketSink(f"udp://127.0.0.1:{server.getsockname()[1]}")
+        sink.write(_records())
+        assert json.loads(server.recv(65536)) == _records()[0]
+        sink.close()
+        server.close()
+
+    def test_unknown_sink(self):
+        with pytest.raises(ValueError):
+            open_sink("events.txt")
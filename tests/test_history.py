@@ -0,0 +1,47 @@
+import numpy as np
+
+from src.history import TrackHistory
+from src.tracker import Tracker
+
+
+class TestTrackHistory:
+    def test_ring(self):
+        history = TrackHistory(length=4, capacity=1)
+        for i in range(10):
+            history.append([7, 3], [[i, 0, i + 2, 2], [0, i, 2, i + 2]], frame_index=2 * i)
+        assert history.capacity == 2
+
+        boxes, found = history.last([3, 7, 5])
+        assert found.tolist() == [True, True, False]
+        assert boxes[:2].tolist() == [[0, 9, 2, 11], [9, 0, 11, 2]]
+        # Only the last 4 positions are kept.
+        np.testing.assert_array_equal(history.trajectory(7), [[12, 7, 1], [14, 8, 1], [16, 9, 1], [18, 10, 1]])
+        np.testing.assert_array_equal(history.trajectory(7, n=2), [[16, 9, 1], [18, 10, 1]])
+        assert history.trajectory(5).shape == (0, 3)
+        # One pixel every 2 frames.
+        np.testing.assert_allclose(history.speed([7, 3], n=4), [0.5, 0.5])
+        assert np.isnan(history.speed([5])).all()
+
+    def test_evict(self):
+        history = TrackHistory(length=4, capacity=2)
+        history.append([1, 2], np.zeros((2, 4)), frame_index=0)
+        history.evict(np.array([2]))
+        assert len(history) == 1
+        # The slot of track 1 is reused without its old positions.
+        history.append([3], np.ones((1, 4)), frame_index=1)
+        assert history.capacity == 2
+        assert history.trajectory(3).shape == (1, 3)
+        assert not history.last([1])[1].any()
+
+
+class TestTrackerHistory:
+    def test_bounded(self):
+        """Check that the history only holds live tracks on a long stream of short tracks."""
+        tracker = Tracker([(0, 500), (1920, 500)], {"total": None})
+        for i in range(500):
+            # A new person every 20 frames, each one walks for 10 frames.
+            y = 400 + 10 * (i % 20)
+            dets = np.array([[100, y - 50, 140, y + 50, 0.9]]) if i % 20 < 10 else np.empty((0, 5))
+            tracker.track(dets)
+        assert len(tracker.history) <= 1
+        assert tracker.history.capacity == 64
@@ -0,0 +1,45 @@
+from unittest import mock
+
+import cv2
+import numpy as np
+import pytest
+
+import detect as detect_module
+from benchmarks.stub import StubInterpreter
+from src.main import main
+
+
+class TestMain:
+    @pytest.mark.parametrize("num_frames", [36, 40])
+    def test_batch_detect_every(self, tmp_path, num_frames):
+        """Check that detecting every 3rd frame in batches of 4 never resizes the input of the interpreter."""
+        path = str(tmp_path / "video.avi")
+        writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*"MJPG"), 30, (320, 240))
+        for i in range(num_frames):
+            writer.write(np.full((240, 320, 3), i, dtype=np.uint8))
+        writer.release()
+
+        interpreters = []
+
+        def factory(model_file, *args, **kwargs):
+            interpreter = StubInterpreter(model_file, input_size=320, num_anchors=100)
+            interpreter.allocate_tensors = mock.Mock(wraps=interpreter.allocate_tensors)
+            interpreters.append(interpreter)
+            return interpreter
+
+        with mock.patch.object(detect_module, "Interpreter", new=factory):
+            main(
+                path,
+                str(tmp_path / "out"),
+                "stub.tflite",
+                "mp4",
+                0.2,
+                0.2,
+                {"total": None},
+                batch_size=4,
+                detect_every=3,
+                headless=True,
+            )
+        # Allocated when loaded, then once more when the warmup resizes the input to the batch size.
+        assert len(interpreters) == 1
+        assert interpreters[0].allocate_tensors.call_count == 2
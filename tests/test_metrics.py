@@ -0,0 +1,78 @@
+import io
+import json
+import urllib.request
+
+from src.metrics import Metrics, MetricsLogger, MetricsServer, NullMetrics, to_prometheus
+
+
+class TestMetrics:
+    def test_snapshot(self):
+        metrics = Metrics(stream="cam")
+        for i in range(1, 101):
+            metrics.observe("invoke", i / 1000)
+        with metrics.timer("draw"):
+            pass
+        metrics.inc("dropped_frames", 2)
+        metrics.set_gauge("queue_depth", 3, queue="detect")
+        snapshot = metrics.snapshot()
+        assert abs(snapshot["stages"]["invoke"]["p50"] - 50.5) < 1e-6
+        assert 95 <= snapshot["stages"]["invoke"]["p95"] <= 96
+        assert snapshot["stages"]["invoke"]["count"] == 100
+        assert snapshot["stages"]["draw"]["count"] == 1
+        assert snapshot["counters"] == {"dropped_frames": 2}
+        assert snapshot["gauges"] == {"queue_depth[detect]": 3}
+        json.dumps(snapshot)
+
+    def test_window(self):
+        metrics = Metrics(window=10)
+        for i in range(100):
+            metrics.observe("invoke", i)
+        snapshot = metrics.snapshot()["stages"]["invoke"]
+        # Quantiles only cover the last samples, count covers all of them.
+        assert snapshot["p50"] >= 90 * 1000
+        assert snapshot["count"] == 100
+
+    def test_prometheus(self):
+        streams = [Metrics(stream="a"), Metrics(stream="b")]
+        for metrics in streams:
+            metrics.observe("invoke", 0.01)
+            metrics.mark_frame()
+        text = to_prometheus(streams)
+        lines = text.splitlines()
+        # Lines of a family are grouped under a single TYPE line.
+        assert lines.count("# TYPE tracking_stage_seconds summary") == 1
+        stage_lines = [i for i, line in enumerate(lines) if line.startswith("tracking_stage_seconds")]
+        assert stage_lines == list(range(stage_lines[0], stage_lines[0] + len(stage_lines)))
+        assert 'tracking_stage_seconds_count{stream="b",stage="invoke"} 1' in lines
+        assert 'tracking_frames_total{stream="a"} 1' in lines
+
+    def test_null_metrics(self):
+        metrics = NullMetrics()
+        with metrics.timer("invoke"):
+            metrics.inc("frames")
+
+
+class TestMetricsServer:
+    def test_serve(self):
+        metrics = Metrics(stream="cam")
+        metrics.observe("invoke", 0.01)
+        server = MetricsServer(lambda: [metrics], port=0).start()
+        try:
+            with urllib.request.urlopen(f"http://127.0.0.1:{server.port}/metrics") as res:
+                assert 'stage="invoke"' in res.read().decode()
+            with urllib.request.urlopen(f"http://127.0.0.1:{server.port}/metrics.json") as res:
+                assert json.loads(res.read())[0]["stream"] == "cam"
+        finally:
+            server.stop()
+
+
+class TestMetricsLogger:
+    def test_log(self):
+        metrics = Metrics(stream="cam")
+        output = io.StringIO()
+        logger = MetricsLogger(lambda: [metrics], output, interval=0.01).start()
+        metrics.observe("invoke", 0.01)
+        logger.stop()
+        lines = output.getvalue().splitlines()
+        assert len(lines) >= 1
+        assert json.loads(lines[-1])["streams"][0]["stages"]["invoke"]["count"] == 1
@@ -0,0 +1,93 @@
+import time
+
+import numpy as np
+
+from src.multistream import MultiStreamRunner
+from src.streams import BaseStream
+from src.tracker import Tracker
+
+
+class _ListStream(BaseStream):
+    def __init__(self, frames, delay=0.0):
+        self.frames = list(frames)
+        self.delay = delay
+
+    def next(self):
+        time.sleep(self.delay)
+        if not self.frames:
+            return False, None
+        return True, self.frames.pop(0)
+
+    def release(self):
+        pass
+
+
+class _StubDetect:
+    """Return one person box, which moves with the frame value."""
+
+    def __init__(self, delay=0.0):
+        self.delay = delay
+
+    def detect_dets(self, frame):
+        time.sleep(self.delay)
+        x = float(frame[0, 0, 0])
+        return np.array([[x, 10, x + 20, 50, 0.9, 0]])
+
+
+def _frames(n):
+    return [np.full((100, 200, 3), i * 5, dtype=np.uint8) for i in range(n)]
+
+
+class TestMultiStreamRunner:
+    def test_in_order(self):
+        """Check that every frame of every stream is tracked in order without dropping."""
+        seen = {}
+
+        def callback(name, index, frame):
+            seen.setdefault(name, []).append(index)
+
+        streams = {f"cam{i}": _ListStream(_frames(20)) for i in range(3)}
+        runner = MultiStreamRunner(
+            streams,
+            [_StubDetect(), _StubDetect()],
+            lambda: Tracker([(0, 30), (200, 30)], {"total": None}),
+            max_pending=2,
+            drop_oldest=False,
+            frame_callback=callback,
+        )
+        runner.run()
+        assert seen == {f"cam{i}": list(range(20)) for i in range(3)}
+        for stats in runner.stats().values():
+            assert stats["processed"] == 20 and stats["dropped"] == 0
+
+    def test_drop_oldest(self):
+        """Check that a stream which falls behind drops frames and keeps the latest one."""
+        seen = []
+        runner = MultiStreamRunner(
+            {"cam": _ListStream(_frames(30))},
+            [_StubDetect(delay=0.01)],
+            lambda: Tracker([(0, 30), (200, 30)], {"total": None}),
+            max_pending=2,
+            frame_callback=lambda name, index, frame: seen.append(index),
+        )
+        runner.run()
+        stats = runner.stats()["cam"]
+        assert stats["dropped"] > 0
+        assert stats["processed"] + stats["dropped"] == 30
+        assert seen == sorted(seen) and seen[-1] == 29
+
+    def test_fairness(self):
+        """Check that a fast stream does not starve a slow stream."""
+        seen = []
+        streams = {"fast": _ListStream(_frames(50)), "slow": _ListStream(_frames(5), delay=0.005)}
+        runner = MultiStreamRunner(
+            streams,
+            [_StubDetect(delay=0.002)],
+            lambda: Tracker([(0, 30), (200, 30)], {"total": None}),
+            max_pending=50,
+            frame_callback=lambda name, index, frame: seen.append(name),
+        )
+        runner.run()
+        assert seen.count("slow") == 5
+        # Slow frames are interleaved instead of waiting for the fast stream to finish.
+        assert seen.index("slow") < seen.index("fast") + 10
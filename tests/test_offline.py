@@ -0,0 +1,44 @@
+import cv2
+import numpy as np
+
+from src.offline import detect_chunks
+from src.streams import VideoStream
+from src.tracker import Tracker
+
+
+class _FrameDetect:
+    """Detect a person whose vertical position is given by the pixel values of the frame."""
+
+    def detect_dets(self, frame):
+        y = float(frame[0, 0, 0]) * 4
+        return np.array([[900, y - 50, 960, y + 50, 0.9, 0], [100, 100, 160, 200, 0.8, 0]])
+
+
+class TestOffline:
+    def test_same_as_serial(self, tmp_path):
+        """Check that detections and counts of chunks processed in parallel are the same as serial processing."""
+        path = str(tmp_path / "video.avi")
+        writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*"MJPG"), 30, (1920, 1080))
+        for i in range(30):
+            writer.write(np.full((1080, 1920, 3), 8 * i, dtype=np.uint8))
+        writer.release()
+
+        detect = _FrameDetect()
+        stream = VideoStream(path)
+        expect = Tracker([(0, 500), (1920, 500)], {"total": None})
+        expect_dets = []
+        while True:
+            is_finish, frame = stream.next()
+            if not is_finish:
+                break
+            expect_dets.append(detect.detect_dets(frame)[:, :5])
+            expect.track(expect_dets[-1])
+
+        result = Tracker([(0, 500), (1920, 500)], {"total": None})
+        result_dets = list(detect_chunks(path, _FrameDetect, workers=2, chunk_frames=7))
+        for dets in result_dets:
+            result.track(dets)
+
+        assert len(result_dets) == 30
+        assert all(np.array_equal(e, r) for e, r in zip(expect_dets, result_dets))
+        assert expect.counter == result.counter == {"total": 1}
@@ -0,0 +1,50 @@
+import random
+import time
+
+import pytest
+
+from src.pipeline import Pipeline, run_serial
+
+
+def _jitter(x):
+    time.sleep(random.random() * 0.002)
+    return x
+
+
+class TestPipeline:
+    def test_same_as_serial(self):
+        """Check that the output order is the same as serial execution."""
+        stages = [lambda x: x * 2, _jitter, lambda x: x + 1]
+        expect, result = [], []
+        run_serial(range(100), stages, expect.append)
+        Pipeline(range(100), stages, result.append, queue_depth=2).run()
+        assert result == expect
+
+    def test_backpressure(self):
+        """Check that queues never hold more items than queue_depth."""
+        result = []
+        pipeline = Pipeline(range(50), [lambda x: x], lambda x: (time.sleep(0.001), result.append(x)), queue_depth=3)
+
+        def source():
+            for i in range(50):
+                assert all(size <= 3 for size in pipeline.qsizes())
+                yield i
+
+        pipeline.source = source()
+        pipeline.run()
+        assert result == list(range(50))
+
+    def test_raise(self):
+        """Check that an exception in a stage is raised from run."""
+
+        def fail(x):
+            if x == 10:
+                raise RuntimeError("stage failed")
+            return x
+
+        with pytest.raises(RuntimeError):
+            Pipeline(range(100), [fail], lambda x: None, queue_depth=1).run()
+
+    def test_invalid_queue_depth(self):
+        with pytest.raises(ValueError):
+            Pipeline([], [], lambda x: None, queue_depth=0)
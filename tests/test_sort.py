@@ -0,0 +1,73 @@
+import numpy as np
+
+from src.sort import BatchKalmanBoxTracker, KalmanBoxTracker, Sort, associate_detections_to_trackers, iou, iou_batch
+
+
+class TestIouBatch:
+    def test_same_as_iou(self):
+        """Check that every element is the same as iou of the pair."""
+        rng = np.random.default_rng(0)
+        xy = rng.uniform(0, 100, size=(20, 2))
+        boxes = np.concatenate([xy, xy + rng.uniform(5, 50, size=(20, 2))], axis=1)
+        result = iou_batch(boxes[:8], boxes)
+        assert result.shape == (8, 20)
+        for d in range(8):
+            for t in range(20):
+                assert np.isclose(result[d, t], iou(boxes[d], boxes[t]))
+
+
+class TestAssociateDetectionsToTrackers:
+    def test_associate(self):
+        dets = np.array([[0, 0, 10, 10, 0.9], [100, 100, 110, 110, 0.9], [50, 50, 60, 60, 0.9]])
+        trks = np.array([[101, 101, 111, 111], [200, 200, 210, 210], [1, 1, 11, 11]])
+        matches, unmatched_dets, unmatched_trks = associate_detections_to_trackers(dets, trks)
+        assert sorted(map(tuple, matches)) == [(0, 2), (1, 0)]
+        assert list(unmatched_dets) == [2]
+        assert list(unmatched_trks) == [1]
+
+    def test_empty(self):
+        matches, unmatched_dets, _ = associate_detections_to_trackers(np.empty((0, 5)), np.empty((0, 4)))
+        assert len(matches) == 0 and len(unmatched_dets) == 0
+        matches, unmatched_dets, _ = associate_detections_to_trackers(np.ones((2, 5)), np.empty((0, 4)))
+        assert len(matches) == 0 and list(unmatched_dets) == [0, 1]
+
+
+class TestBatchKalmanBoxTracker:
+    def test_same_as_kalman_box_tracker(self):
+        """Check that predict/update give the same states as per track KalmanBoxTracker."""
+        boxes = np.array([[0, 0, 10, 20], [50, 50, 80, 120], [100, 10, 110, 40]], dtype=float)
+        batch = BatchKalmanBoxTracker(capacity=2)
+        slots = batch.add(boxes)
+        trackers = [KalmanBoxTracker(box) for box in boxes]
+        for step in range(5):
+            result = batch.predict(slots)
+            expect = np.concatenate([trk.predict() for trk in trackers])
+            assert np.allclose(result, expect)
+            # Update only the first two tracks.
+            observed = boxes[:2] + step * 3
+            batch.update(slots[:2], observed)
+            for trk, box in zip(trackers[:2], observed):
+                trk.update(box)
+            assert np.allclose(batch.get_state(slots), np.concatenate([trk.get_state() for trk in trackers]))
+        assert list(batch.time_since_update[slots]) == [trk.time_since_update for trk in trackers]
+        assert list(batch.hit_streak[slots]) == [trk.hit_streak for trk in trackers]
+
+    def test_reuse_slot(self):
+        batch = BatchKalmanBoxTracker(capacity=2)
+        slots = batch.add(np.array([[0, 0, 10, 10], [0, 0, 20, 20]], dtype=float))
+        batch.remove(slots[:1])
+        new_slot = batch.add(np.array([[0, 0, 30, 30]], dtype=float))
+        assert new_slot[0] == slots[0]
+        # Alive tracks are ordered by creation.
+        assert list(batch.live_slots()) == [slots[1], new_slot[0]]
+
+
+class TestSort:
+    def test_empty_detections(self):
+        """Check that a frame without detections keeps tracks alive until max_age."""
+        sort = Sort(max_age=1, min_hits=1)
+        sort.update(np.array([[0, 0, 10, 10, 0.9]]))
+        assert len(sort.update(np.empty((0, 5)))) == 0
+        assert len(sort.trackers.live_slots()) == 1
+        sort.update(np.empty((0, 5)))
+        assert len(sort.trackers.live_slots()) == 0
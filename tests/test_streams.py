@@ -0,0 +1,166 @@
+import time
+
+import cv2
+import numpy as np
+import pytest
+
+from data import video2img
+from src.archive import EXTENSION, FrameArchiveWriter
+from src.streams import ImageFileStream, LiveStream, PackedFrameStream, VideoStream
+
+
+@pytest.fixture
+def video(tmp_path):
+    """Write a short video where the pixel values of frame i are 10 * i."""
+    path = str(tmp_path / "video.avi")
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*"MJPG"), 30, (64, 48))
+    for i in range(20):
+        writer.write(np.full((48, 64, 3), 10 * i, dtype=np.uint8))
+    writer.release()
+    return path
+
+
+def _read_all(stream, copy=True):
+    frames = []
+    while True:
+        is_finish, frame = stream.next()
+        if not is_finish:
+            break
+        frames.append(frame.copy() if copy else frame)
+    stream.release()
+    return frames
+
+
+class TestVideoStream:
+    def test_buffered_same_as_sync(self, video):
+        """Check that background decode returns the same frames as decode in next."""
+        expect = _read_all(VideoStream(video))
+        result = _read_all(VideoStream(video, buffer_size=4))
+        assert len(result) == 20
+        assert all(np.array_equal(e, r) for e, r in zip(expect, result))
+
+    def test_hold(self, video):
+        """Check that the last `hold` frames are not overwritten by the decode thread."""
+        stream = VideoStream(video, buffer_size=2, hold=3)
+        frames = []
+        for i in range(20):
+            frames.append(stream.next()[1])
+            # Let the decode thread fill every free buffer.
+            time.sleep(0.005)
+            assert [int(np.round(f.mean() / 10)) for f in frames[-3:]] == list(range(max(i - 2, 0), i + 1))
+        stream.release()
+        # Frames are decoded into the 5 buffers of the ring.
+        assert len({id(f) for f in frames}) == 5
+
+    def test_stride_and_scale(self, video):
+        for buffer_size in [0, 4]:
+            stream = VideoStream(video, buffer_size=buffer_size, stride=3, scale=0.5)
+            assert len(stream) == 7
+            frames = _read_all(stream)
+            assert len(frames) == 7
+            assert frames[0].shape == (24, 32, 3)
+            assert [int(np.round(f.mean() / 10)) for f in frames] == list(range(0, 20, 3))
+
+    def test_release_while_decoding(self, video):
+        stream = VideoStream(video, buffer_size=1)
+        stream.next()
+        stream.release()
+        assert not stream._thread.is_alive()
+
+
+class TestLiveStream:
+    def test_latest_frame(self, video):
+        """Check that a slow consumer of a 30 FPS stream gets the latest frames and skips the others."""
+        stream = LiveStream(video, realtime=True, reconnect=False)
+        indices, timestamps = [], []
+        while True:
+            is_finish, frame = stream.next()
+            if not is_finish:
+                break
+            assert int(np.round(frame.mean() / 10)) == stream.frame_index
+            indices.append(stream.frame_index)
+            timestamps.append(stream.timestamp)
+            time.sleep(0.1)
+        stream.release()
+        assert indices == sorted(set(indices)) and len(indices) < 15
+        assert stream.dropped == 20 - len(indices)
+        assert timestamps == sorted(timestamps)
+
+    def test_reconnect(self, video):
+        """Check that the end of the source is handled like a camera failure."""
+        stream = LiveStream(video, backoff=0.01)
+        while stream.frame_index < 30:
+            assert stream.next()[0]
+        stream.release()
+        assert stream.reconnects >= 1
+
+    def test_give_up(self, tmp_path):
+        stream = LiveStream(str(tmp_path / "missing.avi"), max_retries=2, backoff=0.01)
+        assert stream.next() == (False, None)
+        assert stream.reconnects == 2
+
+
+@pytest.fixture
+def frames_dir(tmp_path):
+    """Write 12 jpg frames and a frame archive of the same frames."""
+    frames_dir = tmp_path / "frames"
+    frames_dir.mkdir()
+    rng = np.random.default_rng(0)
+    with FrameArchiveWriter(str(tmp_path / f"frames{EXTENSION}")) as writer:
+        for i in range(12):
+            frame = np.repeat(rng.integers(0, 255, size=(12, 16, 3), dtype=np.uint8), 8, axis=0).repeat(8, axis=1)
+            cv2.imwrite(str(frames_dir / f"frame{str(i).zfill(5)}.jpg"), frame)
+            writer.write(cv2.imencode(".jpg", frame)[1].tobytes())
+    return frames_dir
+
+
+class TestImageFileStream:
+    def test_prefetch_same_as_sync(self, frames_dir):
+        expect = _read_all(ImageFileStream(str(frames_dir)))
+        assert len(expect) == 12
+        result = _read_all(ImageFileStream(str(frames_dir), prefetch=4, workers=3))
+        assert all(np.array_equal(e, r) for e, r in zip(expect, result))
+
+    def test_archive(self, frames_dir):
+        """Check that frames of an archive are the same as frames of the jpg files."""
+        expect = _read_all(ImageFileStream(str(frames_dir)))
+        stream = ImageFileStream(str(frames_dir) + EXTENSION, prefetch=2)
+        assert len(stream) == 12
+        result = _read_all(stream)
+        assert len(result) == 12
+        assert all(np.array_equal(e, r) for e, r in zip(expect, result))
+
+    def test_reduce(self, frames_dir):
+        frames = _read_all(ImageFileStream(str(frames_dir) + EXTENSION, reduce=4))
+        assert frames[0].shape == (24, 32, 3)
+
+
+class TestPackedFrameStream:
+    @pytest.mark.parametrize("fmt", ["archive", "npy"])
+    def test_video2img(self, video, tmp_path, fmt):
+        """Check that frames packed by video2img are the frames of the video."""
+        save_dir = str(tmp_path / "frames")
+        video2img._main(video, save_dir, 0, fmt, None)
+        stream = PackedFrameStream(save_dir + (EXTENSION if fmt == "archive" else ".npy"))
+        assert len(stream) == 20
+        # Random access.
+        assert int(np.round(stream[7].mean() / 10)) == 7
+        stream.seek(15)
+        frames = _read_all(stream)
+        assert [int(np.round(f.mean() / 10)) for f in frames] == list(range(15, 20))
+
+    def test_npy_copy_on_write(self, tmp_path):
+        """Check that the npy file is shrunk to the written frames and drawing does not change it."""
+        path = str(tmp_path / "frames.npy")
+        writer = video2img._NpyWriter(path, capacity=10)
+        for i in range(4):
+            writer.write(np.full((48, 64, 3), i, dtype=np.uint8))
+        writer.close()
+
+        stream = PackedFrameStream(path)
+        assert len(stream) == 4
+        _, frame = stream.next()
+        frame[:] = 255
+        stream.release()
+        assert np.load(path).shape == (4, 48, 64, 3)
+        assert np.load(path)[0].max() == 0
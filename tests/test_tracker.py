@@ -0,0 +1,62 @@
+import numpy as np
+
+from src.tracker import DetectionScheduler, Tracker
+
+
+def _walk(num_frames, start_y=400, speed=10):
+    """Detections of a single person walking down across y=500."""
+    for i in range(num_frames):
+        y = start_y + speed * i
+        yield np.array([[100, y - 50, 140, y + 50, 0.9]])
+
+
+class TestTracker:
+    def test_count(self):
+        tracker = Tracker([(0, 500), (1920, 500)], {"total": None})
+        for dets in _walk(20):
+            tracker.update(np.zeros((1080, 1920, 3), dtype=np.uint8), dets)
+        assert tracker.counter["total"] == 1
+
+    def test_track_without_drawing(self):
+        """Check that track counts without touching the frame and draw renders the last tracks."""
+        tracker = Tracker([(0, 500), (1920, 500)], {"total": None})
+        frame = np.zeros((1080, 1920, 3), dtype=np.uint8)
+        for dets in _walk(20):
+            tracker.track(dets)
+        assert tracker.counter["total"] == 1
+        assert not frame.any()
+        assert tracker.draw(frame).any()
+
+    def test_count_with_skipped_frames(self):
+        """Check that predicting tracks on skipped frames keeps the count."""
+        tracker = Tracker([(0, 500), (1920, 500)], {"total": None, "bottom": (None, False), "top": (None, True)})
+        scheduler = DetectionScheduler(tracker, detect_every=3)
+        detected = 0
+        for dets in _walk(30):
+            if scheduler.should_detect():
+                detected += 1
+            else:
+                dets = None
+            tracker.update(np.zeros((1080, 1920, 3), dtype=np.uint8), dets)
+            if dets is None:
+                # Tracks are still reported on skipped frames.
+                assert len(tracker.tracks) == 1
+            # Events are indexed by frames of the source, not by detected frames.
+            assert all(event.frame_index == tracker.frame_index - 1 for event in tracker.events)
+        assert detected == 10
+        assert tracker.counter == {"total": 1, "bottom": 1, "top": 0}
+
+
+class TestDetectionScheduler:
+    def test_adaptive(self):
+        tracker = Tracker([(0, 500), (1920, 500)], {"total": None})
+        scheduler = DetectionScheduler(tracker, detect_every=100, adaptive=True, border_margin=50)
+        frame = np.zeros((1080, 1920, 3), dtype=np.uint8)
+        # Let the track converge far from the border.
+        for _ in range(10):
+            scheduler.should_detect()
+            tracker.update(frame, np.array([[100, 100, 140, 200, 0.9]]))
+        assert not scheduler.should_detect()
+        # A track close to the border always triggers detection.
+        tracker.tracks = np.array([[100, 430, 140, 530, 1]])
+        assert scheduler.should_detect()